@@ -1,17 +1,30 @@
+import os
 import json
-from config import client, logger
-from utils import encode_image
-
+import time
+import asyncio
+from collections import Counter
+from functools import lru_cache
 
-def get_system_prompt(user_id, username, categorias_dinamicas):
-    return f"""
+from config import client, logger
+from ai_scheduler import ai_scheduler, DeadlineExceeded
+from audio import transcribe_voice
+from cache import ResponseCache
+from db import PostgresResponseCacheBackend
+from metrics import stage_seconds, errors_total
+from utils import prepare_image, normalize_text
+
+
+# Prefijo estático: idéntico byte a byte en todas las llamadas para aprovechar el
+# cache de prompts del proveedor. Todo lo que depende del usuario o de la petición
+# va después, en get_user_prompt_section() y en el sufijo de process_with_ai().
+STATIC_SYSTEM_PROMPT = """
 Eres "Jarvis", un clasificador de base de datos ultra-rígido.
 Tu único trabajo es mapear el input del usuario a su lista oficial de proyectos.
 
 🚨 REGLA DE ORO (PENALIZACIÓN SI SE INCUMPLE) 🚨
 ESTÁ ESTRICTAMENTE PROHIBIDO inventar, resumir o modificar los nombres. NO PUEDES usar palabras como "Construcción", "Ingeniería", "Proyecto Barandas", etc., a menos que estén literalmente en la lista.
 
-{categorias_dinamicas}
+La LISTA DE OPCIONES VÁLIDAS del usuario está en la sección USUARIO al final de estas instrucciones.
 
 🧠 INSTRUCCIONES DE MAPEO INTELIGENTE:
 - Analiza el mensaje (ej. "box003", "barandas", "floculantes").
@@ -26,6 +39,7 @@ NIVEL 3: TIPO (Campo `tipo_entrada`)
    - Solo usar: 'Open' o 'Closed'.
 
 ### TABLAS DISPONIBLES:
+(<USER_ID> es el valor indicado en la sección USUARIO.)
 
 1. agenda_personal — registros de tareas, notas, recordatorios del usuario.
    Columnas: id, telegram_user_id, username, categoria, subcategoria, tipo_entrada, resumen, contenido_completo, fecha_evento, datos_extra, estado, fecha_creacion.
@@ -33,73 +47,191 @@ NIVEL 3: TIPO (Campo `tipo_entrada`)
 2. categorias_agenda — lista oficial de categorías y subcategorías del usuario.
    Columnas: telegram_user_id, categoria, subcategoria, estado.
 
-### REGLAS SQL PARA BÚSQUEDAS EN agenda_personal:
-- Usa OR y busca coincidencias con ILIKE '%termino%' en categoria, subcategoria Y resumen.
-- SIEMPRE incluye AND telegram_user_id = {user_id}.
+### REGLAS PARA BÚSQUEDAS EN agenda_personal:
+- Búsquedas por palabras clave: NO escribas SQL. Usa intent "QUERY" y coloca solo las palabras clave en "search_terms" (ej. "barandas box003"); el sistema busca en categoría, subcategoría, resumen y contenido y ordena por relevancia.
+- Escribe sql_query solo para filtros que no son palabras clave (fechas, tipo_entrada, estado).
+- En sql_query SIEMPRE incluye AND telegram_user_id = <USER_ID>.
 - ORDEN: ORDER BY categoria ASC, fecha_evento ASC.
-- Si el usuario pide "toda la agenda" o "todo": SELECT * FROM agenda_personal WHERE telegram_user_id = {user_id} ORDER BY categoria ASC, fecha_evento ASC.
+- Si el usuario pide "toda la agenda" o "todo": SELECT * FROM agenda_personal WHERE telegram_user_id = <USER_ID> ORDER BY categoria ASC, fecha_evento ASC.
 
 ### REGLAS SQL PARA CONSULTAS DE CATEGORÍAS (tabla categorias_agenda):
-- Si el usuario pide "mis categorías" o "qué categorías tengo": SELECT DISTINCT categoria FROM categorias_agenda WHERE telegram_user_id = {user_id} AND estado = 'ACTIVO' ORDER BY categoria ASC
-- Si el usuario pide "subcategorías de [CATEGORIA]" o "proyectos de [CATEGORIA]": SELECT subcategoria FROM categorias_agenda WHERE telegram_user_id = {user_id} AND TRIM(categoria) ILIKE TRIM('%CATEGORIA_AQUI%') AND estado = 'ACTIVO' ORDER BY subcategoria ASC
+- Si el usuario pide "mis categorías" o "qué categorías tengo": SELECT DISTINCT categoria FROM categorias_agenda WHERE telegram_user_id = <USER_ID> AND estado = 'ACTIVO' ORDER BY categoria ASC
+- Si el usuario pide "subcategorías de [CATEGORIA]" o "proyectos de [CATEGORIA]": SELECT subcategoria FROM categorias_agenda WHERE telegram_user_id = <USER_ID> AND TRIM(categoria) ILIKE TRIM('%CATEGORIA_AQUI%') AND estado = 'ACTIVO' ORDER BY subcategoria ASC
 - Para estas consultas usa intent "QUERY" y coloca el SQL en sql_query.
 
 FORMATO JSON ESPERADO:
-{{
+{
   "intent": "SAVE" | "QUERY" | "DELETE" | "UPDATE",
   "reasoning": "Explica qué frase del usuario conectaste con qué proyecto exacto de la lista.",
   "sql_query": "SELECT ...",
-  "save_data": {{
+  "search_terms": "palabras clave (solo para búsquedas, en lugar de sql_query)",
+  "save_data": {
       "category": "CATEGORIA EXACTA DE LA LISTA o LIBRE",
       "subcategory": "SUBCATEGORIA EXACTA DE LA LISTA o LIBRE. NUNCA INVENTES PALABRAS.",
       "entry_type": "TAREA",
       "summary": "...",
       "full_content": "...",
       "event_date": "YYYY-MM-DD HH:MM:SS" (or null),
-      "extra_data": {{}},
+      "extra_data": {},
       "status": "Open"
-  }},
+  },
   "user_reply": "Mensaje de confirmación corto. Si usaste LIBRE, pregunta amablemente si quiere crear esa categoría."
-}}
+}
 """
 
 
-async def process_with_ai(content_type, content_data, current_date, user_id, username, categorias_dinamicas):
-    sys_instruction = get_system_prompt(user_id, username, categorias_dinamicas)
-    messages = [{"role": "system", "content": f"{sys_instruction}\n\nFecha Actual: {current_date}"}]
+@lru_cache(maxsize=2048)
+def get_user_prompt_section(user_id, username, categorias_dinamicas):
+    return f"""### USUARIO
+USER_ID: {user_id}
+USERNAME: {username}
+
+{categorias_dinamicas}"""
+
+
+def get_system_prompt(user_id, username, categorias_dinamicas):
+    return f"{STATIC_SYSTEM_PROMPT}\n{get_user_prompt_section(user_id, username, categorias_dinamicas)}"
+
+
+MULTIPART_INSTRUCTION = (
+    "El usuario envió varios mensajes seguidos (texto y/o imágenes). Interprétalos juntos. "
+    "Si describen varios registros independientes, devuelve save_data como una lista con un objeto por registro."
+)
+
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1536'))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_LOW_DETAIL_MAX_EDGE = int(os.getenv('IMAGE_LOW_DETAIL_MAX_EDGE', '512'))
+
+usage_stats = Counter()
+
+response_cache = ResponseCache(
+    maxsize=int(os.getenv('AI_CACHE_SIZE', '2000')),
+    ttl=float(os.getenv('AI_CACHE_TTL', '3600')),
+    backend=PostgresResponseCacheBackend() if os.getenv('AI_CACHE_PERSIST', '0') == '1' else None,
+)
+
+
+def _record_usage(response, elapsed):
+    """Acumula tokens de entrada/salida y tokens servidos desde el cache de prompts."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+    usage_stats['requests'] += 1
+    usage_stats['prompt_tokens'] += usage.prompt_tokens
+    usage_stats['cached_prompt_tokens'] += cached
+    usage_stats['completion_tokens'] += usage.completion_tokens
+    if cached:
+        usage_stats['cached_requests'] += 1
+    logger.info(
+        f"GPT usage: prompt={usage.prompt_tokens} cached={cached} "
+        f"completion={usage.completion_tokens} latencia={elapsed:.2f}s"
+    )
+
+
+async def process_with_ai(content_type, content_data, current_date, user_id, username, categorias_dinamicas,
+                         media_duration=None, timings=None):
+    lane = {'audio': 'voice', 'image': 'image'}.get(content_type, 'text')
+    if content_type == 'multipart' and any(kind == 'image' for kind, _ in content_data):
+        lane = 'image'
+    deadline = ai_scheduler.deadline_for(lane)
+    messages = []
+    user_text = None
 
     if content_type == 'audio':
         try:
-            with open(content_data, "rb") as audio_file:
-                transcription = await client.audio.transcriptions.create(model="whisper-1", file=audio_file)
-            messages.append({"role": "user", "content": f"Audio recibido: {transcription.text}"})
+            # content_data son los bytes OGG de la nota de voz
+            text = await transcribe_voice(content_data, duration=media_duration, timings=timings,
+                                          user_id=user_id, deadline=deadline)
+            messages.append({"role": "user", "content": f"Audio recibido: {text}"})
+            user_text = text
         except Exception as e:
+            errors_total.inc(stage='whisper')
             logger.error(f"Error Whisper: {e}")
             return None
     elif content_type == 'image':
         try:
-            base64_image = encode_image(content_data)
+            # content_data son los bytes de la foto; Pillow corre en un hilo para no bloquear el loop
+            data_url, detail = await asyncio.to_thread(
+                prepare_image, content_data, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_LOW_DETAIL_MAX_EDGE
+            )
             messages.append({
                 "role": "user",
                 "content": [
                     {"type": "text", "text": "Analiza esta imagen y extrae la información relevante para la agenda según las categorías establecidas."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": data_url, "detail": detail}}
                 ]
             })
         except Exception as e:
+            errors_total.inc(stage='vision')
             logger.error(f"Error Vision: {e}")
             return None
     elif content_type == 'text':
         messages.append({"role": "user", "content": content_data})
+        user_text = content_data
+    elif content_type == 'multipart':
+        try:
+            # content_data: lista de ('text', str) / ('image', bytes) en el orden en que llegaron
+            content = [{"type": "text", "text": MULTIPART_INSTRUCTION}]
+            for kind, data in content_data:
+                if kind == 'image':
+                    data_url, detail = await asyncio.to_thread(
+                        prepare_image, data, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_LOW_DETAIL_MAX_EDGE
+                    )
+                    content.append({"type": "image_url", "image_url": {"url": data_url, "detail": detail}})
+                else:
+                    content.append({"type": "text", "text": data})
+            messages.append({"role": "user", "content": content})
+            user_text = " ".join(data for kind, data in content_data if kind == 'text')
+        except Exception as e:
+            errors_total.inc(stage='vision')
+            logger.error(f"Error Vision: {e}")
+            return None
+
+    if callable(categorias_dinamicas):
+        # Función async (texto -> bloque de categorías): la lista se acota al texto del
+        # usuario, que en audios solo se conoce después de transcribir
+        categorias_dinamicas = await categorias_dinamicas(user_text)
+    sys_instruction = get_system_prompt(user_id, username, categorias_dinamicas)
+    # El sufijo por petición va al final para no romper el prefijo cacheable
+    messages.insert(0, {"role": "system", "content": f"{sys_instruction}\n\nFecha Actual: {current_date}"})
+
+    cache_key = None
+    if content_type == 'text':
+        # Bucket horario: las fechas relativas ("mañana", "hoy") siguen siendo válidas
+        cache_key = ResponseCache.make_key(user_id, normalize_text(content_data), categorias_dinamicas, current_date[:13])
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Cache IA hit para user_id: {user_id} (hit ratio {response_cache.hit_ratio():.0%})")
+            return cached
 
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.0
-        )
-        return json.loads(response.choices[0].message.content)
+        async def _create():
+            with stage_seconds.time(stage='vision' if lane == 'image' else 'chat'):
+                return await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                    temperature=0.0
+                )
+
+        started = time.perf_counter()
+        response = await ai_scheduler.submit(_create, "gpt-4o", user_id=user_id, lane=lane, deadline=deadline)
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings['classify'] = elapsed
+        _record_usage(response, elapsed)
+        result = json.loads(response.choices[0].message.content)
+    except DeadlineExceeded as e:
+        errors_total.inc(stage='deadline')
+        logger.error(f"GPT sin respuesta a tiempo para user_id {user_id}: {e}")
+        return None
     except Exception as e:
+        errors_total.inc(stage='chat')
         logger.error(f"Error GPT: {e}")
         return None
+
+    if cache_key is not None:
+        await response_cache.set(cache_key, result, elapsed)
+    return result
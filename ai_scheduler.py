@@ -0,0 +1,300 @@
+import os
+import time
+import random
+import asyncio
+import itertools
+
+import openai
+
+from config import logger
+from metrics import counter, histogram
+
+
+LANES = {'text': 0, 'voice': 1, 'image': 2}
+
+queue_wait_seconds = histogram('jarvis_ai_queue_wait_seconds', 'Espera en cola antes de cada llamada a OpenAI')
+retries_total = counter('jarvis_ai_retries_total', 'Reintentos de llamadas a OpenAI por modelo y motivo')
+deadline_exceeded_total = counter('jarvis_ai_deadline_exceeded_total', 'Peticiones a OpenAI vencidas por carril')
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """Bucket de `rate_per_minute` peticiones con ráfaga de `burst`.
+
+    `block()` congela el bucket (p. ej. tras un 429 con retry-after) para que
+    ninguna petición de ese modelo salga antes de tiempo.
+    """
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Segundos hasta que haya una ficha disponible (0 si ya la hay)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _Job:
+    __slots__ = ('factory', 'model', 'user_id', 'lane', 'deadline', 'future', 'seq', 'enqueued_at', 'not_before', 'attempt')
+
+    def __init__(self, factory, model, user_id, lane, deadline, seq):
+        self.factory = factory
+        self.model = model
+        self.user_id = user_id
+        self.lane = lane
+        self.deadline = deadline
+        self.future = asyncio.get_running_loop().create_future()
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0
+        self.attempt = 0
+
+
+def _parse_rpm(spec):
+    """'gpt-4o:500,whisper-1:50' -> {'gpt-4o': 500.0, 'whisper-1': 50.0}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        model, _, rpm = item.rpartition(':')
+        limits[model] = float(rpm)
+    return limits
+
+
+def _retry_after(error):
+    """Segundos indicados por OpenAI en retry-after-ms / retry-after, o None."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+class AIScheduler:
+    """Cola única frente al cliente de OpenAI.
+
+    - Buckets por modelo (límite de la organización) y por usuario (reparto justo).
+    - Carriles de prioridad text > voice > image, con envejecimiento para que las
+      imágenes no esperen indefinidamente detrás de una ráfaga de texto.
+    - Cada petición tiene un deadline absoluto: si vence en cola no se envía y si
+      vence durante la llamada se cancela.
+    - 429/5xx/errores de conexión se reintentan con backoff exponencial con jitter,
+      respetando retry-after. Un 429 congela el bucket del modelo completo.
+    """
+
+    def __init__(self, max_concurrency=16, model_rpm=None, default_model_rpm=500, user_rpm=30, user_burst=10,
+                 max_retries=4, backoff_base=0.5, backoff_cap=20.0, aging_seconds=10.0, deadlines=None):
+        self.max_concurrency = max_concurrency
+        self.model_rpm = dict(model_rpm or {})
+        self.default_model_rpm = default_model_rpm
+        self.user_rpm = user_rpm
+        self.user_burst = user_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.aging_seconds = aging_seconds
+        self.deadlines = dict(deadlines or {'text': 30.0, 'voice': 120.0, 'image': 60.0})
+        self._model_buckets = {}
+        self._user_buckets = {}
+        self._queue = []
+        self._active = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+
+    async def submit(self, factory, model, user_id=None, lane='text', deadline=None):
+        """Encola `factory()` (corrutina que llama a OpenAI) y retorna su resultado.
+
+        `deadline` es un instante de time.monotonic(); por defecto, el del carril.
+        Lanza DeadlineExceeded si no se pudo completar a tiempo.
+        """
+        self._ensure_running()
+        if deadline is None:
+            deadline = time.monotonic() + self.deadlines.get(lane, 30.0)
+        job = _Job(factory, model, user_id, lane, deadline, next(self._seq))
+        self._queue.append(job)
+        self._wakeup.set()
+        return await job.future
+
+    def deadline_for(self, lane):
+        return time.monotonic() + self.deadlines.get(lane, 30.0)
+
+    def snapshot(self):
+        depth = {f"queued_{lane}": 0 for lane in LANES}
+        for job in self._queue:
+            depth[f"queued_{job.lane}"] += 1
+        depth['in_flight'] = self._active
+        return depth
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in self._queue:
+            if not job.future.done():
+                job.future.set_exception(DeadlineExceeded("scheduler detenido"))
+        self._queue.clear()
+
+    def _model_bucket(self, model):
+        bucket = self._model_buckets.get(model)
+        if bucket is None:
+            rpm = self.model_rpm.get(model, self.default_model_rpm)
+            bucket = self._model_buckets[model] = TokenBucket(rpm, burst=max(1, rpm / 10))
+        return bucket
+
+    def _user_bucket(self, user_id):
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            if len(self._user_buckets) > 10000:
+                now = time.monotonic()
+                self._user_buckets = {uid: b for uid, b in self._user_buckets.items() if not b.is_full(now)}
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rpm, burst=self.user_burst)
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            self._expire(now)
+            wait = None
+            while self._active < self.max_concurrency and self._queue:
+                job, wait = self._pick(now)
+                if job is None:
+                    break
+                self._queue.remove(job)
+                queue_wait_seconds.observe(now - job.enqueued_at, lane=job.lane)
+                self._active += 1
+                task = asyncio.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeouts = [wait] if wait is not None else []
+            timeouts += [job.deadline - now for job in self._queue]
+            timeout = max(0.0, min(timeouts)) if timeouts else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _expire(self, now):
+        for job in list(self._queue):
+            if job.future.done():
+                self._queue.remove(job)
+            elif job.deadline <= now:
+                self._queue.remove(job)
+                deadline_exceeded_total.inc(lane=job.lane)
+                job.future.set_exception(DeadlineExceeded(f"deadline vencido en cola ({job.lane})"))
+
+    def _pick(self, now):
+        """Siguiente job que pueda salir ya, o (None, segundos hasta que alguno pueda)."""
+        min_wait = None
+        ordered = sorted(
+            self._queue,
+            key=lambda j: (LANES.get(j.lane, len(LANES)) - (now - j.enqueued_at) / self.aging_seconds, j.seq)
+        )
+        for job in ordered:
+            waits = [job.not_before - now, self._model_bucket(job.model).wait_time(now)]
+            if job.user_id is not None:
+                waits.append(self._user_bucket(job.user_id).wait_time(now))
+            wait = max(waits)
+            if wait <= 0:
+                self._model_bucket(job.model).take(now)
+                if job.user_id is not None:
+                    self._user_bucket(job.user_id).take(now)
+                return job, None
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    async def _execute(self, job):
+        try:
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"deadline vencido ({job.lane})")
+            try:
+                result = await asyncio.wait_for(job.factory(), timeout=remaining)
+            except asyncio.TimeoutError:
+                deadline_exceeded_total.inc(lane=job.lane)
+                raise DeadlineExceeded(f"deadline vencido durante la llamada ({job.lane})")
+            except _RETRYABLE as e:
+                now = time.monotonic()
+                delay = self._backoff(job.attempt, e)
+                if isinstance(e, openai.RateLimitError):
+                    self._model_bucket(job.model).block(delay, now)
+                if job.attempt >= self.max_retries or now + delay >= job.deadline or job.future.done():
+                    raise
+                reason = type(e).__name__
+                retries_total.inc(model=job.model, reason=reason)
+                logger.warning(f"OpenAI {reason} en {job.model}; reintento {job.attempt + 1} en {delay:.1f}s")
+                job.attempt += 1
+                job.not_before = now + delay
+                job.enqueued_at = now
+                self._queue.append(job)
+                return
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._active -= 1
+            self._wakeup.set()
+
+
+ai_scheduler = AIScheduler(
+    max_concurrency=int(os.getenv('AI_MAX_CONCURRENCY', '16')),
+    model_rpm=_parse_rpm(os.getenv('AI_MODEL_RPM', 'gpt-4o:500,whisper-1:50')),
+    user_rpm=float(os.getenv('AI_USER_RPM', '30')),
+    user_burst=int(os.getenv('AI_USER_BURST', '10')),
+    max_retries=int(os.getenv('AI_MAX_RETRIES', '4')),
+    deadlines={
+        'text': float(os.getenv('AI_DEADLINE_TEXT', '30')),
+        'voice': float(os.getenv('AI_DEADLINE_VOICE', '120')),
+        'image': float(os.getenv('AI_DEADLINE_IMAGE', '60')),
+    },
+)
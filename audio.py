@@ -0,0 +1,111 @@
+import os
+import re
+import time
+import shutil
+import asyncio
+
+from config import client, logger
+from ai_scheduler import ai_scheduler
+from metrics import stage_seconds
+
+
+VOICE_SINGLE_SHOT_MAX_SECONDS = int(os.getenv('VOICE_SINGLE_SHOT_MAX_SECONDS', '60'))
+VOICE_CHUNK_SECONDS = int(os.getenv('VOICE_CHUNK_SECONDS', '45'))
+VOICE_MAX_CONCURRENCY = int(os.getenv('VOICE_MAX_CONCURRENCY', '4'))
+
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+async def _ffmpeg(args, input_bytes):
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-nostdin", "-i", "pipe:0", *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await proc.communicate(input_bytes)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg terminó con código {proc.returncode}: {stderr[-300:].decode(errors='ignore')}")
+    return stdout, stderr.decode(errors='ignore')
+
+
+async def detect_silences(audio_bytes, noise_db=-35, min_silence=0.4):
+    """Retorna los puntos medios (segundos) de cada silencio detectado por ffmpeg."""
+    _, log = await _ffmpeg(
+        ["-af", f"silencedetect=noise={noise_db}dB:d={min_silence}", "-f", "null", "-"],
+        audio_bytes,
+    )
+    points, start = [], None
+    for kind, value in _SILENCE_RE.findall(log):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            points.append((start + float(value)) / 2)
+            start = None
+    return points
+
+
+def plan_chunks(duration, silence_points, target=VOICE_CHUNK_SECONDS):
+    """Divide [0, duration] en tramos de ~target segundos cortando en el silencio más cercano."""
+    bounds, cursor = [], 0.0
+    while duration - cursor > target * 1.5:
+        ideal = cursor + target
+        candidates = [p for p in silence_points if cursor + target / 2 < p < cursor + target * 1.5]
+        cut = min(candidates, key=lambda p: abs(p - ideal)) if candidates else ideal
+        bounds.append((cursor, cut))
+        cursor = cut
+    bounds.append((cursor, duration))
+    return bounds
+
+
+async def cut_segment(audio_bytes, start, end):
+    stdout, _ = await _ffmpeg(
+        ["-ss", f"{start:.2f}", "-to", f"{end:.2f}", "-vn", "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"],
+        audio_bytes,
+    )
+    return stdout
+
+
+async def transcribe_bytes(audio_bytes, filename="voice.ogg", user_id=None, deadline=None):
+    async def _create():
+        with stage_seconds.time(stage='whisper'):
+            return await client.audio.transcriptions.create(model="whisper-1", file=(filename, audio_bytes))
+
+    transcription = await ai_scheduler.submit(_create, "whisper-1", user_id=user_id, lane='voice', deadline=deadline)
+    return transcription.text
+
+
+async def transcribe_voice(audio_bytes, duration=None, timings=None, user_id=None, deadline=None):
+    """Transcribe una nota de voz en memoria.
+
+    Las notas cortas (o si no hay ffmpeg) van en una sola llamada a Whisper. Las largas
+    se cortan en silencios, se transcriben en paralelo y se unen en orden.
+    """
+    timings = timings if timings is not None else {}
+    if not duration or duration <= VOICE_SINGLE_SHOT_MAX_SECONDS or shutil.which("ffmpeg") is None:
+        started = time.perf_counter()
+        text = await transcribe_bytes(audio_bytes, user_id=user_id, deadline=deadline)
+        timings['transcribe'] = time.perf_counter() - started
+        return text
+
+    started = time.perf_counter()
+    try:
+        silences = await detect_silences(audio_bytes)
+        bounds = plan_chunks(duration, silences)
+        chunks = await asyncio.gather(*(cut_segment(audio_bytes, start, end) for start, end in bounds))
+    except (RuntimeError, OSError) as e:
+        logger.error(f"Error cortando audio, se envía completo: {e}")
+        chunks = [audio_bytes]
+    timings['transcode'] = time.perf_counter() - started
+
+    semaphore = asyncio.Semaphore(VOICE_MAX_CONCURRENCY)
+
+    async def _transcribe(index, chunk):
+        async with semaphore:
+            return await transcribe_bytes(chunk, filename=f"voice_{index}.ogg", user_id=user_id, deadline=deadline)
+
+    started = time.perf_counter()
+    texts = await asyncio.gather(*(_transcribe(i, chunk) for i, chunk in enumerate(chunks)))
+    timings['transcribe'] = time.perf_counter() - started
+    logger.info(f"Audio de {duration}s transcrito en {len(chunks)} tramos")
+    return " ".join(t.strip() for t in texts if t and t.strip())
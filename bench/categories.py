@@ -0,0 +1,133 @@
+"""Precisión del preselector de categorías (category_index) frente a k.
+
+Usa como verdad las entradas ya guardadas en agenda_personal cuya (categoria,
+subcategoria) sigue activa en categorias_agenda: para cada una mide si aparece entre
+las k candidatas elegidas a partir del texto original, y cuánto se achica el bloque de
+categorías del prompt. Solo lee de la base (POSTGRES_* del entorno/.env).
+
+    python -m bench.categories --ks 5,10,20,40 --min-categories 40 --output categorias.json
+"""
+import json
+import time
+import argparse
+import platform
+from datetime import datetime
+from collections import Counter, defaultdict
+
+from dotenv import load_dotenv
+
+from bench.run import percentiles, git_commit
+
+
+def load_samples(min_categories, per_user):
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT telegram_user_id, categoria, subcategoria FROM categorias_agenda
+            WHERE estado = 'ACTIVO'
+            ORDER BY telegram_user_id, categoria, subcategoria
+        """)
+        taxonomies = defaultdict(list)
+        for telegram_user_id, categoria, subcategoria in cur.fetchall():
+            taxonomies[telegram_user_id].append((categoria, subcategoria))
+        taxonomies = {uid: rows for uid, rows in taxonomies.items() if len(rows) >= min_categories}
+
+        cur.execute("""
+            SELECT telegram_user_id, categoria, subcategoria, COALESCE(NULLIF(contenido_completo, ''), resumen)
+            FROM (
+                SELECT *, row_number() OVER (PARTITION BY telegram_user_id ORDER BY id DESC) AS n
+                FROM agenda_personal
+                WHERE telegram_user_id = ANY(%s)
+            ) a
+            WHERE n <= %s
+        """, (list(taxonomies), per_user))
+        valid = {uid: set(rows) for uid, rows in taxonomies.items()}
+        samples = []
+        for telegram_user_id, categoria, subcategoria, text in cur.fetchall():
+            # Las entradas en LIBRE o en subcategorías ya borradas no tienen respuesta correcta en la lista
+            if text and (categoria, subcategoria) in valid[telegram_user_id]:
+                samples.append((telegram_user_id, (categoria, subcategoria), text))
+        cur.close()
+        return taxonomies, samples
+    finally:
+        conn.close()
+
+
+def evaluate(taxonomies, samples, ks):
+    from db import render_categories
+    from category_index import CategoryIndex
+
+    indexes, build_times = {}, []
+    for telegram_user_id, rows in taxonomies.items():
+        started = time.perf_counter()
+        index = indexes[telegram_user_id] = CategoryIndex()
+        index.update(rows)
+        index.search("", 1)  # fuerza el cálculo de normas
+        build_times.append(time.perf_counter() - started)
+
+    hits, shortlist_chars = Counter(), Counter()
+    full_chars, search_times, ranks = 0, [], []
+    for telegram_user_id, label, text in samples:
+        rows = taxonomies[telegram_user_id]
+        started = time.perf_counter()
+        ranked = indexes[telegram_user_id].search(text, max(ks))
+        search_times.append(time.perf_counter() - started)
+        rank = ranked.index(label) + 1 if label in ranked else None
+        ranks.append(rank)
+        full_chars += len(render_categories(rows))
+        for k in ks:
+            if rank is not None and rank <= k:
+                hits[k] += 1
+            shortlist_chars[k] += len(render_categories(ranked[:k], total=len(rows)))
+
+    total = len(samples)
+    sizes = [len(rows) for rows in taxonomies.values()]
+    found = [rank for rank in ranks if rank is not None]
+    return {
+        'users': len(taxonomies),
+        'samples': total,
+        'subcategories_per_user': {'min': min(sizes), 'mean': round(sum(sizes) / len(sizes)), 'max': max(sizes)} if sizes else None,
+        'index_build_ms': percentiles(build_times),
+        'search_ms': percentiles(search_times),
+        'mean_reciprocal_rank': round(sum(1 / rank for rank in found) / total, 4) if total else None,
+        'full_prompt_chars_mean': round(full_chars / total) if total else None,
+        'by_k': {
+            k: {
+                'recall': round(hits[k] / total, 4) if total else None,
+                'prompt_chars_mean': round(shortlist_chars[k] / total) if total else None,
+                # ~4 caracteres por token en español
+                'prompt_tokens_saved_mean': round((full_chars - shortlist_chars[k]) / total / 4) if total else None,
+            }
+            for k in ks
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precisión del preselector de categorías frente a k")
+    parser.add_argument('--ks', default='5,10,20,40', type=lambda value: sorted(int(v) for v in value.split(',') if v))
+    parser.add_argument('--min-categories', type=int, default=40, help="solo usuarios con al menos N subcategorías")
+    parser.add_argument('--per-user', type=int, default=500, help="entradas más recientes evaluadas por usuario")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    load_dotenv()
+    taxonomies, samples = load_samples(args.min_categories, args.per_user)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'ks': args.ks, 'min_categories': args.min_categories, 'per_user': args.per_user},
+        },
+        'results': evaluate(taxonomies, samples, args.ks),
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
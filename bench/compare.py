@@ -0,0 +1,81 @@
+"""Compara dos reportes de bench/run.py y marca regresiones.
+
+    python -m bench.compare base.json nuevo.json --threshold 10
+
+Sale con código 1 si alguna latencia p95/p99 empeora, o el throughput cae,
+más que `--threshold` por ciento.
+"""
+import sys
+import json
+import argparse
+
+
+# (ruta dentro del workload, mayor es mejor)
+METRICS = [
+    (('throughput_per_s',), True),
+    (('latency_ms', 'p50'), False),
+    (('latency_ms', 'p95'), False),
+    (('latency_ms', 'p99'), False),
+    (('delivery_lag_ms', 'p95'), False),
+    (('db_round_trips_per_update',), False),
+    (('db_round_trips_per_reminder',), False),
+    (('openai_calls_per_update',), False),
+]
+GATED = {('throughput_per_s',), ('latency_ms', 'p95'), ('latency_ms', 'p99'), ('delivery_lag_ms', 'p95')}
+
+
+def _get(data, path):
+    for key in path:
+        if not isinstance(data, dict) or data.get(key) is None:
+            return None
+        data = data[key]
+    return data
+
+
+def compare(base, new, threshold):
+    lines, regressions = [], []
+    for workload in sorted(set(base['workloads']) | set(new['workloads'])):
+        old_w, new_w = base['workloads'].get(workload), new['workloads'].get(workload)
+        if old_w is None or new_w is None:
+            lines.append(f"{workload}: solo en {'nuevo' if old_w is None else 'base'}")
+            continue
+        for path, higher_is_better in METRICS:
+            before, after = _get(old_w, path), _get(new_w, path)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if higher_is_better else change
+            name = '.'.join(path)
+            flag = ""
+            if path in GATED and worse > threshold:
+                flag = "  <-- regresión"
+                regressions.append(f"{workload}.{name}")
+            lines.append(f"{workload:>10} {name:<28} {before:>10} -> {after:<10} ({change:+.1f}%){flag}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara dos reportes del benchmark")
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help="porcentaje tolerado antes de fallar")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"base {base['meta'].get('commit')} -> nuevo {new['meta'].get('commit')}")
+    if base['meta'].get('config') != new['meta'].get('config'):
+        print("⚠️ Las configuraciones difieren; la comparación puede no ser válida")
+    lines, regressions = compare(base, new, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\nRegresiones (> {args.threshold}%): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Mensajes por segundo con una conexión por llamada (psycopg2.connect bloqueante) frente al pool.
+
+Cada "mensaje" hace el trabajo de base de master_handler + el botón Guardar
+(verificar registro, leer categorías, insertar la entrada) con una espera de
+`--ai-latency` en medio que representa la llamada a la IA. En el modo `connect`
+cada consulta abre y cierra su conexión dentro de la corrutina, como antes del pool,
+y bloquea el event loop; en el modo `pool` pasa por db.pool.run.
+
+    python -m bench.db_pool --users 50 --messages 20 --ai-latency 0.2
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+from bench.postgres import DisposablePostgres
+from bench.run import percentiles, git_commit
+from bench.persistence import measure_loop_lag
+
+
+USER_ID_BASE = 9600000000
+
+
+def _is_registered(conn, uid):
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM usuarios WHERE telegram_user_id = %s", (uid,))
+    found = cur.fetchone() is not None
+    cur.close()
+    return found
+
+
+def _categories(conn, uid):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT categoria, subcategoria FROM categorias_agenda
+        WHERE telegram_user_id = %s AND estado = 'ACTIVO' ORDER BY categoria, subcategoria
+    """, (uid,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def _save(conn, uid, i):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO agenda_personal (telegram_user_id, categoria, subcategoria, tipo_entrada, resumen, estado)
+        VALUES (%s, 'TRABAJO', 'Pendientes', 'TAREA', %s, 'Open')
+    """, (uid, f"bench pool {uid}-{i}"))
+    cur.close()
+
+
+async def run_mode(mode, args, users):
+    import db
+
+    if mode == 'connect':
+        async def call(fn, *fn_args):
+            # Como antes del pool: conexión nueva por llamada y psycopg2 síncrono en el loop
+            conn = db.get_db_connection()
+            try:
+                result = fn(conn, *fn_args)
+                conn.commit()
+                return result
+            finally:
+                conn.close()
+    else:
+        call = db.pool.run
+
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def _user(uid):
+        async with semaphore:
+            for i in range(args.messages):
+                started = time.perf_counter()
+                await call(_is_registered, uid)
+                await call(_categories, uid)
+                await asyncio.sleep(max(0.0, random.gauss(args.ai_latency, args.ai_latency * 0.2)))
+                await call(_save, uid, i)
+                latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(_user(uid) for uid in users))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    return {
+        'messages': len(latencies),
+        'duration_s': round(elapsed, 3),
+        'messages_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': percentiles(latencies),
+        'event_loop_lag_ms': percentiles(lags),
+    }
+
+
+async def main(args):
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+    import db
+    from migrations import migrate
+
+    migrate()
+    await db.init_pool()
+    users = [USER_ID_BASE + i for i in range(args.users)]
+
+    def _reset(conn):
+        cur = conn.cursor()
+        for table in ('agenda_personal', 'categorias_agenda', 'usuarios'):
+            cur.execute(f"DELETE FROM {table} WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+        cur.close()
+
+    results = {}
+    try:
+        await db.pool.run(_reset)
+        await db.bulk_register_users([(uid, f"bench_{uid}", f"Bench {uid}") for uid in users])
+        for mode in args.modes:
+            results[mode] = await run_mode(mode, args, users)
+    finally:
+        await db.pool.run(_reset)
+        await db.close_pool()
+        if postgres is not None:
+            postgres.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'users': args.users, 'messages': args.messages, 'concurrency': args.concurrency,
+                       'ai_latency': args.ai_latency, 'db_pool_max': int(os.getenv('DB_POOL_MAX', '10'))},
+        },
+        'workloads': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Conexión por llamada frente al pool de conexiones")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20, help="mensajes por usuario")
+    parser.add_argument('--concurrency', type=int, default=50, help="usuarios simultáneos")
+    parser.add_argument('--ai-latency', type=float, default=0.2, help="segundos simulados de la llamada a la IA")
+    parser.add_argument('--modes', default='connect,pool',
+                        type=lambda value: [m for m in value.split(',') if m in ('connect', 'pool')])
+    parser.add_argument('--external-db', action='store_true', help="usa POSTGRES_* (¡solo una base desechable!)")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,260 @@
+"""Servidores locales que imitan la API de OpenAI y la Bot API de Telegram.
+
+Solo implementan lo que usa el bot (chat.completions, audio.transcriptions,
+getMe/sendMessage/editMessageText/getFile...) con latencia configurable.
+"""
+import io
+import json
+import time
+import random
+import asyncio
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+
+class FakeHTTPServer:
+    """Servidor HTTP/1.1 mínimo con keep-alive; las subclases implementan handle()."""
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.port = None
+        self.calls = Counter()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await self._read_body(reader, headers)
+
+                status, content_type, payload = await self.handle(method, urlsplit(target).path, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        length = int(headers.get('content-length', 0))
+        return await reader.readexactly(length) if length else b""
+
+    async def handle(self, method, path, headers, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def json_response(data, status="200 OK"):
+        return status, "application/json", json.dumps(data).encode()
+
+
+class FakeOpenAI(FakeHTTPServer):
+    """Imita /v1/chat/completions y /v1/audio/transcriptions.
+
+    La intención se decide por palabras clave del mensaje del usuario, así los
+    workloads controlan qué rama de master_handler se ejecuta.
+    """
+
+    TRANSCRIPTION = "recordar revisar el informe bench mañana a las 10"
+
+    def __init__(self, chat_latency=0.8, whisper_latency=1.2, jitter=0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_latency = chat_latency
+        self.whisper_latency = whisper_latency
+        self.jitter = jitter
+
+    async def _sleep(self, base):
+        if base > 0:
+            await asyncio.sleep(max(0.0, random.gauss(base, base * self.jitter)))
+
+    async def handle(self, method, path, headers, body):
+        if path.endswith("/chat/completions"):
+            self.calls['chat'] += 1
+            request = json.loads(body)
+            await self._sleep(self.chat_latency)
+            return self.json_response(self._completion(request))
+        if path.endswith("/audio/transcriptions"):
+            self.calls['transcriptions'] += 1
+            await self._sleep(self.whisper_latency)
+            return self.json_response({"text": self.TRANSCRIPTION})
+        self.calls['unknown'] += 1
+        return self.json_response({"error": {"message": f"ruta no soportada: {path}"}}, "404 Not Found")
+
+    @staticmethod
+    def _user_text(request):
+        content = request['messages'][-1]['content']
+        if isinstance(content, list):
+            return " ".join(part.get('text', '') for part in content if part.get('type') == 'text'), True
+        return content, False
+
+    def _completion(self, request):
+        text, has_image = self._user_text(request)
+        lowered = text.lower()
+        if not has_image and lowered.startswith("consulta"):
+            result = {"intent": "QUERY", "reasoning": "bench", "search_terms": "bench"}
+        else:
+            result = {
+                "intent": "SAVE",
+                "reasoning": "bench",
+                "save_data": {
+                    "category": "TRABAJO",
+                    "subcategory": "Pendientes",
+                    "entry_type": "TAREA",
+                    "summary": f"bench {text[:60]}",
+                    "full_content": text,
+                    "event_date": None,
+                    "extra_data": {"origen": "imagen" if has_image else "texto"},
+                    "status": "Open",
+                },
+                "user_reply": "Anotado.",
+            }
+        content = json.dumps(result)
+        prompt_tokens = sum(len(json.dumps(m['content'])) for m in request['messages']) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-bench-{self.calls['chat']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'gpt-4o'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+
+
+def sample_jpeg(width=1600, height=1200):
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class FakeTelegram(FakeHTTPServer):
+    """Imita la Bot API: responde a los métodos que usa el bot y registra cada mensaje enviado.
+
+    Los archivos (fotos y notas de voz) se sirven desde /file/bot<token>/<file_path>.
+    """
+
+    BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Jarvis", "username": "jarvis_bench_bot"}
+
+    def __init__(self, latency=0.05, files=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.files = files or {}
+        self.sent = []
+        self._message_id = 0
+        self._waiters = []
+
+    async def handle(self, method, path, headers, body):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'file':
+            file_path = '/'.join(parts[2:])
+            self.calls['download'] += 1
+            if file_path not in self.files:
+                return "404 Not Found", "text/plain", b"not found"
+            return "200 OK", "application/octet-stream", self.files[file_path]
+
+        api_method = parts[-1]
+        self.calls[api_method] += 1
+        params = self._params(headers, body)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return self.json_response({"ok": True, "result": self._result(api_method, params)})
+
+    @staticmethod
+    def _params(headers, body):
+        if not body:
+            return {}
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body)
+        params = {}
+        for key, values in parse_qs(body.decode(), keep_blank_values=True).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    def _result(self, api_method, params):
+        if api_method == 'getMe':
+            return self.BOT_USER
+        if api_method == 'getFile':
+            file_id = params.get('file_id')
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                    "file_path": file_id}
+        if api_method in ('sendMessage', 'editMessageText'):
+            text = str(params.get('text', ''))
+            message = (time.monotonic(), params.get('chat_id'), api_method, text)
+            self.sent.append(message)
+            self._wake(message)
+            self._message_id += 1
+            return {
+                "message_id": params.get('message_id') or self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": params.get('chat_id') or 0, "type": "private"},
+                "from": self.BOT_USER,
+                "text": text,
+            }
+        return True
+
+    def _wake(self, message):
+        for waiter in self._waiters:
+            if waiter[0](message):
+                waiter[1] -= 1
+                if waiter[1] <= 0 and not waiter[2].done():
+                    waiter[2].set_result(None)
+
+    async def wait_for(self, predicate, count, timeout):
+        """Espera hasta que `count` mensajes enviados cumplan `predicate`."""
+        remaining = count - sum(1 for message in self.sent if predicate(message))
+        if remaining <= 0:
+            return
+        waiter = [predicate, remaining, asyncio.get_running_loop().create_future()]
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[2], timeout)
+        finally:
+            self._waiters.remove(waiter)
@@ -0,0 +1,78 @@
+"""Verifica que el SQL que arma el propio bot pase guard_sql.
+
+fetch_page manda por guard_sql todo lo que se pagina: las búsquedas de
+build_agenda_search, las consultas de las reglas del router y las que la IA copia de
+los ejemplos del prompt. Si la guarda se endurece sin contemplar ese SQL, la consulta
+termina en "❌ Error al ejecutar la consulta". No necesita base de datos. Termina con
+código 1 si alguna consulta es rechazada o si alguna regla del router no se probó.
+
+    python -m bench.guard
+"""
+import re
+import sys
+import json
+import argparse
+
+USER_ID = 9100000000
+SEARCH_TERMS = ["planos casa", "barandas box003", "Reunión mañana", "pasaporte"]
+# Un mensaje por regla de router.DEFAULT_RULES
+ROUTER_MESSAGES = [
+    "mis categorías", "proyectos de trabajo", "busca en mi agenda planos casa", "¿me buscas el pasaporte?",
+    "toda mi agenda", "¿qué tengo hoy?", "agenda para mañana",
+]
+_PROMPT_SQL_RE = re.compile(r": (SELECT [^\n]+?)\.?$", re.MULTILINE)
+
+
+def check(sql, params=None):
+    from db import guard_sql, QueryRejected
+
+    try:
+        guarded = guard_sql(sql, USER_ID)
+    except QueryRejected as e:
+        return {'ok': False, 'rejected': str(e), 'sql': sql}
+    return {'ok': True, 'sql': guarded, 'params': params}
+
+
+def run():
+    from ai import STATIC_SYSTEM_PROMPT
+    from db import build_agenda_search
+    from router import DEFAULT_RULES, IntentRouter
+
+    results = {}
+    for terms in SEARCH_TERMS:
+        sql, params = build_agenda_search(terms)
+        results[f"search:{terms}"] = check(sql, params)
+
+    router = IntentRouter(DEFAULT_RULES)
+    for text in ROUTER_MESSAGES:
+        response = router.route(text, USER_ID)
+        if response is None:
+            results[f"router:{text}"] = {'ok': False, 'rejected': "sin_regla"}
+        elif response.get('search_terms'):
+            sql, params = build_agenda_search(response['search_terms'])
+            results[f"router:{text}"] = check(sql, params)
+        else:
+            results[f"router:{text}"] = check(response['sql_query'], response.get('sql_params'))
+    for rule in DEFAULT_RULES:
+        if not router.stats[f'rule:{rule.name}']:
+            results[f"router:{rule.name}"] = {'ok': False, 'rejected': "regla_sin_probar"}
+
+    for i, sql in enumerate(_PROMPT_SQL_RE.findall(STATIC_SYSTEM_PROMPT)):
+        sql = sql.replace("<USER_ID>", str(USER_ID)).replace("CATEGORIA_AQUI", "trabajo")
+        results[f"prompt:{i}"] = check(sql)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SQL generado por el bot frente a guard_sql")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    results = run()
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if not all(result['ok'] for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,153 @@
+"""Bytes enviados y latencia de extremo a extremo de una foto: original en base64 frente a prepare_image.
+
+Para cada imagen de muestra compara el camino anterior (el JPEG completo en base64 con
+detail por defecto) con utils.prepare_image (redimensionado, recomprimido y detail según
+el tamaño). La petición va a un FakeOpenAI local por HTTP real; la subida por la red se
+estima con `--uplink-mbps`, ya que en loopback es casi gratis. También estima los
+tokens de imagen que cobraría la API de visión.
+
+    python -m bench.images --sizes 4032x3024,1600x1200,800x600 --repeat 5
+    python -m bench.images --files foto1.jpg foto2.jpg
+"""
+import io
+import json
+import math
+import time
+import base64
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+from PIL import Image, ImageFilter
+
+from bench.fakes import FakeOpenAI
+from bench.run import percentiles, git_commit
+
+
+def photo_like_jpeg(width, height, quality=92):
+    """JPEG con zonas suaves y algo de ruido, más parecido a una foto de celular que el ruido puro."""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def vision_tokens(width, height, detail):
+    """Tokens de imagen según la tabla de OpenAI: 85 en low; en high 85 + 170 por tile de 512px."""
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def legacy_payload(image_bytes):
+    # Como antes: el archivo completo en base64, con el detail por defecto ('auto' ~ high)
+    encoded = base64.b64encode(image_bytes).decode('ascii')
+    return f"data:image/jpeg;base64,{encoded}", 'auto'
+
+
+def prepared_payload(image_bytes, args):
+    from utils import prepare_image
+
+    return prepare_image(image_bytes, args.max_edge, args.quality, args.low_detail_max_edge)
+
+
+async def measure(client, image_bytes, prepare, args):
+    prepare_s, request_s, payload = [], [], None
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        data_url, detail = await asyncio.to_thread(prepare, image_bytes)
+        prepare_s.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await client.chat.completions.create(model="gpt-4o", messages=[{
+            "role": "user",
+            "content": [{"type": "text", "text": "Analiza esta imagen"},
+                        {"type": "image_url", "image_url": {"url": data_url, "detail": detail}}],
+        }])
+        request_s.append(time.perf_counter() - started)
+        payload = (data_url, detail)
+
+    data_url, detail = payload
+    raw = base64.b64decode(data_url.split(',', 1)[1])
+    with Image.open(io.BytesIO(raw)) as sent:
+        width, height = sent.size
+    upload_s = len(data_url) * 8 / (args.uplink_mbps * 1_000_000)
+    end_to_end = [p + r + upload_s for p, r in zip(prepare_s, request_s)]
+    return {
+        'payload_bytes': len(data_url),
+        'sent_size': f"{width}x{height}",
+        'detail': detail,
+        'vision_tokens_est': vision_tokens(width, height, 'high' if detail == 'auto' else detail),
+        'prepare_ms': percentiles(prepare_s),
+        'request_ms': percentiles(request_s),
+        'upload_ms_est': round(upload_s * 1000, 2),
+        'end_to_end_ms': percentiles(end_to_end),
+    }
+
+
+async def main(args):
+    from openai import AsyncOpenAI
+
+    samples = {}
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split('x'))
+        samples[f"sintetica_{size}"] = photo_like_jpeg(width, height)
+    for path in args.files:
+        with open(path, 'rb') as f:
+            samples[path] = f.read()
+
+    fake = await FakeOpenAI(chat_latency=args.openai_latency, jitter=0).start()
+    client = AsyncOpenAI(base_url=f"{fake.url}/v1", api_key='bench')
+    results = {}
+    try:
+        for name, image_bytes in samples.items():
+            before = await measure(client, image_bytes, legacy_payload, args)
+            after = await measure(client, image_bytes, lambda data: prepared_payload(data, args), args)
+            results[name] = {
+                'original_bytes': len(image_bytes),
+                'before': before,
+                'after': after,
+                'payload_reduction': round(1 - after['payload_bytes'] / before['payload_bytes'], 4),
+            }
+    finally:
+        await client.close()
+        await fake.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'max_edge': args.max_edge, 'quality': args.quality,
+                       'low_detail_max_edge': args.low_detail_max_edge, 'uplink_mbps': args.uplink_mbps,
+                       'openai_latency': args.openai_latency, 'repeat': args.repeat},
+        },
+        'images': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Foto original en base64 frente a prepare_image")
+    parser.add_argument('--sizes', default='4032x3024,1600x1200,800x600',
+                        type=lambda value: [v for v in value.split(',') if v])
+    parser.add_argument('--files', nargs='*', default=[], help="fotos reales a comparar")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-edge', type=int, default=1536)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--low-detail-max-edge', type=int, default=512)
+    parser.add_argument('--uplink-mbps', type=float, default=20.0, help="ancho de banda de subida estimado")
+    parser.add_argument('--openai-latency', type=float, default=0.0, help="latencia fija del FakeOpenAI")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
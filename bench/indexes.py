@@ -0,0 +1,183 @@
+"""Verifica con EXPLAIN que el planner usa los índices de las migraciones 2 a 4.
+
+Carga `--users` x `--rows-per-user` entradas sintéticas en agenda_personal, corre
+ANALYZE y revisa el plan de cada forma de consulta del bot (agenda por usuario y
+categoría, barrido de recordatorios, búsquedas ILIKE '%término%'). También comprueba
+que ON CONFLICT DO NOTHING deduplique categorias_agenda. Termina con código 1 si
+algún índice esperado no aparece en el plan.
+
+    python -m bench.indexes --users 2000 --rows-per-user 100
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+from datetime import datetime
+
+from bench.postgres import DisposablePostgres
+from bench.run import git_commit
+
+
+USER_ID_BASE = 9500000000
+WORDS = ["reunion", "planos", "factura", "dentista", "presupuesto", "pasaporte", "informe", "cumpleanos",
+         "entrega", "barandas", "llamar", "revisar", "comprar", "pagar", "enviar", "proveedor"]
+CATEGORIES = ["TRABAJO", "PERSONAL", "RECORDATORIO", "ENTRETENIMIENTO"]
+
+# (nombre, consulta, parámetros, índice esperado, requiere pg_trgm)
+CHECKS = [
+    ("agenda_por_usuario",
+     "SELECT * FROM agenda_personal WHERE telegram_user_id = %s ORDER BY categoria ASC, fecha_evento ASC",
+     (USER_ID_BASE + 7,), "idx_agenda_user_cat_fecha", False),
+    ("agenda_por_usuario_y_categoria",
+     "SELECT * FROM agenda_personal WHERE telegram_user_id = %s AND categoria = %s ORDER BY fecha_evento",
+     (USER_ID_BASE + 7, "TRABAJO"), "idx_agenda_user_cat_fecha", False),
+    ("barrido_recordatorios",
+     """SELECT id FROM agenda_personal
+        WHERE fecha_evento IS NOT NULL AND estado != 'Closed'
+          AND fecha_evento BETWEEN NOW() - INTERVAL '1 minute' AND NOW() + INTERVAL '120 minutes'""",
+     (), "idx_agenda_fecha_evento_abiertos", False),
+    ("ilike_resumen",
+     "SELECT id FROM agenda_personal WHERE resumen ILIKE %s", ("%pasaporte-raro%",), "idx_agenda_resumen_trgm", True),
+    ("ilike_subcategoria",
+     "SELECT id FROM agenda_personal WHERE subcategoria ILIKE %s", ("%box0042%",), "idx_agenda_subcategoria_trgm", True),
+    ("ilike_categoria",
+     "SELECT id FROM agenda_personal WHERE categoria ILIKE %s", ("%finanzas%",), "idx_agenda_categoria_trgm", True),
+]
+
+
+def seed(conn, users, rows_per_user):
+    from psycopg2.extras import execute_values
+
+    rows = []
+    for u in range(users):
+        for i in range(rows_per_user):
+            summary = " ".join(random.sample(WORDS, 4))
+            if random.random() < 0.001:
+                summary += " pasaporte-raro"
+            rows.append((
+                USER_ID_BASE + u, random.choice(CATEGORIES), f"Proyecto Box{random.randrange(10000):04d}", summary,
+                random.uniform(-365, 365) * 86400,
+                # Casi todo lo viejo está cerrado: el índice parcial solo guarda lo abierto
+                'Closed' if random.random() < 0.9 else 'Open',
+            ))
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO agenda_personal (telegram_user_id, categoria, subcategoria, resumen, fecha_evento, estado)
+        VALUES %s
+    """, rows, template="(%s, %s, %s, %s, NOW()::timestamp + make_interval(secs => %s), %s)", page_size=5000)
+    cur.execute("ANALYZE agenda_personal")
+    conn.commit()
+    cur.close()
+
+
+def used_indexes(plan):
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= used_indexes(child)
+    return names
+
+
+def explain(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params or None)
+    plan = cur.fetchone()[0][0]['Plan']
+    conn.rollback()
+    cur.close()
+    return plan
+
+
+def check_unique_categories(conn):
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute("""
+            INSERT INTO categorias_agenda (telegram_user_id, categoria, subcategoria)
+            VALUES (%s, 'TRABAJO', 'General')
+            ON CONFLICT DO NOTHING
+        """, (USER_ID_BASE,))
+    cur.execute("SELECT COUNT(*) FROM categorias_agenda WHERE telegram_user_id = %s", (USER_ID_BASE,))
+    count = cur.fetchone()[0]
+    conn.rollback()
+    cur.close()
+    return count == 1
+
+
+def run(args):
+    from db import get_db_connection
+    from migrations import migrate
+
+    migrate()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT extname FROM pg_extension")
+    extensions = {row[0] for row in cur.fetchall()}
+    cur.execute("DELETE FROM agenda_personal WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+    conn.commit()
+    cur.close()
+    try:
+        seed(conn, args.users, args.rows_per_user)
+        results = {}
+        for name, sql, params, expected, needs_trgm in CHECKS:
+            if needs_trgm and 'pg_trgm' not in extensions:
+                results[name] = {'expected': expected, 'ok': None, 'skipped': "pg_trgm no disponible"}
+                continue
+            plan = explain(conn, sql, params)
+            indexes = used_indexes(plan)
+            results[name] = {
+                'expected': expected,
+                'ok': expected in indexes,
+                'indexes': sorted(indexes),
+                'node': plan['Node Type'],
+                'total_cost': plan['Total Cost'],
+            }
+        results['categorias_unicas'] = {'ok': check_unique_categories(conn)}
+        return results
+    finally:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM agenda_personal WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verifica con EXPLAIN el uso de los índices de agenda_personal")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rows-per-user', type=int, default=100)
+    parser.add_argument('--external-db', action='store_true', help="usa POSTGRES_* (¡solo una base desechable!)")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+    try:
+        results = run(args)
+    finally:
+        if postgres is not None:
+            postgres.stop()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'users': args.users, 'rows_per_user': args.rows_per_user},
+        },
+        'checks': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if any(check['ok'] is False for check in results.values()):
+        sys.exit(1)
@@ -0,0 +1,121 @@
+"""Benchmark de alta de usuarios: /start uno a uno (register_user) frente a bulk_register_users.
+
+    python -m bench.onboarding --users 20000 --batch-sizes 500,1000,5000
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+from bench.postgres import DisposablePostgres
+from bench.run import CountingConnection, round_trips, git_commit
+
+
+USER_ID_BASE = 9200000000
+
+
+def synthetic_users(count, offset=0):
+    return [(USER_ID_BASE + offset + i, f"user_{offset + i}", f"Usuario {offset + i}") for i in range(count)]
+
+
+async def measure(coroutine_factory, users):
+    before = round_trips.value
+    started = time.perf_counter()
+    await coroutine_factory()
+    elapsed = time.perf_counter() - started
+    return {
+        'users': users,
+        'duration_s': round(elapsed, 3),
+        'users_per_s': round(users / elapsed, 1) if elapsed else None,
+        'db_round_trips_per_user': round((round_trips.value - before) / users, 2) if users else None,
+    }
+
+
+async def run(args):
+    import db
+    from migrations import migrate
+
+    original_kwargs = db._connection_kwargs
+    db._connection_kwargs = lambda: {**original_kwargs(), 'connection_factory': CountingConnection}
+    migrate()
+    await db.init_pool()
+
+    def _reset(conn):
+        cur = conn.cursor()
+        for table in ('categorias_agenda', 'usuarios'):
+            cur.execute(f"DELETE FROM {table} WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+        cur.close()
+
+    results = {}
+    try:
+        await db.pool.run(_reset)
+        single = synthetic_users(args.single_users)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def _register(uid, username, nombre):
+            async with semaphore:
+                await db.register_user(uid, username, nombre)
+
+        async def _register_all(users):
+            await asyncio.gather(*(_register(*user) for user in users))
+
+        results['register_user_new'] = await measure(lambda: _register_all(single), len(single))
+        results['register_user_existing'] = await measure(lambda: _register_all(single), len(single))
+
+        for batch_size in args.batch_sizes:
+            await db.pool.run(_reset)
+            users = synthetic_users(args.users)
+            results[f'bulk_new_batch_{batch_size}'] = await measure(
+                lambda: db.bulk_register_users(users, batch_size=batch_size), len(users))
+            results[f'bulk_existing_batch_{batch_size}'] = await measure(
+                lambda: db.bulk_register_users(users, batch_size=batch_size), len(users))
+    finally:
+        await db.pool.run(_reset)
+        await db.close_pool()
+    return results
+
+
+async def main(args):
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+    try:
+        results = await run(args)
+    finally:
+        if postgres is not None:
+            postgres.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'users': args.users, 'single_users': args.single_users, 'concurrency': args.concurrency,
+                       'batch_sizes': args.batch_sizes},
+        },
+        'workloads': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de alta de usuarios")
+    parser.add_argument('--users', type=int, default=20000, help="usuarios por corrida de bulk_register_users")
+    parser.add_argument('--single-users', type=int, default=1000, help="usuarios registrados uno a uno")
+    parser.add_argument('--concurrency', type=int, default=10, help="registros simultáneos (como /start en paralelo)")
+    parser.add_argument('--batch-sizes', default='1000', type=lambda value: [int(v) for v in value.split(',') if v])
+    parser.add_argument('--external-db', action='store_true', help="usa POSTGRES_* (¡solo una base desechable!)")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,180 @@
+"""Benchmark del write-behind de PostgresPersistence: costo de los flush bajo carga.
+
+Simula `--users` usuarios que modifican su user_data (un pending_save de tamaño
+realista) a `--rate` updates/s durante `--duration` segundos, para cada retardo de
+flush de `--flush-ms`. Reporta lotes por segundo, usuarios por lote, duración de cada
+flush (total y solo la base), round trips, costo del camino caliente
+(update_user_data) y el retraso del event loop mientras se escribe.
+
+    python -m bench.persistence --users 5000 --rate 500 --flush-ms 0,50,200,1000
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+from bench.postgres import DisposablePostgres
+from bench.run import CountingConnection, round_trips, percentiles, git_commit
+
+
+USER_ID_BASE = 9300000000
+
+
+def pending_save(i):
+    return [{
+        'category': 'TRABAJO',
+        'subcategory': f'Proyecto Box{i % 300:03d}',
+        'summary': f'Reunión de seguimiento {i}',
+        'full_content': 'Revisar barandas, presupuesto y fechas de entrega con el equipo. ' * 3,
+        'event_date': '2026-10-16 09:00',
+    }]
+
+
+async def measure_loop_lag(stop, lags, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run_scenario(flush_ms, args):
+    import persistence as persistence_module
+    from persistence import PostgresPersistence
+
+    flushes = []
+    original_save = persistence_module.save_conversation_states
+    original_write = PostgresPersistence._write
+
+    async def timed_save(rows, deleted, purge_expired=False):
+        started = time.perf_counter()
+        try:
+            return await original_save(rows, deleted, purge_expired=purge_expired)
+        finally:
+            flushes[-1].update(users=len(rows) + len(deleted), db_s=time.perf_counter() - started)
+
+    async def timed_write(self):
+        flushes.append({})
+        started = time.perf_counter()
+        await original_write(self)
+        flushes[-1]['total_s'] = time.perf_counter() - started
+
+    persistence_module.save_conversation_states = timed_save
+    PostgresPersistence._write = timed_write
+    try:
+        store = PostgresPersistence(ttl=3600, flush_delay=flush_ms / 1000, reload_after=3600)
+        users = [USER_ID_BASE + i for i in range(args.users)]
+        user_data = {uid: {} for uid in users}
+        for uid in users:
+            await store.refresh_user_data(uid, user_data[uid])
+
+        stop = asyncio.Event()
+        lags = []
+        lag_task = asyncio.create_task(measure_loop_lag(stop, lags))
+        hot_path = []
+        before = round_trips.value
+        started = time.perf_counter()
+        interval = 1 / args.rate
+        for i in range(int(args.rate * args.duration)):
+            uid = random.choice(users)
+            data = user_data[uid]
+            if data and random.random() < 0.3:
+                data.clear()
+            else:
+                data['pending_save'] = pending_save(i)
+                data['state'] = None
+            t0 = time.perf_counter_ns()
+            await store.update_user_data(uid, data)
+            hot_path.append(time.perf_counter_ns() - t0)
+            # Ritmo constante de updates, como los marca Application.update_persistence
+            delay = started + (i + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elapsed = time.perf_counter() - started
+        await store.flush()
+        stop.set()
+        await lag_task
+
+        done = [f for f in flushes if 'db_s' in f]
+        updates = int(args.rate * args.duration)
+        return {
+            'updates': updates,
+            'flushes': len(done),
+            'flushes_per_s': round(len(done) / elapsed, 2),
+            'users_per_flush_mean': round(sum(f['users'] for f in done) / len(done), 1) if done else None,
+            'flush_total_ms': percentiles([f['total_s'] for f in done]),
+            'flush_db_ms': percentiles([f['db_s'] for f in done]),
+            'db_round_trips_per_update': round((round_trips.value - before) / updates, 3) if updates else None,
+            'update_user_data_ns': {
+                'p50': sorted(hot_path)[len(hot_path) // 2] if hot_path else None,
+                'max': max(hot_path) if hot_path else None,
+            },
+            'event_loop_lag_ms': percentiles(lags),
+        }
+    finally:
+        persistence_module.save_conversation_states = original_save
+        PostgresPersistence._write = original_write
+
+
+async def main(args):
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+    import db
+    from migrations import migrate
+
+    original_kwargs = db._connection_kwargs
+    db._connection_kwargs = lambda: {**original_kwargs(), 'connection_factory': CountingConnection}
+    migrate()
+    await db.init_pool()
+
+    def _reset(conn):
+        cur = conn.cursor()
+        cur.execute("DELETE FROM conversation_state WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+        cur.close()
+
+    results = {}
+    try:
+        for flush_ms in args.flush_ms:
+            await db.pool.run(_reset)
+            results[f'flush_{flush_ms}ms'] = await run_scenario(flush_ms, args)
+    finally:
+        await db.pool.run(_reset)
+        await db.close_pool()
+        if postgres is not None:
+            postgres.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'users': args.users, 'rate': args.rate, 'duration': args.duration, 'flush_ms': args.flush_ms},
+        },
+        'workloads': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark del write-behind del estado de conversación")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=500, help="updates de user_data por segundo")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--flush-ms', default='0,50,200,1000', type=lambda value: [int(v) for v in value.split(',') if v])
+    parser.add_argument('--external-db', action='store_true', help="usa POSTGRES_* (¡solo una base desechable!)")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
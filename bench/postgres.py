@@ -0,0 +1,84 @@
+"""Postgres desechable para el benchmark: initdb en un directorio temporal y pg_ctl.
+
+Sin fsync ni logs a disco: solo sirve para medir, nunca para guardar datos.
+"""
+import os
+import glob
+import shutil
+import socket
+import tempfile
+import subprocess
+
+import psycopg2
+
+
+def _find_bindir():
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bindir = subprocess.run([pg_config, '--bindir'], capture_output=True, text=True).stdout.strip()
+        if os.path.exists(os.path.join(bindir, 'initdb')):
+            return bindir
+    candidates = sorted(glob.glob('/usr/lib/postgresql/*/bin/initdb'))
+    if candidates:
+        return os.path.dirname(candidates[-1])
+    return None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class DisposablePostgres:
+    """Levanta un cluster temporal y expone variables POSTGRES_* para db.py."""
+
+    def __init__(self, database='jarvis_bench', user='bench'):
+        self.database = database
+        self.user = user
+        self.port = None
+        self._dir = None
+        self._bindir = None
+
+    def env(self):
+        return {
+            'POSTGRES_HOST': '127.0.0.1',
+            'POSTGRES_PORT': str(self.port),
+            'POSTGRES_DB': self.database,
+            'POSTGRES_USER': self.user,
+            'POSTGRES_PASSWORD': '',
+        }
+
+    def start(self):
+        self._bindir = _find_bindir()
+        if self._bindir is None:
+            raise RuntimeError("No se encontró initdb; instala PostgreSQL o usa --external-db")
+        self._dir = tempfile.mkdtemp(prefix='jarvis-bench-pg-')
+        data = os.path.join(self._dir, 'data')
+        self.port = _free_port()
+        self._run('initdb', '-D', data, '-U', self.user, '--auth=trust', '--encoding=UTF8', '--no-sync')
+        options = f"-p {self.port} -k {self._dir} -c listen_addresses=127.0.0.1 -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        self._run('pg_ctl', '-D', data, '-o', options, '-l', os.path.join(self._dir, 'postgres.log'), '-w', 'start')
+
+        conn = psycopg2.connect(host='127.0.0.1', port=self.port, user=self.user, dbname='postgres')
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {self.database}")
+        conn.close()
+        return self
+
+    def stop(self):
+        if self._dir is None:
+            return
+        try:
+            self._run('pg_ctl', '-D', os.path.join(self._dir, 'data'), '-m', 'immediate', 'stop')
+        finally:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    def _run(self, program, *args):
+        subprocess.run([os.path.join(self._bindir, program), *args], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
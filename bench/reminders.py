@@ -0,0 +1,150 @@
+"""Contención de reclamos de recordatorios: dos schedulers sobre las mismas alertas.
+
+Simula el solapamiento de dos réplicas líderes (p. ej. durante un relevo): ambos
+ReminderScheduler cargan el mismo horizonte y reclaman cada alerta en Postgres antes de
+enviarla. Con `--fail-rate` una parte de los envíos falla con un error de red, para
+ejercitar la liberación del reclamo y el reintento. Verifica que cada alerta se envíe
+exactamente una vez y termina con código 1 si alguna se duplica o se pierde.
+
+    python -m bench.reminders --events 500 --spread 5 --fail-rate 0.1
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+from collections import Counter
+
+from bench.postgres import DisposablePostgres
+from bench.run import CountingConnection, round_trips, git_commit
+
+
+USER_ID_BASE = 9400000000
+
+
+async def run(args):
+    import db
+    import reminders
+    from delivery import DeliveryEngine
+    from migrations import migrate
+    from telegram.error import NetworkError
+
+    original_kwargs = db._connection_kwargs
+    db._connection_kwargs = lambda: {**original_kwargs(), 'connection_factory': CountingConnection}
+    migrate()
+    await db.init_pool()
+    # Sin límites de Telegram (el envío es falso) ni reintentos en el engine: cada fallo
+    # pasa por release_reminders y vuelve al heap
+    reminders.delivery_engine = DeliveryEngine(global_rate=100000, chat_rate=1000, chat_burst=1000, max_retries=0)
+
+    def _reset(conn):
+        cur = conn.cursor()
+        cur.execute("DELETE FROM agenda_personal WHERE telegram_user_id >= %s", (USER_ID_BASE,))
+        cur.close()
+
+    def _seed(conn):
+        cur = conn.cursor()
+        # Todas las alertas caen entre `lead` y `lead + spread` segundos desde ahora
+        for i in range(args.events):
+            cur.execute("""
+                INSERT INTO agenda_personal (telegram_user_id, categoria, subcategoria, resumen, fecha_evento)
+                VALUES (%s, 'RECORDATORIO', 'Citas', %s, NOW()::timestamp + %s * INTERVAL '1 second')
+            """, (USER_ID_BASE + i % args.users, f"Evento {i}",
+                  2 * args.lead_seconds + random.uniform(0, args.spread)))
+        cur.close()
+
+    sent = Counter()
+    by_worker = Counter()
+    attempts = Counter()
+
+    def make_send(worker):
+        async def send(event, label):
+            attempts[(event['id'], label)] += 1
+            if random.random() < args.fail_rate:
+                raise NetworkError("fallo simulado")
+            sent[(event['id'], label)] += 1
+            by_worker[worker] += 1
+        return send
+
+    interval = args.lead_seconds / 60
+    workers = [
+        reminders.ReminderScheduler(make_send(worker), [interval], retry_base=args.retry_base)
+        for worker in ('a', 'b')
+    ]
+    try:
+        await db.pool.run(_reset)
+        await db.pool.run(_seed)
+        before = round_trips.value
+        await asyncio.gather(*(worker.start() for worker in workers))
+        await asyncio.sleep(2 * args.lead_seconds + args.spread + args.settle)
+        await asyncio.gather(*(worker.stop() for worker in workers))
+    finally:
+        await db.pool.run(_reset)
+        await db.close_pool()
+
+    expected = args.events
+    duplicated = [key for key, count in sent.items() if count > 1]
+    retried = [count - 1 for count in attempts.values() if count > 1]
+    return {
+        'expected': expected,
+        'sent': sum(sent.values()),
+        'unique_sent': len(sent),
+        'duplicated': len(duplicated),
+        'missing': expected - len(sent),
+        'sent_by_worker': dict(by_worker),
+        'retried_alerts': len(retried),
+        'max_retries_per_alert': max(retried) if retried else 0,
+        'db_round_trips_per_alert': round((round_trips.value - before) / expected, 2) if expected else None,
+    }
+
+
+async def main(args):
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+    try:
+        results = await run(args)
+    finally:
+        if postgres is not None:
+            postgres.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'events': args.events, 'users': args.users, 'spread': args.spread,
+                       'lead_seconds': args.lead_seconds, 'fail_rate': args.fail_rate},
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Contención de reclamos de recordatorios entre dos schedulers")
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--users', type=int, default=100, help="usuarios entre los que se reparten los eventos")
+    parser.add_argument('--spread', type=float, default=5, help="segundos en los que se reparten las alertas")
+    parser.add_argument('--lead-seconds', type=float, default=2, help="antelación de la alerta respecto del evento")
+    parser.add_argument('--fail-rate', type=float, default=0.1, help="fracción de envíos que fallan")
+    parser.add_argument('--retry-base', type=float, default=0.2, help="backoff inicial de los reintentos")
+    parser.add_argument('--settle', type=float, default=3, help="segundos extra para terminar reintentos")
+    parser.add_argument('--external-db', action='store_true', help="usa POSTGRES_* (¡solo una base desechable!)")
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    results = report['results']
+    if results['duplicated'] or results['missing']:
+        sys.exit(1)
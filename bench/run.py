@@ -0,0 +1,482 @@
+"""Benchmark de extremo a extremo del bot con OpenAI, Telegram y Postgres locales.
+
+Ejecuta los handlers reales (master_handler, button_callback, check_reminders)
+con cargas guionadas y escribe un JSON con throughput, latencias p50/p95/p99 y
+round trips a la base por update, para comparar entre commits (bench/compare.py).
+
+    python -m bench.run --users 20 --messages 5 --output bench-results.json
+
+Con `--processor sequential` los updates se atienden de a uno (sin PerUserUpdateProcessor),
+para comparar latencias p50/p99 con muchos usuarios simultáneos:
+
+    python -m bench.run --users 50 --workloads save_text,ordering --processor sequential
+"""
+import os
+import sys
+import re
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from types import SimpleNamespace
+
+import psycopg2.extensions
+
+from bench.fakes import FakeOpenAI, FakeTelegram, sample_jpeg
+from bench.postgres import DisposablePostgres
+
+
+TOKEN = "123456:BENCH"
+USER_ID_BASE = 9100000000
+ALL_WORKLOADS = ['register', 'save_text', 'query', 'fastpath', 'ordering', 'photo', 'voice', 'reminders']
+ERROR_PREFIXES = ("😵", "❌", "🚫", "⚠️ No estás")
+# Acuse del botón "cancelar": empieza con ❌ pero no es un error
+CANCEL_REPLY = "❌ Operación cancelada."
+FASTPATH_TEXTS = ("mis categorias", "mi agenda", "agenda de hoy", "busca en mi agenda bench planos")
+ORDER_RE = re.compile(r"orden (\d+) (\d+)")
+
+
+class RoundTrips:
+    """Contador de round trips a Postgres (execute, commit, rollback y fetch de cursores con nombre)."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self):
+        with self._lock:
+            self.value += 1
+
+
+round_trips = RoundTrips()
+_cursor_classes = {}
+
+
+def _counting_cursor(base):
+    if base not in _cursor_classes:
+        class CountingCursor(base):
+            def execute(self, *args, **kwargs):
+                round_trips.inc()
+                return super().execute(*args, **kwargs)
+
+            def executemany(self, *args, **kwargs):
+                round_trips.inc()
+                return super().executemany(*args, **kwargs)
+
+            def fetchmany(self, *args, **kwargs):
+                if self.name:
+                    round_trips.inc()
+                return super().fetchmany(*args, **kwargs)
+
+            def fetchall(self):
+                if self.name:
+                    round_trips.inc()
+                return super().fetchall()
+
+            def scroll(self, *args, **kwargs):
+                if self.name:
+                    round_trips.inc()
+                return super().scroll(*args, **kwargs)
+
+        _cursor_classes[base] = CountingCursor
+    return _cursor_classes[base]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        round_trips.inc()
+        return super().commit()
+
+    def rollback(self):
+        round_trips.inc()
+        return super().rollback()
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)] * 1000
+
+    return {
+        'p50': round(rank(50), 2), 'p95': round(rank(95), 2), 'p99': round(rank(99), 2),
+        'max': round(ordered[-1] * 1000, 2), 'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Harness:
+    def __init__(self, app, telegram, openai, users):
+        self.app = app
+        self.telegram = telegram
+        self.openai = openai
+        self.users = users
+        self.handler_errors = 0
+        self._update_id = 0
+        self._message_id = 0
+
+    # --- Construcción de updates con el formato de la Bot API ---
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": f"Bench{uid % 10000}", "username": f"bench_{uid}"}
+
+    def _message(self, uid, **content):
+        self._message_id += 1
+        return {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"}, "from": self._user(uid), **content,
+        }
+
+    def _update(self, **payload):
+        from telegram import Update
+
+        self._update_id += 1
+        return Update.de_json({"update_id": self._update_id, **payload}, self.app.bot)
+
+    def text(self, uid, text):
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith('/') else []
+        return self._update(message=self._message(uid, text=text, entities=entities))
+
+    def photo(self, uid):
+        sizes = [
+            {"file_id": "photo_small", "file_unique_id": "photo_small", "width": 320, "height": 240},
+            {"file_id": "photo_large", "file_unique_id": "photo_large", "width": 1600, "height": 1200},
+        ]
+        return self._update(message=self._message(uid, photo=sizes))
+
+    def voice(self, uid, duration=8):
+        voice = {"file_id": "voice", "file_unique_id": "voice", "duration": duration, "mime_type": "audio/ogg"}
+        return self._update(message=self._message(uid, voice=voice))
+
+    def callback(self, uid, data):
+        bot_message = {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"}, "from": FakeTelegram.BOT_USER, "text": "bench",
+        }
+        return self._update(callback_query={
+            "id": str(self._update_id), "from": self._user(uid), "chat_instance": str(uid),
+            "data": data, "message": bot_message,
+        })
+
+    # --- Ejecución ---
+
+    async def send(self, update, latencies):
+        """Procesa un update por el mismo camino que el polling (update processor por usuario)."""
+        started = time.perf_counter()
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        latencies.append(time.perf_counter() - started)
+
+    async def on_error(self, update, context):
+        self.handler_errors += 1
+        logging.getLogger('bench').error(f"Error en handler: {context.error!r}")
+
+    def _counters(self):
+        return (round_trips.value, sum(self.openai.calls.values()),
+                sum(v for k, v in self.telegram.calls.items() if k != 'download'), len(self.telegram.sent),
+                self.handler_errors)
+
+    def _error_replies(self, sent_before):
+        return sum(1 for _, _, _, text in self.telegram.sent[sent_before:]
+                   if text.startswith(ERROR_PREFIXES) and text != CANCEL_REPLY)
+
+    def out_of_order(self, sent_before):
+        """Usuarios cuyas confirmaciones de la carga 'ordering' llegaron fuera del orden de envío."""
+        last, broken = {}, set()
+        for _, _, _, text in self.telegram.sent[sent_before:]:
+            match = ORDER_RE.search(text)
+            if match:
+                uid, index = int(match.group(1)), int(match.group(2))
+                if index < last.get(uid, -1):
+                    broken.add(uid)
+                last[uid] = index
+        return len(broken)
+
+    async def run_workload(self, script, concurrency):
+        """Corre `script(uid, latencies)` para cada usuario, en paralelo hasta `concurrency` usuarios."""
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _user(uid):
+            async with semaphore:
+                await script(uid, latencies)
+
+        before = self._counters()
+        started = time.perf_counter()
+        await asyncio.gather(*(_user(uid) for uid in self.users))
+        elapsed = time.perf_counter() - started
+        rt, ai_calls, tg_calls, _, errors = (after - b for after, b in zip(self._counters(), before))
+        updates = len(latencies)
+        return {
+            'updates': updates,
+            'duration_s': round(elapsed, 3),
+            'throughput_per_s': round(updates / elapsed, 2) if elapsed else None,
+            'latency_ms': percentiles(latencies),
+            'db_round_trips_per_update': round(rt / updates, 2) if updates else None,
+            'openai_calls_per_update': round(ai_calls / updates, 2) if updates else None,
+            'telegram_calls_per_update': round(tg_calls / updates, 2) if updates else None,
+            'handler_errors': errors,
+            'error_replies': self._error_replies(before[3]),
+        }
+
+    # --- Cargas guionadas ---
+
+    def scripts(self, messages):
+        async def register(uid, lat):
+            await self.send(self.text(uid, "/start"), lat)
+
+        async def save_text(uid, lat):
+            for i in range(messages):
+                await self.send(self.text(uid, f"anotar tarea bench {uid}-{i} revisar planos"), lat)
+                await self.send(self.callback(uid, "save"), lat)
+
+        async def query(uid, lat):
+            for i in range(messages):
+                await self.send(self.text(uid, f"consulta bench {i}"), lat)
+                results = self.app.chat_data.get(uid, {}).get('results')
+                first_page = results['pages'].get(0) if results else None
+                if first_page and first_page[1]:
+                    await self.send(self.callback(uid, f"page:{results['token']}:1"), lat)
+
+        async def fastpath(uid, lat):
+            for i in range(messages):
+                await self.send(self.text(uid, FASTPATH_TEXTS[i % len(FASTPATH_TEXTS)]), lat)
+
+        async def ordering(uid, lat):
+            # Todos los mensajes del usuario a la vez: deben atenderse en el orden de llegada
+            await asyncio.gather(*(self.send(self.text(uid, f"anotar orden {uid} {i}"), lat) for i in range(messages)))
+
+        async def photo(uid, lat):
+            for _ in range(messages):
+                await self.send(self.photo(uid), lat)
+                await self.send(self.callback(uid, "save"), lat)
+
+        async def voice(uid, lat):
+            for _ in range(messages):
+                await self.send(self.voice(uid), lat)
+                await self.send(self.callback(uid, "cancel"), lat)
+
+        return {'register': register, 'save_text': save_text, 'query': query, 'fastpath': fastpath,
+                'ordering': ordering, 'photo': photo, 'voice': voice}
+
+    async def reminder_storm(self, per_user, lead_seconds, timeout):
+        """Inserta eventos cuya alerta de 60m vence en `lead_seconds` y mide el retraso de entrega."""
+        import db
+        from handlers import check_reminders
+        from psycopg2.extras import execute_values
+
+        rows = [(uid, f"bench_{uid}", f"bench recordatorio {uid}-{i}", 3600 + lead_seconds)
+                for uid in self.users for i in range(per_user)]
+
+        def _insert(conn):
+            cur = conn.cursor()
+            execute_values(cur, """
+                INSERT INTO agenda_personal
+                (telegram_user_id, username, categoria, subcategoria, tipo_entrada, resumen, fecha_evento, estado)
+                VALUES %s
+            """, rows, template="(%s, %s, 'RECORDATORIO', 'Citas', 'RECORDATORIO', %s, NOW() + make_interval(secs => %s), 'Open')")
+            cur.close()
+
+        before = self._counters()
+        due_at = time.monotonic() + lead_seconds
+        await db.pool.run(_insert)
+        # Con REMINDER_RECONCILE_SECONDS=0 cada check_reminders reconcilia y carga los eventos nuevos
+        await check_reminders(SimpleNamespace(application=self.app, bot=self.app.bot))
+
+        users = set(self.users)
+
+        def is_reminder(message):
+            return message[2] == 'sendMessage' and message[1] in users and 'Recordatorio en 1 HORA' in message[3]
+
+        sent_before = before[3]
+        try:
+            await self.telegram.wait_for(is_reminder, len(rows), timeout)
+        except asyncio.TimeoutError:
+            pass
+        delivered = [m for m in self.telegram.sent[sent_before:] if is_reminder(m)]
+        lags = [max(0.0, m[0] - due_at) for m in delivered]
+        rt = round_trips.value - before[0]
+        span = (delivered[-1][0] - due_at) if delivered else None
+        return {
+            'reminders': len(rows),
+            'delivered': len(delivered),
+            'delivery_lag_ms': percentiles(lags),
+            'throughput_per_s': round(len(delivered) / span, 2) if span else None,
+            'db_round_trips_per_reminder': round(rt / len(rows), 2) if rows else None,
+        }
+
+
+async def cleanup(user_ids):
+    import db
+
+    def _delete(conn):
+        cur = conn.cursor()
+        for table in ('agenda_personal', 'categorias_agenda', 'usuarios'):
+            cur.execute(f"DELETE FROM {table} WHERE telegram_user_id = ANY(%s)", (list(user_ids),))
+        cur.close()
+
+    await db.pool.run(_delete)
+
+
+async def main(args):
+    postgres = None
+    if args.external_db:
+        from dotenv import load_dotenv
+        load_dotenv()
+    else:
+        postgres = DisposablePostgres().start()
+        os.environ.update(postgres.env())
+
+    openai = await FakeOpenAI(chat_latency=args.openai_latency, whisper_latency=args.whisper_latency,
+                              jitter=args.jitter).start()
+    telegram = await FakeTelegram(latency=args.telegram_latency, files={
+        'photo_small': sample_jpeg(320, 240),
+        'photo_large': sample_jpeg(1600, 1200),
+        'voice': b"OggS" + os.urandom(24000),
+    }).start()
+
+    # Las variables deben existir antes de importar config/db/ai (se leen al importar)
+    os.environ.update({
+        'OPENAI_BASE_URL': f"{openai.url}/v1",
+        'OPENAI_API_KEY': 'bench',
+        'TELEGRAM_TOKEN': TOKEN,
+        'METRICS_PORT': '0',
+        'AI_CACHE_PERSIST': '0',
+        'REMINDER_RECONCILE_SECONDS': '0',
+    })
+
+    import db
+    import main as bot_main
+    from telegram.ext import ApplicationBuilder
+    from concurrency import PerUserUpdateProcessor
+    from metrics import InstrumentedRequest
+    from migrations import migrate
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    original_kwargs = db._connection_kwargs
+    db._connection_kwargs = lambda: {**original_kwargs(), 'connection_factory': CountingConnection}
+
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f"{telegram.url}/bot")
+        .base_file_url(f"{telegram.url}/file/bot")
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(PerUserUpdateProcessor(args.concurrency) if args.processor == 'per_user' else False)
+        .updater(None)
+        .build()
+    )
+    bot_main.add_handlers(app)
+
+    users = [USER_ID_BASE + i for i in range(args.users)]
+    harness = Harness(app, telegram, openai, users)
+    app.add_error_handler(harness.on_error)
+
+    migrate()
+    await app.initialize()
+    await app.update_processor.initialize()
+    await bot_main.post_init(app)
+
+    results = {}
+    try:
+        if args.external_db:
+            await cleanup(users)
+        scripts = harness.scripts(args.messages)
+        for name in args.workloads:
+            if name == 'reminders':
+                results[name] = await harness.reminder_storm(args.reminders_per_user, args.reminder_lead, args.timeout)
+            else:
+                sent_before = len(telegram.sent)
+                results[name] = await harness.run_workload(scripts[name], args.concurrency)
+                if name == 'ordering':
+                    results[name]['out_of_order_users'] = harness.out_of_order(sent_before)
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    finally:
+        await cleanup(users)
+        await bot_main.post_shutdown(app)
+        await app.update_processor.shutdown()
+        await app.shutdown()
+        await telegram.stop()
+        await openai.stop()
+        if postgres is not None:
+            postgres.stop()
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {
+                'users': args.users, 'messages': args.messages, 'concurrency': args.concurrency,
+                'processor': args.processor,
+                'openai_latency': args.openai_latency, 'whisper_latency': args.whisper_latency,
+                'telegram_latency': args.telegram_latency, 'reminders_per_user': args.reminders_per_user,
+                'db_pool_max': int(os.getenv('DB_POOL_MAX', '10')),
+            },
+        },
+        'workloads': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del bot")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5, help="mensajes por usuario en cada carga")
+    parser.add_argument('--concurrency', type=int, default=32, help="usuarios simultáneos y MAX_CONCURRENT_UPDATES")
+    parser.add_argument('--processor', choices=('per_user', 'sequential'), default='per_user',
+                        help="per_user: PerUserUpdateProcessor; sequential: un update a la vez")
+    parser.add_argument('--workloads', default=','.join(ALL_WORKLOADS),
+                        type=lambda value: [w for w in value.split(',') if w])
+    parser.add_argument('--openai-latency', type=float, default=0.8)
+    parser.add_argument('--whisper-latency', type=float, default=1.2)
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.2, help="desviación relativa de la latencia simulada")
+    parser.add_argument('--reminders-per-user', type=int, default=10)
+    parser.add_argument('--reminder-lead', type=float, default=5.0, help="segundos hasta que vencen las alertas")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--external-db', action='store_true',
+                        help="usa POSTGRES_* del entorno/.env (¡solo una base desechable!) en vez de initdb")
+    parser.add_argument('--output', help="archivo JSON de salida (por defecto stdout)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(ALL_WORKLOADS)
+    if unknown:
+        parser.error(f"cargas desconocidas: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    # Las cargas guionadas no deberían recibir respuestas de error: una regresión así no
+    # se ve en las latencias, así que la corrida falla
+    failed = [name for name, result in report['workloads'].items()
+              if result.get('error_replies') or result.get('handler_errors')]
+    if failed:
+        print(f"Cargas con respuestas de error: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
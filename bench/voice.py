@@ -0,0 +1,162 @@
+"""Prueba del pipeline de voz contra un servidor local de transcripción.
+
+Un FakeOpenAI modificado responde a cada tramo con su índice ("tramo 3") tras una
+latencia aleatoria, de modo que los tramos terminan desordenados. Se verifica:
+
+- nota corta: una sola llamada a Whisper (camino directo);
+- nota larga (requiere ffmpeg): varios tramos cortados en silencios, transcritos en
+  paralelo y unidos en orden;
+- ningún archivo temporal en todo el camino;
+- tiempos por etapa (download, transcode, transcribe, classify).
+
+Termina con código 1 si algún chequeo falla.
+
+    python -m bench.voice --long-seconds 240 --whisper-latency 0.5
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+from bench.fakes import FakeOpenAI, FakeTelegram
+from bench.run import TOKEN, git_commit
+
+
+_FILENAME_RE = re.compile(rb'filename="voice(?:_(\d+))?\.ogg"')
+
+
+class StubTranscriber(FakeOpenAI):
+    """Transcribe cada archivo como "tramo N" (o "nota corta") con latencia aleatoria."""
+
+    async def handle(self, method, path, headers, body):
+        if not path.endswith("/audio/transcriptions"):
+            return await super().handle(method, path, headers, body)
+        self.calls['transcriptions'] += 1
+        match = _FILENAME_RE.search(body)
+        await asyncio.sleep(random.uniform(0, 2 * self.whisper_latency))
+        if match is None:
+            return self.json_response({"error": {"message": "archivo sin nombre"}}, "400 Bad Request")
+        index = match.group(1)
+        return self.json_response({"text": "nota corta" if index is None else f"tramo {index}"})
+
+
+def synth_voice(seconds, speech=8, pause=1.5):
+    """OGG/Opus con tono de `speech` segundos seguido de `pause` segundos de silencio, en bucle."""
+    period = speech + pause
+    return subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+        "-i", f"sine=frequency=220:duration={seconds}",
+        "-af", f"volume='if(lt(mod(t,{period}),{speech}),1,0)':eval=frame",
+        "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1",
+    ], capture_output=True, check=True).stdout
+
+
+async def run_case(bot, openai, file_id, duration, user_id):
+    from ai import process_with_ai
+    from audio import transcribe_voice
+
+    calls_before = openai.calls['transcriptions']
+    timings = {}
+    started = time.perf_counter()
+    voice_file = await bot.get_file(file_id)
+    audio_bytes = bytes(await voice_file.download_as_bytearray())
+    timings['download'] = time.perf_counter() - started
+
+    text = await transcribe_voice(audio_bytes, duration=duration, timings=timings, user_id=user_id)
+    # La clasificación usa el mismo camino que master_handler
+    result = await process_with_ai('text', text, "2026-01-01 10:00", user_id, "bench", "TRABAJO: General",
+                                   timings=timings)
+    return {
+        'duration_s': duration,
+        'transcriptions': openai.calls['transcriptions'] - calls_before,
+        'text': text,
+        'intent': (result or {}).get('intent'),
+        'timings_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+    }
+
+
+async def main(args):
+    openai = await StubTranscriber(chat_latency=args.chat_latency, whisper_latency=args.whisper_latency,
+                                   jitter=0).start()
+    files = {'short': b"OggS" + os.urandom(16000)}
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    if has_ffmpeg:
+        files['long'] = synth_voice(args.long_seconds)
+    telegram = await FakeTelegram(latency=args.telegram_latency, files=files).start()
+    os.environ.update({
+        'OPENAI_BASE_URL': f"{openai.url}/v1",
+        'OPENAI_API_KEY': 'bench',
+        'AI_CACHE_PERSIST': '0',
+    })
+
+    from telegram import Bot
+
+    # Cualquier archivo temporal en el camino de la voz es un error
+    temp_files = []
+    originals = (tempfile.NamedTemporaryFile, tempfile.mkstemp)
+
+    def _track(original):
+        def wrapper(*a, **kw):
+            temp_files.append(original.__name__)
+            return original(*a, **kw)
+        return wrapper
+
+    tempfile.NamedTemporaryFile, tempfile.mkstemp = (_track(fn) for fn in originals)
+    bot = Bot(TOKEN, base_url=f"{telegram.url}/bot", base_file_url=f"{telegram.url}/file/bot")
+    results, checks = {}, {}
+    try:
+        async with bot:
+            short = results['short'] = await run_case(bot, openai, 'short', 8, 1)
+            checks['short_single_shot'] = short['transcriptions'] == 1 and short['text'] == "nota corta"
+            if has_ffmpeg:
+                long = results['long'] = await run_case(bot, openai, 'long', args.long_seconds, 2)
+                expected = " ".join(f"tramo {i}" for i in range(long['transcriptions']))
+                checks['long_chunked'] = long['transcriptions'] > 1
+                checks['long_in_order'] = long['text'] == expected
+                checks['long_timings'] = {'download', 'transcode', 'transcribe', 'classify'} <= set(long['timings_ms'])
+            else:
+                results['long'] = {'skipped': "ffmpeg no disponible"}
+    finally:
+        tempfile.NamedTemporaryFile, tempfile.mkstemp = originals
+        await telegram.stop()
+        await openai.stop()
+    checks['no_temp_files'] = not temp_files
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'long_seconds': args.long_seconds, 'whisper_latency': args.whisper_latency,
+                       'chat_latency': args.chat_latency, 'ffmpeg': has_ffmpeg},
+        },
+        'cases': results,
+        'checks': checks,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pipeline de voz contra un servidor local de transcripción")
+    parser.add_argument('--long-seconds', type=int, default=240, help="duración de la nota larga sintética")
+    parser.add_argument('--whisper-latency', type=float, default=0.5, help="latencia media por tramo")
+    parser.add_argument('--chat-latency', type=float, default=0.1)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if not all(report['checks'].values()):
+        sys.exit(1)
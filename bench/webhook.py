@@ -0,0 +1,207 @@
+"""Latencia de update a handler: polling (getUpdates) frente a webhook.
+
+Un FakeTelegram hace de Telegram en los dos modos: en polling encola los updates y
+responde a getUpdates con long polling; en webhook los envía por POST al servidor
+embebido de PTB con el secret token (hasta 40 conexiones, como Telegram). En ambos
+casos se suma `--latency` de red por entrega. El handler solo registra la llegada,
+así se mide la ingesta y no el trabajo del bot. También verifica que un POST con un
+secret incorrecto se rechace.
+
+    python -m bench.webhook --users 50 --updates 2000 --rate 200
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+
+from bench.fakes import FakeTelegram
+from bench.run import TOKEN, USER_ID_BASE, percentiles, git_commit
+
+
+SECRET = "bench-secret"
+WEBHOOK_CONNECTIONS = 40
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class UpdateSource(FakeTelegram):
+    """FakeTelegram con getUpdates (long polling) sobre una cola de updates."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pending = []
+        self._arrived = asyncio.Event()
+
+    def push(self, update):
+        self.pending.append(update)
+        self._arrived.set()
+
+    async def handle(self, method, path, headers, body):
+        if not path.endswith('/getUpdates'):
+            return await super().handle(method, path, headers, body)
+        self.calls['getUpdates'] += 1
+        params = self._params(headers, body)
+        offset = params.get('offset') or 0
+        self.pending = [u for u in self.pending if u['update_id'] >= offset]
+        if not self.pending:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[:int(params.get('limit') or 100)]
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return self.json_response({"ok": True, "result": batch})
+
+
+def make_update(update_id, uid):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"Bench{uid % 10000}"},
+            "text": f"mensaje {update_id}",
+        },
+    }
+
+
+async def run_mode(mode, args):
+    import httpx
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, ApplicationHandlerStop, TypeHandler
+    from concurrency import PerUserUpdateProcessor
+    from main import ALLOWED_UPDATES
+
+    telegram = await UpdateSource(latency=args.latency).start()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f"{telegram.url}/bot")
+        .concurrent_updates(PerUserUpdateProcessor(args.concurrency))
+        .build()
+    )
+    total = args.updates
+    sent_at, arrived_at = {}, {}
+    all_arrived = asyncio.Event()
+
+    async def on_update(update, context):
+        arrived_at[update.update_id] = time.perf_counter()
+        if len(arrived_at) >= total:
+            all_arrived.set()
+        raise ApplicationHandlerStop
+
+    app.add_handler(TypeHandler(Update, on_update), group=-1)
+    await app.initialize()
+    port = _free_port()
+    if mode == 'polling':
+        await app.updater.start_polling(poll_interval=0.0, timeout=args.poll_timeout, allowed_updates=ALLOWED_UPDATES)
+    else:
+        await app.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='telegram',
+            webhook_url=f"http://127.0.0.1:{port}/telegram", secret_token=SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    await app.start()
+
+    webhook_url = f"http://127.0.0.1:{port}/telegram"
+    rejected_status = None
+    limits = httpx.Limits(max_connections=WEBHOOK_CONNECTIONS, max_keepalive_connections=WEBHOOK_CONNECTIONS)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        if mode == 'webhook':
+            response = await client.post(webhook_url, json=make_update(0, USER_ID_BASE),
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': 'incorrecto'})
+            rejected_status = response.status_code
+
+        async def deliver(update):
+            sent_at[update['update_id']] = time.perf_counter()
+            if mode == 'polling':
+                telegram.push(update)
+                return
+            if args.latency > 0:
+                await asyncio.sleep(args.latency)
+            await client.post(webhook_url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+
+        calls_before = telegram.calls['getUpdates']
+        tasks = []
+        started = time.perf_counter()
+        for i in range(total):
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = make_update(i + 1, USER_ID_BASE + i % args.users)
+            tasks.append(asyncio.create_task(deliver(update)))
+        await asyncio.gather(*tasks)
+        try:
+            await asyncio.wait_for(all_arrived.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        polls = telegram.calls['getUpdates'] - calls_before
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    await telegram.stop()
+
+    latencies = [arrived_at[update_id] - sent_at[update_id] for update_id in arrived_at if update_id in sent_at]
+    result = {
+        'updates': total,
+        'received': len(latencies),
+        'duration_s': round(elapsed, 3),
+        'update_to_handler_ms': percentiles(latencies),
+    }
+    if mode == 'polling':
+        result['get_updates_calls'] = polls
+        result['updates_per_poll'] = round(len(latencies) / polls, 2) if polls else None
+    else:
+        result['bad_secret_status'] = rejected_status
+    return result
+
+
+async def main(args):
+    os.environ.update({'TELEGRAM_TOKEN': TOKEN, 'METRICS_PORT': '0'})
+    results = {}
+    for mode in args.modes:
+        results[mode] = await run_mode(mode, args)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'config': {'updates': args.updates, 'users': args.users, 'rate': args.rate, 'latency': args.latency,
+                       'concurrency': args.concurrency, 'poll_timeout': args.poll_timeout},
+        },
+        'modes': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latencia de update a handler: polling frente a webhook")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=200, help="updates por segundo que envía Telegram")
+    parser.add_argument('--latency', type=float, default=0.03, help="latencia de red simulada por entrega")
+    parser.add_argument('--concurrency', type=int, default=32, help="MAX_CONCURRENT_UPDATES")
+    parser.add_argument('--poll-timeout', type=int, default=10, help="timeout de long polling de getUpdates")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--modes', default='polling,webhook',
+                        type=lambda value: [m for m in value.split(',') if m in ('polling', 'webhook')])
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,145 @@
+import os
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Cache LRU en memoria con expiración por TTL y contadores de aciertos/fallos."""
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Retorna el valor vigente (o _MISSING) sin tocar los contadores. Requiere el lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class UserCache(TTLCache):
+    """Estado por telegram_user_id: registro y texto de categorías ya renderizado."""
+
+    def get_field(self, user_id, field):
+        with self._lock:
+            entry = self._lookup(user_id)
+            if entry is _MISSING or field not in entry:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[field]
+
+    def set_field(self, user_id, field, value):
+        with self._lock:
+            entry = self._lookup(user_id)
+            current = {} if entry is _MISSING else dict(entry)
+        current[field] = value
+        self.set(user_id, current)
+
+
+class ResponseCache:
+    """Cache de respuestas de la IA en dos niveles: memoria (LRU+TTL) y, opcionalmente,
+    un backend persistente con métodos async get(key) / set(key, response, latency, ttl).
+
+    Solo se cachean intents sin efectos directos (ver CACHEABLE_INTENTS): QUERY guarda
+    el SQL, no los resultados, y SAVE vuelve a pasar por la tarjeta de confirmación.
+    """
+
+    CACHEABLE_INTENTS = {'QUERY', 'SAVE'}
+
+    def __init__(self, maxsize=2000, ttl=3600.0, backend=None):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.backend = backend
+        self.stats = Counter()
+
+    @staticmethod
+    def make_key(user_id, normalized_input, categorias, date_bucket):
+        cat_hash = hashlib.sha1(categorias.encode('utf-8')).hexdigest()
+        raw = f"{user_id}|{normalized_input}|{cat_hash}|{date_bucket}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.backend is not None:
+            entry = await self.backend.get(key)
+            if entry is not None:
+                self.stats['backend_hits'] += 1
+                self.memory.set(key, entry)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        response, latency = entry
+        self.stats['hits'] += 1
+        self.stats['latency_saved_ms'] += int(latency * 1000)
+        return copy.deepcopy(response)
+
+    async def set(self, key, response, latency):
+        if not response or response.get('intent') not in self.CACHEABLE_INTENTS:
+            return
+        entry = (response, latency)
+        self.memory.set(key, entry)
+        if self.backend is not None:
+            await self.backend.set(key, response, latency, self.memory.ttl)
+
+    def hit_ratio(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+
+user_cache = UserCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '5000')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '600')),
+)
@@ -0,0 +1,118 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+from utils import normalize_text
+from cache import TTLCache
+
+
+NGRAM_SIZES = (3, 4)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def char_ngrams(text):
+    """N-gramas de caracteres por palabra, con bordes marcados: 'box003' -> ' bo', 'box', ..."""
+    grams = Counter()
+    for word in _NON_WORD_RE.sub(" ", normalize_text(text)).split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(max(1, len(padded) - n + 1)):
+                grams[padded[i:i + n]] += 1
+    return grams
+
+
+class CategoryIndex:
+    """Índice TF-IDF de n-gramas de caracteres sobre las subcategorías de un usuario.
+
+    Los n-gramas toleran errores de tipeo, plurales y códigos parciales ("box3" vs
+    "Box003"). update() aplica solo las filas agregadas o eliminadas; los pesos IDF y
+    las normas se recalculan de forma perezosa en la siguiente búsqueda.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._df = Counter()
+        self._norms = {}
+        self._dirty = False
+        self.source = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def update(self, rows):
+        """Sincroniza el índice con `rows` [(categoria, subcategoria), ...]; retorna (agregadas, eliminadas)."""
+        self.source = rows
+        wanted = set(rows)
+        removed = [row for row in self._docs if row not in wanted]
+        added = [row for row in wanted if row not in self._docs]
+        for row in removed:
+            for gram in self._docs.pop(row):
+                del self._postings[gram][row]
+                self._df[gram] -= 1
+                if not self._df[gram]:
+                    del self._df[gram], self._postings[gram]
+        for row in added:
+            # La categoría pesa menos que la subcategoría, que es lo que se elige
+            grams = char_ngrams(row[1])
+            grams.update({gram: 0.5 * count for gram, count in char_ngrams(row[0]).items()})
+            self._docs[row] = grams
+            for gram, count in grams.items():
+                self._postings[gram][row] = count
+                self._df[gram] += 1
+        if removed or added:
+            self._dirty = True
+        return len(added), len(removed)
+
+    def _idf(self, gram):
+        return math.log((1 + len(self._docs)) / (1 + self._df[gram])) + 1
+
+    def _refresh_norms(self):
+        self._norms = {
+            row: math.sqrt(sum((count * self._idf(gram)) ** 2 for gram, count in grams.items())) or 1.0
+            for row, grams in self._docs.items()
+        }
+        self._dirty = False
+
+    def search(self, text, k):
+        """Las `k` filas más parecidas a `text` por similitud coseno, de mayor a menor."""
+        if self._dirty:
+            self._refresh_norms()
+        scores = Counter()
+        for gram, count in char_ngrams(text).items():
+            postings = self._postings.get(gram)
+            if not postings:
+                continue
+            weight = count * self._idf(gram) ** 2
+            for row, doc_count in postings.items():
+                scores[row] += weight * doc_count
+        ranked = sorted(scores, key=lambda row: (-scores[row] / self._norms[row], row))
+        return ranked[:k]
+
+
+class CategoryIndexes:
+    """Un CategoryIndex por usuario, independiente del cache de usuario.
+
+    Cuando cambian las categorías el cache de usuario se invalida y se recargan las
+    filas, pero el índice sobrevive y solo aplica la diferencia.
+    """
+
+    def __init__(self, maxsize=5000, ttl=86400.0):
+        self._indexes = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def shortlist(self, user_id, rows, text, k):
+        index = self._indexes.get(user_id)
+        if index is None:
+            index = CategoryIndex()
+            self._indexes.set(user_id, index)
+        # Mientras el cache de usuario devuelva la misma lista no hay nada que sincronizar
+        if index.source is not rows:
+            index.update(rows)
+        return index.search(text, k)
+
+    def stats(self):
+        return self._indexes.stats()
+
+
+category_indexes = CategoryIndexes()
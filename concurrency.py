@@ -0,0 +1,87 @@
+import time
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+from config import logger
+from metrics import counter
+
+
+dropped_updates_total = counter('jarvis_updates_dropped_total', 'Updates descartados por exceso de pendientes del usuario')
+
+DROPPED_NOTICE = "⏳ Tienes demasiados mensajes pendientes. Espera a que responda los anteriores y vuelve a enviar este."
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Procesa updates de distintos usuarios en paralelo y los de un mismo usuario en orden.
+
+    Cada usuario tiene un asyncio.Lock (FIFO), así los mensajes y botones de una persona
+    no se intercalan y su estado en context.user_data (state, pending_save, pending_sql)
+    no se corrompe. El lock se toma antes que el semáforo global, de modo que un usuario
+    con muchos mensajes en cola no ocupa cupos de `max_concurrent_updates` mientras espera.
+    Pasados `max_pending_per_user` updates en cola se descartan los nuevos y se avisa al
+    usuario, como mucho una vez cada `notice_interval` segundos.
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_per_user=20, notice_interval=30.0):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_user = max_pending_per_user
+        self.notice_interval = notice_interval
+        self._locks = {}
+        self._pending = {}
+        self._last_notice = {}
+
+    @staticmethod
+    def _user_key(update):
+        user = getattr(update, 'effective_user', None)
+        return user.id if user is not None else None
+
+    async def process_update(self, update, coroutine):
+        user_id = self._user_key(update)
+        if user_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        pending = self._pending.get(user_id, 0)
+        if pending >= self.max_pending_per_user:
+            # Backpressure: se descarta el exceso de un mismo usuario en vez de acumular tareas
+            coroutine.close()
+            dropped_updates_total.inc()
+            logger.warning(f"Update descartado: {pending} pendientes para user_id {user_id}")
+            await self._notify_dropped(update, user_id)
+            return
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._pending[user_id] = pending + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._pending[user_id] -= 1
+            if self._pending[user_id] == 0:
+                del self._pending[user_id]
+                self._locks.pop(user_id, None)
+
+    async def _notify_dropped(self, update, user_id):
+        now = time.monotonic()
+        if now - self._last_notice.get(user_id, float('-inf')) < self.notice_interval:
+            return
+        # Solo se recuerdan los avisos recientes
+        self._last_notice = {uid: t for uid, t in self._last_notice.items() if now - t < self.notice_interval}
+        self._last_notice[user_id] = now
+        message = update.effective_message
+        if message is None:
+            return
+        try:
+            await message.reply_text(DROPPED_NOTICE)
+        except Exception as e:
+            logger.error(f"Error avisando descarte a user_id {user_id}: {e}")
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
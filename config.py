@@ -8,4 +8,5 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Los reintentos los gestiona ai_scheduler (backoff con retry-after y deadlines)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
@@ -1,11 +1,23 @@
 import os
+import re
+import json
+import time
+import uuid
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import Json, execute_values
 from config import logger
+from cache import user_cache
+from category_index import category_indexes
+from metrics import timed
 
 
-def get_db_connection():
-    conn = psycopg2.connect(
+def _connection_kwargs():
+    return dict(
         host=os.getenv('POSTGRES_HOST'),
         database=os.getenv('POSTGRES_DB'),
         user=os.getenv('POSTGRES_USER'),
@@ -13,9 +25,138 @@ def get_db_connection():
         port=os.getenv('POSTGRES_PORT', '5432'),
         options="-c timezone=America/Lima"
     )
+
+
+def get_db_connection():
+    conn = psycopg2.connect(**_connection_kwargs())
     return conn
 
 
+class DatabasePool:
+    """Pool compartido de conexiones psycopg2 usable desde corrutinas.
+
+    Las llamadas bloqueantes de psycopg2 se ejecutan en hilos (asyncio.to_thread)
+    para no detener el event loop del bot. Un semáforo limita las conexiones en
+    uso a `maxconn` y permite aplicar un timeout de adquisición.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, acquire_timeout=10.0, health_check_interval=30.0, **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._conn_kwargs = conn_kwargs
+        self._pool = None
+        self._semaphore = None
+        self._last_used = {}
+
+    async def open(self):
+        self._semaphore = asyncio.Semaphore(self.maxconn)
+        self._pool = await asyncio.to_thread(
+            pg_pool.ThreadedConnectionPool, self.minconn, self.maxconn, **self._conn_kwargs
+        )
+        logger.info(f"Pool DB abierto (min={self.minconn}, max={self.maxconn})")
+
+    async def close(self):
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.closeall)
+            self._pool = None
+            self._last_used.clear()
+
+    def _is_healthy(self, conn):
+        """Descarta conexiones cerradas; hace ping solo si la conexión estuvo ociosa."""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _getconn(self):
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("No se pudo obtener una conexión sana del pool")
+
+    def _putconn(self, conn, broken=False):
+        if broken or conn.closed:
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._pool is None:
+            raise RuntimeError("El pool de base de datos no está inicializado")
+        await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        broken = False
+        try:
+            conn = await asyncio.to_thread(self._getconn)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            try:
+                await asyncio.to_thread(self._putconn, conn, broken)
+            finally:
+                self._semaphore.release()
+
+    async def run(self, fn, *args):
+        """Ejecuta fn(conn, *args) en un hilo con una conexión del pool, dentro de una transacción."""
+        async with self.connection() as conn:
+            return await asyncio.to_thread(_run_in_transaction, conn, fn, *args)
+
+
+def _run_in_transaction(conn, fn, *args):
+    try:
+        result = fn(conn, *args)
+        conn.commit()
+        return result
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+
+
+pool = None
+
+
+async def init_pool():
+    global pool
+    pool = DatabasePool(
+        minconn=int(os.getenv('DB_POOL_MIN', '1')),
+        maxconn=int(os.getenv('DB_POOL_MAX', '10')),
+        acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        health_check_interval=float(os.getenv('DB_POOL_HEALTH_INTERVAL', '30')),
+        **_connection_kwargs()
+    )
+    await pool.open()
+    return pool
+
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
 DEFAULT_CATEGORIES = {
     "TRABAJO": ["General", "Reuniones", "Pendientes", "Proyectos"],
     "ENTRETENIMIENTO": ["Películas", "Series", "Música", "Libros", "Videojuegos"],
@@ -24,226 +165,905 @@ DEFAULT_CATEGORIES = {
 }
 
 
-def init_db():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+def _default_category_rows(users):
+    """Filas (telegram_user_id, username, categoria, subcategoria) de las categorías por defecto."""
+    return [
+        (telegram_user_id, username, categoria, sub)
+        for telegram_user_id, username in users
+        for categoria, subcategorias in DEFAULT_CATEGORIES.items()
+        for sub in subcategorias
+    ]
 
-        # Tabla Principal
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS agenda_personal (
-                id SERIAL PRIMARY KEY,
-                telegram_user_id BIGINT,
-                username VARCHAR(100),
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                categoria VARCHAR(50),
-                subcategoria VARCHAR(100),
-                tipo_entrada VARCHAR(50),
-                resumen TEXT,
-                contenido_completo TEXT,
-                fecha_evento TIMESTAMP,
-                datos_extra JSONB,
-                estado VARCHAR(20) DEFAULT 'Open'
-            );
-        """)
-
-        # Tabla de usuarios
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id SERIAL PRIMARY KEY,
-                telegram_user_id BIGINT UNIQUE NOT NULL,
-                username VARCHAR(100),
-                nombre VARCHAR(200),
-                fecha_registro TIMESTAMP DEFAULT NOW(),
-                estado VARCHAR(20) DEFAULT 'ACTIVO'
-            );
-        """)
-
-        # Tabla de categorías por usuario
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS categorias_agenda (
-                id SERIAL PRIMARY KEY,
-                telegram_user_id BIGINT NOT NULL,
-                username VARCHAR(100),
-                categoria VARCHAR(50) NOT NULL,
-                subcategoria VARCHAR(100) NOT NULL,
-                estado VARCHAR(20) DEFAULT 'ACTIVO'
-            );
-        """)
-
-        # Migraciones
-        cur.execute("""
-            DO $$
-            BEGIN
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='agenda_personal' AND column_name='username') THEN
-                    ALTER TABLE agenda_personal ADD COLUMN username VARCHAR(100);
-                END IF;
-
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='agenda_personal' AND column_name='tipo_entrada') THEN
-                    ALTER TABLE agenda_personal ADD COLUMN tipo_entrada VARCHAR(50);
-                END IF;
-
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='categorias_agenda' AND column_name='telegram_user_id') THEN
-                    ALTER TABLE categorias_agenda ADD COLUMN telegram_user_id BIGINT;
-                END IF;
-
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='agenda_personal' AND column_name='notificaciones_enviadas') THEN
-                    ALTER TABLE agenda_personal ADD COLUMN notificaciones_enviadas JSONB DEFAULT '[]'::jsonb;
-                END IF;
-            END $$;
-        """)
 
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Error DB init: {e}")
+def _insert_default_categories(cur, users):
+    execute_values(cur, """
+        INSERT INTO categorias_agenda (telegram_user_id, username, categoria, subcategoria)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+    """, _default_category_rows(users), page_size=1000)
 
 
-def register_user(telegram_user_id, username, nombre):
+async def register_user(telegram_user_id, username, nombre):
     """Registra un usuario nuevo o actualiza sus datos si ya existe. Retorna True si es nuevo."""
-    try:
-        conn = get_db_connection()
+    def _register(conn):
         cur = conn.cursor()
+        # xmax = 0 solo en filas recién insertadas (no en las actualizadas por ON CONFLICT)
+        cur.execute("""
+            INSERT INTO usuarios (telegram_user_id, username, nombre)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (telegram_user_id) DO UPDATE
+                SET username = EXCLUDED.username, nombre = EXCLUDED.nombre
+            RETURNING (xmax = 0) AS inserted
+        """, (telegram_user_id, username, nombre))
+        inserted = cur.fetchone()[0]
+        if inserted:
+            _insert_default_categories(cur, [(telegram_user_id, username)])
+        cur.close()
+        return inserted
 
-        cur.execute("SELECT id FROM usuarios WHERE telegram_user_id = %s", (telegram_user_id,))
-        existing = cur.fetchone()
-
-        if existing:
-            cur.execute(
-                "UPDATE usuarios SET username = %s, nombre = %s WHERE telegram_user_id = %s",
-                (username, nombre, telegram_user_id)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
-            return False
+    try:
+        return await pool.run(_register)
+    except Exception as e:
+        logger.error(f"Error registro usuario: {e}")
+        return False
+    finally:
+        user_cache.invalidate(telegram_user_id)
 
-        cur.execute(
-            "INSERT INTO usuarios (telegram_user_id, username, nombre) VALUES (%s, %s, %s)",
-            (telegram_user_id, username, nombre)
-        )
 
-        for categoria, subcategorias in DEFAULT_CATEGORIES.items():
-            for sub in subcategorias:
-                cur.execute("""
-                    INSERT INTO categorias_agenda (telegram_user_id, username, categoria, subcategoria)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (telegram_user_id, username, categoria, sub))
+async def bulk_register_users(users, batch_size=1000):
+    """Registra o actualiza usuarios en lotes, cada lote en su propia transacción.
 
-        conn.commit()
+    `users` es un iterable de (telegram_user_id, username, nombre). A los nuevos se les
+    crean las categorías por defecto. Retorna (insertados, actualizados).
+    """
+    def _register_batch(conn, batch):
+        cur = conn.cursor()
+        rows = execute_values(cur, """
+            INSERT INTO usuarios (telegram_user_id, username, nombre)
+            VALUES %s
+            ON CONFLICT (telegram_user_id) DO UPDATE
+                SET username = EXCLUDED.username, nombre = EXCLUDED.nombre
+            RETURNING telegram_user_id, username, (xmax = 0) AS inserted
+        """, batch, page_size=len(batch), fetch=True)
+        new_users = [(uid, username) for uid, username, inserted in rows if inserted]
+        if new_users:
+            _insert_default_categories(cur, new_users)
         cur.close()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error registro usuario: {e}")
-        return False
+        return len(new_users), len(rows) - len(new_users)
+
+    totals = [0, 0]
+    batch = {}
+
+    async def _flush():
+        added, changed = await pool.run(_register_batch, list(batch.values()))
+        totals[0] += added
+        totals[1] += changed
+        for uid in batch:
+            user_cache.invalidate(uid)
+        batch.clear()
 
+    for telegram_user_id, username, nombre in users:
+        # ON CONFLICT DO UPDATE no admite el mismo id dos veces en una sentencia: gana el último
+        batch[int(telegram_user_id)] = (int(telegram_user_id), username, nombre)
+        if len(batch) >= batch_size:
+            await _flush()
+    if batch:
+        await _flush()
+    return totals[0], totals[1]
 
-def is_user_registered(telegram_user_id):
+
+@timed('is_user_registered')
+async def is_user_registered(telegram_user_id):
     """Verifica si un usuario está registrado y activo."""
-    try:
-        conn = get_db_connection()
+    def _check(conn):
         cur = conn.cursor()
         cur.execute("SELECT estado FROM usuarios WHERE telegram_user_id = %s", (telegram_user_id,))
         row = cur.fetchone()
         cur.close()
-        conn.close()
-        return row is not None and row[0] == 'ACTIVO'
+        return row
+
+    cached = user_cache.get_field(telegram_user_id, 'registered')
+    if cached is not None:
+        return cached
+
+    try:
+        row = await pool.run(_check)
+        registered = row is not None and row[0] == 'ACTIVO'
+        user_cache.set_field(telegram_user_id, 'registered', registered)
+        return registered
     except Exception as e:
         logger.error(f"Error verificando usuario: {e}")
         return False
 
 
-def get_upcoming_reminders(minutes_before, tolerance=1):
-    """Busca eventos que estén a 'minutes_before' minutos de ocurrir (±tolerance)."""
+async def get_active_user_ids():
+    """telegram_user_id de todos los usuarios activos (destinatarios de una difusión)."""
+    def _fetch(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT telegram_user_id FROM usuarios WHERE estado = 'ACTIVO' ORDER BY telegram_user_id")
+        rows = cur.fetchall()
+        cur.close()
+        return [row[0] for row in rows]
+
     try:
-        conn = get_db_connection()
+        return await pool.run(_fetch)
+    except Exception as e:
+        logger.error(f"Error obteniendo usuarios activos: {e}")
+        return []
+
+
+async def get_reminder_schedule(minutes_list, horizon_minutes, telegram_user_id=None, record_id=None, grace_minutes=1):
+    """Eventos con alertas pendientes dentro del horizonte, con los segundos que faltan para cada uno.
+
+    Se puede acotar a un usuario o a un registro para refrescos incrementales.
+    Retorna None si la consulta falla.
+    """
+    max_minutes = horizon_minutes + max(minutes_list)
+
+    def _fetch(conn):
         cur = conn.cursor()
-        label = f"{minutes_before}m"
-        min_minutes = minutes_before - tolerance
-        max_minutes = minutes_before + tolerance
-        cur.execute("""
-            SELECT id, telegram_user_id, categoria, subcategoria, resumen, fecha_evento
+        filters = ""
+        params = [grace_minutes, max_minutes]
+        if record_id is not None:
+            filters += " AND id = %s"
+            params.append(record_id)
+        if telegram_user_id is not None:
+            filters += " AND telegram_user_id = %s"
+            params.append(telegram_user_id)
+        cur.execute(f"""
+            SELECT id, telegram_user_id, categoria, subcategoria, resumen, fecha_evento,
+                   COALESCE(notificaciones_enviadas, '[]'::jsonb) AS notificaciones_enviadas,
+                   EXTRACT(EPOCH FROM (fecha_evento - NOW()::timestamp)) AS seconds_until
             FROM agenda_personal
             WHERE fecha_evento IS NOT NULL
               AND estado != 'Closed'
-              AND fecha_evento BETWEEN NOW() + (%s * INTERVAL '1 minute')
+              AND fecha_evento BETWEEN NOW() - (%s * INTERVAL '1 minute')
                                     AND NOW() + (%s * INTERVAL '1 minute')
-              AND NOT COALESCE(notificaciones_enviadas, '[]'::jsonb) @> %s::jsonb
-        """, (min_minutes, max_minutes, f'["{label}"]'))
+              {filters}
+        """, params)
         cols = [desc[0] for desc in cur.description]
         rows = [dict(zip(cols, row)) for row in cur.fetchall()]
-        logger.info(f"Recordatorios [{label}]: {len(rows)} encontrados (ventana: {min_minutes}-{max_minutes} min)")
         cur.close()
-        conn.close()
+        for row in rows:
+            row['seconds_until'] = float(row['seconds_until'])
+        return rows
+
+    try:
+        rows = await pool.run(_fetch)
+        logger.info(f"Recordatorios: {len(rows)} eventos en horizonte de {max_minutes} min")
         return rows
     except Exception as e:
         logger.error(f"Error buscando recordatorios: {e}")
+        return None
+
+
+def _group_by_label(pairs):
+    by_label = {}
+    for record_id, label in pairs:
+        ids = by_label.setdefault(label, [])
+        if record_id not in ids:
+            ids.append(record_id)
+    return by_label
+
+
+async def claim_reminders(pairs):
+    """Reclama atómicamente las alertas (record_id, label) antes de enviarlas.
+
+    El label se agrega a notificaciones_enviadas solo si aún no estaba, en la misma
+    sentencia que lo verifica, así que entre varias réplicas cada alerta la reclama una
+    sola. Retorna la lista de pares reclamados por este proceso.
+    """
+    by_label = _group_by_label(pairs)
+    if not by_label:
         return []
 
+    def _claim(conn):
+        cur = conn.cursor()
+        claimed = []
+        # Un UPDATE por label (máximo uno por intervalo) para no repetir filas en el mismo UPDATE
+        for label, ids in by_label.items():
+            claimed += execute_values(cur, """
+                UPDATE agenda_personal AS a
+                SET notificaciones_enviadas = COALESCE(a.notificaciones_enviadas, '[]'::jsonb) || jsonb_build_array(v.label)
+                FROM (VALUES %s) AS v(id, label)
+                WHERE a.id = v.id
+                  AND NOT COALESCE(a.notificaciones_enviadas, '[]'::jsonb) @> jsonb_build_array(v.label)
+                RETURNING a.id, v.label
+            """, [(record_id, label) for record_id in ids], fetch=True)
+        cur.close()
+        return [tuple(row) for row in claimed]
 
-def mark_reminder_sent(record_id, label):
-    """Marca un recordatorio como enviado para no repetirlo."""
     try:
-        conn = get_db_connection()
+        return await pool.run(_claim)
+    except Exception as e:
+        logger.error(f"Error reclamando recordatorios: {e}")
+        return []
+
+
+async def release_reminders(pairs):
+    """Devuelve alertas reclamadas cuyo envío falló para que se reintenten."""
+    by_label = _group_by_label(pairs)
+    if not by_label:
+        return
+
+    def _release(conn):
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE agenda_personal
-            SET notificaciones_enviadas = COALESCE(notificaciones_enviadas, '[]'::jsonb) || %s::jsonb
-            WHERE id = %s
-        """, (f'["{label}"]', record_id))
-        conn.commit()
+        for label, ids in by_label.items():
+            cur.execute("""
+                UPDATE agenda_personal
+                SET notificaciones_enviadas = notificaciones_enviadas - %s
+                WHERE id = ANY(%s)
+            """, (label, ids))
         cur.close()
-        conn.close()
+
+    try:
+        await pool.run(_release)
     except Exception as e:
-        logger.error(f"Error marcando recordatorio: {e}")
+        logger.error(f"Error liberando recordatorios: {e}")
 
 
-async def execute_sql(query, params=None):
+AGENDA_CHANNEL = 'agenda_changed'
+
+
+async def notify_agenda_changed(telegram_user_id=None, record_id=None):
+    """Publica un cambio en agenda_personal para la réplica que programa los recordatorios."""
+    payload = json.dumps({"telegram_user_id": telegram_user_id, "record_id": record_id})
+
+    def _notify(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT pg_notify(%s, %s)", (AGENDA_CHANNEL, payload))
+        cur.close()
+
     try:
+        await pool.run(_notify)
+    except Exception as e:
+        logger.error(f"Error notificando cambio de agenda: {e}")
+
+
+
+class AdvisoryLeader:
+    """Elección de líder entre réplicas con pg_try_advisory_lock.
+
+    El lock de sesión vive en una conexión dedicada (fuera del pool): si el proceso o la
+    conexión caen, Postgres lo libera y otra réplica lo toma en su próximo ensure().
+    La misma conexión escucha `channel` (LISTEN) para recibir cambios de otras réplicas.
+    """
+
+    def __init__(self, key, channel=None):
+        self.key = key
+        self.channel = channel
+        self.conn = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_leader(self):
+        return self.conn is not None and not self.conn.closed
+
+    def _acquire(self):
         conn = get_db_connection()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+            acquired = cur.fetchone()[0]
+            if acquired and self.channel:
+                cur.execute(f"LISTEN {self.channel}")
+        if not acquired:
+            conn.close()
+            return None
+        return conn
+
+    def _alive(self):
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    async def ensure(self):
+        """Retorna True si este proceso es (o acaba de convertirse en) líder."""
+        async with self._lock:
+            if self.conn is not None:
+                if await asyncio.to_thread(self._alive):
+                    return True
+                logger.warning(f"Se perdió el liderazgo (lock {self.key})")
+                self._discard()
+            try:
+                self.conn = await asyncio.to_thread(self._acquire)
+            except psycopg2.Error as e:
+                logger.error(f"Error en elección de líder: {e}")
+                self.conn = None
+            if self.conn is not None:
+                logger.info(f"Liderazgo adquirido (lock {self.key})")
+            return self.conn is not None
+
+    async def drain_notifications(self):
+        """Lee las notificaciones pendientes del canal. Retorna la lista de payloads."""
+        async with self._lock:
+            if self.conn is None:
+                return []
+            try:
+                await asyncio.to_thread(self.conn.poll)
+            except psycopg2.Error:
+                self._discard()
+                return []
+            payloads = [n.payload for n in self.conn.notifies]
+            self.conn.notifies.clear()
+            return payloads
+
+    def _discard(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        self.conn = None
+
+    async def release(self):
+        async with self._lock:
+            self._discard()
+
+
+async def save_entry(telegram_user_id, username, item):
+    """Inserta un registro confirmado en agenda_personal. Retorna el id nuevo."""
+    ids = await save_entries(telegram_user_id, username, [item])
+    return ids[0]
+
+
+async def save_entries(telegram_user_id, username, items):
+    """Inserta varios registros confirmados en una sola sentencia. Retorna los ids nuevos en orden."""
+    rows = [
+        (telegram_user_id, username, item.get('category'), item.get('subcategory'), item.get('entry_type'),
+         item['summary'], item.get('full_content'), item.get('event_date'), Json(item.get('extra_data')))
+        for item in items
+    ]
+
+    def _insert(conn):
+        cur = conn.cursor()
+        inserted = execute_values(cur, """
+            INSERT INTO agenda_personal
+            (telegram_user_id, username, categoria, subcategoria, tipo_entrada, fecha_creacion, resumen, contenido_completo, fecha_evento, datos_extra, estado)
+            VALUES %s
+            RETURNING id
+        """, rows, template="(%s, %s, %s, %s, %s, NOW(), %s, %s, %s, %s, 'APPROVED')", fetch=True)
+        cur.close()
+        return [row[0] for row in inserted]
+
+    return await pool.run(_insert)
+
+
+@timed('execute_sql')
+async def execute_sql(query, params=None):
+    def _execute(conn):
         cur = conn.cursor()
-        logger.info(f"SQL Exec: {query} | Params: {params}")
         cur.execute(query, params)
         if cur.description:
             rows = cur.fetchall()
             cols = [desc[0] for desc in cur.description]
             result = [dict(zip(cols, row)) for row in rows]
         else:
-            conn.commit()
             result = cur.rowcount
-        conn.close()
+        cur.close()
         return result
+
+    try:
+        logger.debug(f"SQL Exec: {query} | Params: {params}")
+        return await pool.run(_execute)
     except Exception as e:
         logger.error(f"SQL Error: {e}")
         return None
+    finally:
+        _invalidate_categories_cache(query)
 
 
-async def get_user_categories(telegram_user_id):
-    query = "SELECT categoria, subcategoria FROM categorias_agenda WHERE telegram_user_id = %s AND estado = 'ACTIVO'"
+@timed('fetch_page')
+async def fetch_page(query, params=None, offset=0, limit=10, user_id=None):
+    """Lee una sola página de un SELECT con un cursor de servidor (named cursor).
+
+    Se salta `offset` filas en el servidor (MOVE) y solo se transfieren `limit` + 1 filas,
+    así la memoria no depende del tamaño total del resultado.
+    Con `user_id` el SQL pasa por guard_sql y por el control de costo/timeout.
+    Retorna (filas, hay_siguiente) o None si la consulta falla o es rechazada.
+    """
+    if user_id is not None:
+        try:
+            query = guard_sql(query, user_id)
+        except QueryRejected:
+            return None
+
+    def _fetch(conn):
+        if user_id is not None:
+            with conn.cursor() as check_cur:
+                _check_plan(check_cur, query, params)
+        cur = conn.cursor(name=f"page_{uuid.uuid4().hex}")
+        try:
+            cur.execute(query, params)
+            if offset:
+                cur.scroll(offset)
+            rows = cur.fetchmany(limit + 1)
+            cols = [desc[0] for desc in cur.description]
+        finally:
+            cur.close()
+        return [dict(zip(cols, row)) for row in rows[:limit]], len(rows) > limit
+
     try:
-        results = await execute_sql(query, (telegram_user_id,))
+        logger.debug(f"SQL Page: {query} | Params: {params} | offset={offset}")
+        return await pool.run(_fetch)
+    except QueryRejected:
+        return None
+    except Exception as e:
+        logger.error(f"SQL Error: {e}")
+        return None
 
-        logger.info(f"Buscando proyectos para user_id: {telegram_user_id}. Encontrados: {len(results) if results else 0}")
+# --- Guardas para SQL generado por la IA ---
 
-        if not results:
-            return "ESTE USUARIO NO TIENE LISTA. USA CATEGORIA 'LIBRE' Y SUBCATEGORIA 'LIBRE'."
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', '5000'))
+QUERY_MAX_COST = float(os.getenv('QUERY_MAX_COST', '100000'))
+QUERY_TIMEOUT_MS = int(os.getenv('QUERY_TIMEOUT_MS', '5000'))
+
+GUARDED_TABLES = {'agenda_personal', 'categorias_agenda'}
+_SELECT_TAIL = {'GROUP', 'HAVING', 'ORDER', 'LIMIT', 'OFFSET', 'FETCH', 'WINDOW'}
+_FORBIDDEN_TOP_LEVEL = {'JOIN', 'UNION', 'INTERSECT', 'EXCEPT', 'INTO', 'FOR', 'USING'}
+# Funciones que el SQL de la IA puede llamar. Cualquier otra (query_to_xml, dblink,
+# pg_read_file...) podría ejecutar SQL arbitrario o leer fuera de las tablas permitidas.
+# Al cambiarla, `python -m bench.guard` verifica que el SQL propio del bot siga pasando.
+ALLOWED_FUNCTIONS = {
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'LOWER', 'UPPER', 'TRIM', 'LTRIM', 'RTRIM', 'LENGTH',
+    'COALESCE', 'NULLIF', 'GREATEST', 'LEAST', 'CONCAT', 'SUBSTRING', 'POSITION', 'REPLACE',
+    'ROUND', 'ABS', 'CAST', 'EXTRACT', 'DATE_TRUNC', 'DATE_PART', 'DATE', 'TO_CHAR', 'TO_DATE',
+    'NOW', 'AGE', 'MAKE_INTERVAL', 'STRING_AGG', 'JSONB_ARRAY_LENGTH', 'AGENDA_UNACCENT',
+    'TO_TSVECTOR', 'TO_TSQUERY', 'PLAINTO_TSQUERY', 'WEBSEARCH_TO_TSQUERY',
+    'TS_RANK', 'TS_RANK_CD',
+}
+# Palabras clave que pueden ir seguidas de un paréntesis sin ser una llamada a función
+_PAREN_KEYWORDS = {
+    'SELECT', 'DISTINCT', 'ON', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'ANY', 'ALL', 'BETWEEN',
+    'CASE', 'WHEN', 'THEN', 'ELSE', 'AS', 'BY', 'OVER', 'FILTER', 'IS', 'LIKE', 'ILIKE', 'LIMIT',
+    'RETURNING', 'HAVING', 'SET',
+}
+_CALL_RE = re.compile(r'("(?:[^"]|"")*"|[A-Za-z_][A-Za-z0-9_$]*)\s*\(')
+_TABLE_RE = re.compile(r"\s*([A-Za-z_][A-Za-z0-9_]*)")
+_ALIAS_RE = re.compile(r"(?:AS\s+)?[A-Za-z_][A-Za-z0-9_]*", re.IGNORECASE)
+_PROTECTED_SET_RE = re.compile(r'(?<![\w$])"?(?:telegram_user_id|id)"?\s*=(?!=)', re.IGNORECASE)
+
+guard_stats = Counter()
+
+
+class QueryRejected(Exception):
+    """El SQL generado no cumple las reglas de seguridad."""
+
+
+def _reject(reason, sql):
+    guard_stats['rejected'] += 1
+    guard_stats[f'rejected:{reason}'] += 1
+    logger.warning(f"SQL rechazado ({reason}): {sql}")
+    raise QueryRejected(reason)
+
+
+def _top_level_words(sql):
+    """Palabras fuera de comillas y paréntesis como (posición, PALABRA). Rechaza comentarios,
+    dollar-quoting y múltiples sentencias."""
+    words, depth, i, n = [], 0, 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if c in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == c:
+                    if end + 1 < n and sql[end + 1] == c:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            if end >= n:
+                _reject("comillas_sin_cerrar", sql)
+            i = end + 1
+            continue
+        if sql.startswith(("--", "/*"), i) or c == '$':
+            _reject("sintaxis_no_permitida", sql)
+        if c == ';':
+            _reject("multiples_sentencias", sql)
+        if c == '\\':
+            _reject("sintaxis_no_permitida", sql)
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            # Un ')' de más cerraría el `telegram_user_id = N AND (` que agrega guard_sql
+            if depth < 0:
+                _reject("parentesis_desbalanceados", sql)
+        elif c.isalpha() or c == '_':
+            end = i
+            while end < n and (sql[end].isalnum() or sql[end] == '_'):
+                end += 1
+            # E'...', U&'...': con escapes de barra invertida el conteo de comillas no es fiable
+            if sql.startswith(("'", "&'", '&"'), end):
+                _reject("sintaxis_no_permitida", sql)
+            if depth == 0:
+                words.append((i, sql[i:end].upper()))
+            i = end
+            continue
+        i += 1
+    if depth != 0:
+        _reject("parentesis_desbalanceados", sql)
+    return words
+
+
+def _check_functions(sql):
+    """Rechaza llamadas a funciones fuera de ALLOWED_FUNCTIONS (también calificadas o entre comillas)."""
+    unquoted = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    for match in _CALL_RE.finditer(unquoted):
+        name = match.group(1)
+        before = unquoted[:match.start()].rstrip()
+        if before.endswith('::'):
+            continue  # tipo con precisión: ::numeric(10,2)
+        if name.startswith('"') or before.endswith('.'):
+            _reject("funcion_no_permitida", sql)
+        upper = name.upper()
+        if upper not in ALLOWED_FUNCTIONS and upper not in _PAREN_KEYWORDS:
+            _reject("funcion_no_permitida", sql)
+
+
+def guard_sql(sql, user_id, max_rows=QUERY_MAX_ROWS):
+    """Valida y reescribe el SQL de la IA para un usuario.
 
-        cat_map = {}
-        for r in results:
-            cat = r.get('categoria', '')
-            sub = r.get('subcategoria', '')
-            if cat not in cat_map:
-                cat_map[cat] = []
-            cat_map[cat].append(f'"{sub}"')
+    - Solo SELECT/UPDATE/DELETE de una tabla permitida (con alias opcional), sin JOIN,
+      UNION, subconsultas ni funciones fuera de ALLOWED_FUNCTIONS.
+    - Un UPDATE no puede asignar telegram_user_id ni id.
+    - Antepone `telegram_user_id = <user_id> AND (...)` al WHERE (o lo agrega si falta).
+    - En SELECT agrega o reduce el LIMIT a `max_rows`.
+    """
+    sql = (sql or "").strip().rstrip(';').strip()
+    words = _top_level_words(sql)
+    if not words:
+        _reject("vacio", sql)
+    kind = words[0][1]
+    names = [w for _, w in words]
 
+    if kind not in ('SELECT', 'UPDATE', 'DELETE'):
+        _reject("tipo_no_permitido", sql)
+    selects = re.findall(r"\bselect\b", re.sub(r"'(?:[^']|'')*'", "''", sql), re.IGNORECASE)
+    if len(selects) > (1 if kind == 'SELECT' else 0):
+        _reject("subconsulta", sql)
+    if _FORBIDDEN_TOP_LEVEL & set(names):
+        _reject("clausula_no_permitida", sql)
+    _check_functions(sql)
+
+    table_kw = 'UPDATE' if kind == 'UPDATE' else 'FROM'
+    if table_kw not in names or (kind == 'UPDATE' and 'FROM' in names):
+        _reject("tabla_no_encontrada", sql)
+    table_pos = words[names.index(table_kw)][0] + len(table_kw)
+    table_match = _TABLE_RE.match(sql[table_pos:])
+    if not table_match or table_match.group(1).lower() not in GUARDED_TABLES:
+        _reject("tabla_no_permitida", sql)
+
+    tail = _SELECT_TAIL if kind == 'SELECT' else {'RETURNING'}
+    # Entre la tabla y la siguiente cláusula solo cabe un alias: nada de comas ni joins
+    table_end = table_pos + table_match.end()
+    next_clause = {'WHERE', 'SET'} | tail
+    clause_pos = next((pos for pos, w in words if pos >= table_end and w in next_clause), len(sql))
+    alias = sql[table_end:clause_pos].strip()
+    if alias and not _ALIAS_RE.fullmatch(alias):
+        _reject("tabla_no_permitida", sql)
+
+    if kind == 'UPDATE':
+        if 'SET' not in names:
+            _reject("tipo_no_permitido", sql)
+        set_pos = words[names.index('SET')][0] + len('SET')
+        set_end = next((pos for pos, w in words if pos > set_pos and w in ('WHERE', 'RETURNING')), len(sql))
+        assignments = re.sub(r"'(?:[^']|'')*'", "''", sql[set_pos:set_end]).strip()
+        # Mover filas a otra cuenta (o pisar su id) no es una edición permitida
+        if assignments.startswith('(') or _PROTECTED_SET_RE.search(assignments):
+            _reject("columna_protegida", sql)
+
+    predicate = f"telegram_user_id = {int(user_id)}"
+    if 'WHERE' in names:
+        where_pos = words[names.index('WHERE')][0]
+        end = next((pos for pos, w in words if pos > where_pos and w in tail), len(sql))
+        cond = sql[where_pos + len('WHERE'):end].strip()
+        sql = f"{sql[:where_pos]}WHERE {predicate} AND ({cond}) {sql[end:]}".strip()
+    else:
+        start = table_pos + table_match.end()
+        end = next((pos for pos, w in words if pos > start and w in tail), len(sql))
+        sql = f"{sql[:end].rstrip()} WHERE {predicate} {sql[end:]}".strip()
+
+    if kind == 'SELECT':
+        limit = re.search(r"\bLIMIT\s+(\d+|ALL)\b", sql, re.IGNORECASE)
+        if limit is None:
+            sql = f"{sql} LIMIT {max_rows}"
+        elif limit.group(1).upper() == 'ALL' or int(limit.group(1)) > max_rows:
+            sql = f"{sql[:limit.start()]}LIMIT {max_rows}{sql[limit.end():]}"
+    return sql
+
+
+def _check_plan(cur, query, params):
+    """Aplica statement_timeout a la transacción y rechaza planes demasiado costosos."""
+    cur.execute("SELECT set_config('statement_timeout', %s, true)", (str(QUERY_TIMEOUT_MS),))
+    cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    cost = plan[0]['Plan']['Total Cost']
+    if cost > QUERY_MAX_COST:
+        guard_stats['rejected'] += 1
+        guard_stats['rejected:costo'] += 1
+        logger.warning(f"SQL rechazado (costo {cost:.0f} > {QUERY_MAX_COST:.0f}): {query}")
+        raise QueryRejected("costo")
+
+
+@timed('execute_guarded_sql')
+async def execute_guarded_sql(query, user_id, params=None):
+    """Como execute_sql pero para SQL de la IA: guard_sql + timeout + control de costo."""
+    try:
+        guarded = guard_sql(query, user_id)
+    except QueryRejected:
+        return None
+
+    def _execute(conn):
+        cur = conn.cursor()
+        _check_plan(cur, guarded, params)
+        cur.execute(guarded, params)
+        if cur.description:
+            cols = [desc[0] for desc in cur.description]
+            result = [dict(zip(cols, row)) for row in cur.fetchall()]
+        else:
+            result = cur.rowcount
+        cur.close()
+        return result
+
+    try:
+        logger.debug(f"SQL Guarded: {guarded} | Params: {params}")
+        return await pool.run(_execute)
+    except QueryRejected:
+        return None
+    except Exception as e:
+        logger.error(f"SQL Error: {e}")
+        return None
+    finally:
+        _invalidate_categories_cache(guarded)
+
+
+async def preview_affected(query, user_id, sample_size=5):
+    """Para un UPDATE/DELETE de la IA retorna (total, muestra) de las filas afectadas, o None."""
+    try:
+        guarded = guard_sql(query, user_id)
+    except QueryRejected:
+        return None
+    words = _top_level_words(guarded)
+    names = [w for _, w in words]
+    if names[0] not in ('UPDATE', 'DELETE'):
+        return None
+    table_kw = 'UPDATE' if names[0] == 'UPDATE' else 'FROM'
+    table = re.match(r"\s*([A-Za-z_][A-Za-z0-9_]*)", guarded[words[names.index(table_kw)][0] + len(table_kw):]).group(1)
+    where_pos = words[names.index('WHERE')][0]
+    end = next((pos for pos, w in words if pos > where_pos and w == 'RETURNING'), len(guarded))
+    where_clause = guarded[where_pos:end]
+
+    def _preview(conn):
+        cur = conn.cursor()
+        count_sql = f"SELECT COUNT(*) FROM {table} {where_clause}"
+        _check_plan(cur, count_sql, None)
+        cur.execute(count_sql)
+        total = cur.fetchone()[0]
+        # Sin parámetros: psycopg2 tomaría los '%' de un ILIKE '%x%' como placeholders
+        cur.execute(f"SELECT * FROM {table} {where_clause} ORDER BY id LIMIT {int(sample_size)}")
+        cols = [desc[0] for desc in cur.description]
+        rows = [dict(zip(cols, row)) for row in cur.fetchall()]
+        cur.close()
+        return total, rows
+
+    try:
+        return await pool.run(_preview)
+    except QueryRejected:
+        return None
+    except Exception as e:
+        logger.error(f"Error preview: {e}")
+        return None
+
+
+_SEARCH_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def build_agenda_search(terms):
+    """SQL parametrizado de búsqueda full-text en agenda_personal, ordenado por relevancia.
+
+    Cada palabra se busca como prefijo (`plano` encuentra `planos`). Retorna (sql, params)
+    para fetch_page, que agrega el filtro por usuario y la paginación; None si no hay palabras.
+    """
+    words = _SEARCH_WORD_RE.findall((terms or "").lower())
+    if not words:
+        return None
+    tsquery = " & ".join(f"{word}:*" for word in words)
+    sql = (
+        "SELECT id, categoria, subcategoria, tipo_entrada, resumen, fecha_evento, estado "
+        "FROM agenda_personal "
+        "WHERE busqueda @@ to_tsquery('spanish', agenda_unaccent(%s)) "
+        "ORDER BY ts_rank_cd(busqueda, to_tsquery('spanish', agenda_unaccent(%s))) DESC, fecha_evento ASC, id ASC"
+    )
+    return sql, [tsquery, tsquery]
+
+
+_CATEGORIES_WRITE_RE = re.compile(r"\b(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+categorias_agenda\b", re.IGNORECASE)
+_USER_ID_RE = re.compile(r"telegram_user_id\s*=\s*(\d+)", re.IGNORECASE)
+
+
+def _invalidate_categories_cache(query):
+    """Invalida el cache de usuario si la sentencia modifica categorias_agenda."""
+    if not query or not _CATEGORIES_WRITE_RE.search(query):
+        return
+    user_ids = {int(m) for m in _USER_ID_RE.findall(query)}
+    if not user_ids:
+        user_cache.clear()
+        return
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+CATEGORY_SHORTLIST_MIN = int(os.getenv('CATEGORY_SHORTLIST_MIN', '40'))
+CATEGORY_SHORTLIST_K = int(os.getenv('CATEGORY_SHORTLIST_K', '20'))
+
+
+async def get_user_category_rows(telegram_user_id):
+    """[(categoria, subcategoria), ...] activas del usuario, cacheadas. None si la consulta falla."""
+    cached = user_cache.get_field(telegram_user_id, 'categorias')
+    if cached is not None:
+        return cached
+
+    query = """
+        SELECT categoria, subcategoria FROM categorias_agenda
+        WHERE telegram_user_id = %s AND estado = 'ACTIVO'
+        ORDER BY categoria, subcategoria
+    """
+    results = await execute_sql(query, (telegram_user_id,))
+    logger.debug(f"Buscando proyectos para user_id: {telegram_user_id}. Encontrados: {len(results) if results else 0}")
+    # Un error de SQL (None) no se cachea
+    if results is None:
+        return None
+    rows = [(r.get('categoria', ''), r.get('subcategoria', '')) for r in results]
+    user_cache.set_field(telegram_user_id, 'categorias', rows)
+    return rows
+
+
+def render_categories(rows, total=None):
+    """Texto de categorías para el prompt; `total` indica que `rows` es una lista preseleccionada."""
+    cat_map = {}
+    for cat, sub in rows:
+        cat_map.setdefault(cat, []).append(f'"{sub}"')
+
+    if total is None:
         prompt_text = "LISTA DE OPCIONES VÁLIDAS POR CATEGORÍA:\n"
-        for cat, subs in cat_map.items():
-            prompt_text += f"- Si category es '{cat}', subcategory DEBE SER EXACTAMENTE UNA DE ESTAS: [{', '.join(subs)}]\n"
+    else:
+        prompt_text = (
+            f"OPCIONES MÁS PARECIDAS AL MENSAJE ({len(rows)} de {total} del usuario). "
+            "Si ninguna corresponde, usa 'LIBRE' en category y subcategory:\n"
+        )
+    for cat, subs in cat_map.items():
+        prompt_text += f"- Si category es '{cat}', subcategory DEBE SER EXACTAMENTE UNA DE ESTAS: [{', '.join(subs)}]\n"
+    return prompt_text
+
 
+@timed('get_user_categories')
+async def get_user_categories(telegram_user_id, text=None):
+    """Bloque de categorías para el prompt del sistema.
+
+    Con `text` y más de CATEGORY_SHORTLIST_MIN subcategorías solo se incluyen las
+    CATEGORY_SHORTLIST_K más parecidas al mensaje (ver category_index), para que el
+    tamaño del prompt no crezca con la taxonomía del usuario.
+    """
+    try:
+        rows = await get_user_category_rows(telegram_user_id)
+        if rows is None:
+            return "USA 'LIBRE'"
+        if not rows:
+            return "ESTE USUARIO NO TIENE LISTA. USA CATEGORIA 'LIBRE' Y SUBCATEGORIA 'LIBRE'."
+        if text and len(rows) > CATEGORY_SHORTLIST_MIN:
+            shortlist = category_indexes.shortlist(telegram_user_id, rows, text, CATEGORY_SHORTLIST_K)
+            return render_categories(shortlist, total=len(rows))
+        # La lista completa se renderiza una vez y se guarda junto a las filas de las que
+        # sale; si las filas se recargaron, el texto viejo no sirve
+        cached = user_cache.get_field(telegram_user_id, 'categorias_texto')
+        if cached is not None and cached[0] is rows:
+            return cached[1]
+        prompt_text = render_categories(rows)
+        user_cache.set_field(telegram_user_id, 'categorias_texto', (rows, prompt_text))
         return prompt_text
     except Exception as e:
         logger.error(f"Error cargando categorías: {e}")
         return "USA 'LIBRE'"
+
+
+async def load_conversation_state(telegram_user_id):
+    """user_data guardado del usuario ({} si no hay o venció). None si la consulta falla."""
+    def _load(conn):
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT data FROM conversation_state WHERE telegram_user_id = %s AND expires_at > NOW()",
+            (telegram_user_id,)
+        )
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else {}
+
+    try:
+        return await pool.run(_load)
+    except Exception as e:
+        logger.error(f"Error cargando estado de conversación: {e}")
+        return None
+
+
+async def save_conversation_states(rows, deleted, purge_expired=False):
+    """Escribe en una transacción un lote de estados [(telegram_user_id, json, ttl_segundos), ...]
+    y borra los de `deleted`. Retorna False si falla."""
+    def _save(conn):
+        cur = conn.cursor()
+        if rows:
+            execute_values(cur, """
+                INSERT INTO conversation_state (telegram_user_id, data, expires_at)
+                VALUES %s
+                ON CONFLICT (telegram_user_id) DO UPDATE
+                SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+            """, rows, template="(%s, %s::jsonb, NOW() + make_interval(secs => %s))", page_size=1000)
+        if deleted:
+            cur.execute("DELETE FROM conversation_state WHERE telegram_user_id = ANY(%s)", (list(deleted),))
+        if purge_expired:
+            cur.execute("DELETE FROM conversation_state WHERE expires_at < NOW()")
+        cur.close()
+
+    try:
+        await pool.run(_save)
+        return True
+    except Exception as e:
+        logger.error(f"Error guardando estado de conversación: {e}")
+        return False
+
+
+class PostgresResponseCacheBackend:
+    """Nivel persistente de ResponseCache en la tabla ai_response_cache."""
+
+    async def get(self, key):
+        def _get(conn):
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT response, latency FROM ai_response_cache WHERE cache_key = %s AND expires_at > NOW()",
+                (key,)
+            )
+            row = cur.fetchone()
+            cur.close()
+            return row
+
+        try:
+            row = await pool.run(_get)
+            return (row[0], row[1] or 0.0) if row else None
+        except Exception as e:
+            logger.error(f"Error leyendo cache IA: {e}")
+            return None
+
+    async def set(self, key, response, latency, ttl):
+        def _set(conn):
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO ai_response_cache (cache_key, response, latency, expires_at)
+                VALUES (%s, %s, %s, NOW() + (%s * INTERVAL '1 second'))
+                ON CONFLICT (cache_key) DO UPDATE
+                SET response = EXCLUDED.response, latency = EXCLUDED.latency, expires_at = EXCLUDED.expires_at
+            """, (key, Json(response), latency, ttl))
+            cur.close()
+
+        try:
+            await pool.run(_set)
+        except Exception as e:
+            logger.error(f"Error guardando cache IA: {e}")
+
+    async def purge_expired(self):
+        def _purge(conn):
+            cur = conn.cursor()
+            cur.execute("DELETE FROM ai_response_cache WHERE expires_at < NOW()")
+            deleted = cur.rowcount
+            cur.close()
+            return deleted
+
+        try:
+            return await pool.run(_purge)
+        except Exception as e:
+            logger.error(f"Error limpiando cache IA: {e}")
+            return 0
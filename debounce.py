@@ -0,0 +1,64 @@
+import asyncio
+
+
+class _Burst:
+    __slots__ = ('parts', 'started', 'handle', 'on_flush')
+
+    def __init__(self, started):
+        self.parts = []
+        self.started = started
+        self.handle = None
+        self.on_flush = None
+
+
+class MessageDebouncer:
+    """Agrupa los mensajes de un usuario que llegan seguidos en una sola ráfaga.
+
+    Cada mensaje reinicia una ventana de `window_ms`; la ráfaga se cierra cuando
+    pasa la ventana sin mensajes nuevos, al llegar a `max_wait_ms` desde el primero
+    o al juntar `max_parts` partes. Al cerrarse se llama a `on_flush(parts)` del
+    último mensaje recibido. window_ms=0 desactiva el agrupamiento.
+    """
+
+    def __init__(self, window_ms=0, max_wait_ms=3000, max_parts=8):
+        self.window = window_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self.max_parts = max_parts
+        self._pending = {}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def has_pending(self, user_id):
+        return user_id in self._pending
+
+    def add(self, user_id, parts, on_flush):
+        """Agrega `parts` (lista de ('text', str) / ('image', bytes)) a la ráfaga del usuario.
+
+        Retorna True si es el primer mensaje de la ráfaga.
+        """
+        loop = asyncio.get_running_loop()
+        burst = self._pending.get(user_id)
+        first = burst is None
+        if first:
+            burst = self._pending[user_id] = _Burst(loop.time())
+        burst.parts.extend(parts)
+        burst.on_flush = on_flush
+        if burst.handle is not None:
+            burst.handle.cancel()
+
+        if len(burst.parts) >= self.max_parts:
+            self.flush(user_id)
+        else:
+            delay = min(self.window, burst.started + self.max_wait - loop.time())
+            burst.handle = loop.call_later(max(0.0, delay), self.flush, user_id)
+        return first
+
+    def flush(self, user_id):
+        burst = self._pending.pop(user_id, None)
+        if burst is None:
+            return
+        if burst.handle is not None:
+            burst.handle.cancel()
+        burst.on_flush(burst.parts)
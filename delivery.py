@@ -0,0 +1,160 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+
+from telegram.error import RetryAfter, NetworkError, BadRequest, Forbidden
+
+from config import logger
+from metrics import counter, histogram
+from ai_scheduler import TokenBucket
+
+
+deliveries_total = counter('jarvis_delivery_total', 'Mensajes salientes por tipo y resultado')
+delivery_lag_seconds = histogram('jarvis_delivery_lag_seconds', 'Retraso entre la hora prevista de un mensaje y su envío')
+
+
+class Delivery:
+    """Un mensaje saliente; `send()` es una corrutina sin argumentos que llama a Telegram.
+
+    `due_at` (reloj monotónico) es la hora prevista del envío, para medir el retraso;
+    si se alcanza `expires_at` antes de enviarlo, el mensaje se descarta.
+    """
+    __slots__ = ('key', 'chat_id', 'send', 'due_at', 'expires_at')
+
+    def __init__(self, key, chat_id, send, due_at=None, expires_at=None):
+        self.key = key
+        self.chat_id = chat_id
+        self.send = send
+        self.due_at = time.monotonic() if due_at is None else due_at
+        self.expires_at = expires_at
+
+
+def _seconds(retry_after):
+    # PTB expone retry_after como int o como timedelta según la versión
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class DeliveryEngine:
+    """Envío concurrente de mensajes dentro de los límites de Telegram.
+
+    - Un bucket global (~30 mensajes/s por bot) y uno por chat (~1 mensaje/s), compartidos
+      por todos los envíos en curso: recordatorios y difusiones juntos no superan el límite.
+    - RetryAfter congela el bucket global el tiempo que pide Telegram y reintenta el mensaje.
+    - Timeouts y errores de red se reintentan con backoff exponencial con jitter.
+    - Chats bloqueados o mensajes inválidos no se reintentan.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, concurrency=16, max_retries=3,
+                 backoff_base=0.5, backoff_cap=10.0):
+        self.global_bucket = TokenBucket(global_rate * 60, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._chat_buckets = {}
+        self._queued = 0
+        self._in_flight = 0
+
+    def snapshot(self):
+        return {'queued': self._queued, 'in_flight': self._in_flight}
+
+    async def deliver(self, deliveries, kind='broadcast', concurrency=None):
+        """Envía `deliveries` y retorna {'sent': [...], 'failed': [...], 'dropped': [...]} con sus claves.
+
+        'failed' son los que agotaron los reintentos por errores transitorios (pueden
+        reintentarse más tarde); 'dropped', los rechazados por Telegram o vencidos.
+        Una `concurrency` menor deja a los demás envíos en curso la mayor parte del
+        bucket global (p. ej. una difusión larga no retrasa los recordatorios).
+        """
+        queue = deque(deliveries)
+        report = {'sent': [], 'failed': [], 'dropped': []}
+        self._queued += len(queue)
+        workers = [asyncio.create_task(self._worker(queue, report, kind))
+                   for _ in range(min(concurrency or self.concurrency, len(queue)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._queued -= len(queue)
+        return report
+
+    async def _worker(self, queue, report, kind):
+        while queue:
+            delivery = queue.popleft()
+            self._queued -= 1
+            self._in_flight += 1
+            try:
+                result = await self._send(delivery, kind)
+            finally:
+                self._in_flight -= 1
+            report[result].append(delivery.key)
+            deliveries_total.inc(kind=kind, result=result)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                now = time.monotonic()
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_full(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate * 60, burst=self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        chat = self._chat_bucket(chat_id)
+        while True:
+            now = time.monotonic()
+            wait = max(self.global_bucket.wait_time(now), chat.wait_time(now))
+            if wait <= 0:
+                self.global_bucket.take(now)
+                chat.take(now)
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, delivery, kind):
+        """Envía con reintentos; retorna 'sent', 'failed' o 'dropped'."""
+        attempt = 0
+        while True:
+            await self._acquire(delivery.chat_id)
+            if delivery.expires_at is not None and time.monotonic() >= delivery.expires_at:
+                return 'dropped'
+            try:
+                await delivery.send()
+            except RetryAfter as e:
+                error = e
+                # El bucket global congelado ya impone la espera a todos los envíos
+                delay = 0
+                self.global_bucket.block(_seconds(e.retry_after), time.monotonic())
+                logger.warning(f"Telegram pidió esperar {_seconds(e.retry_after):.0f}s antes de seguir enviando")
+            except (BadRequest, Forbidden) as e:
+                logger.error(f"Envío a {delivery.chat_id} rechazado: {e}")
+                return 'dropped'
+            except NetworkError as e:
+                error = e
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            except Exception as e:
+                logger.error(f"Error enviando a {delivery.chat_id}: {e}")
+                return 'failed'
+            else:
+                delivery_lag_seconds.observe(max(0.0, time.monotonic() - delivery.due_at), kind=kind)
+                return 'sent'
+
+            if attempt >= self.max_retries:
+                logger.error(f"Envío a {delivery.chat_id} fallido tras {attempt + 1} intentos: {error}")
+                return 'failed'
+            attempt += 1
+            deliveries_total.inc(kind=kind, result='retry')
+            await asyncio.sleep(delay)
+
+
+delivery_engine = DeliveryEngine(
+    global_rate=int(os.getenv('TELEGRAM_GLOBAL_RATE', '25')),
+    chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', '1')),
+    chat_burst=int(os.getenv('TELEGRAM_CHAT_BURST', '3')),
+    concurrency=int(os.getenv('DELIVERY_CONCURRENCY', '16')),
+    max_retries=int(os.getenv('DELIVERY_MAX_RETRIES', '3')),
+)
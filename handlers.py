@@ -1,16 +1,22 @@
 import os
 import json
-import tempfile
+import time
+import uuid
 from datetime import datetime
+from functools import partial
+from collections import OrderedDict
 
-from psycopg2.extras import Json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from config import logger
-from db import get_db_connection, execute_sql, get_user_categories, register_user, is_user_registered, get_upcoming_reminders, mark_reminder_sent
-from ai import process_with_ai
+from db import execute_guarded_sql, fetch_page, preview_affected, guard_sql, QueryRejected, get_user_categories, register_user, is_user_registered, save_entries, build_agenda_search, get_active_user_ids
+from ai import process_with_ai, IMAGE_MAX_EDGE
+from router import router
+from debounce import MessageDebouncer
+from delivery import Delivery, delivery_engine
 from utils import escape_markdown
+import reminders
 
 
 REMINDER_INTERVALS = [
@@ -20,39 +26,131 @@ REMINDER_INTERVALS = [
 ]
 
 
+ALERT_TITLES = {f"{minutes}m": title for minutes, title in REMINDER_INTERVALS}
+
+
+async def send_reminder(bot, event, label):
+    """Envía la alerta 'label' (60m/5m/1m) de un evento a su usuario."""
+    fecha = event['fecha_evento'].strftime('%d/%m/%Y %H:%M')
+    msg = (
+        f"{ALERT_TITLES[label]}\n\n"
+        f"📂 {event.get('categoria', 'GENERAL')} › {event.get('subcategoria', 'General')}\n"
+        f"📝 {event.get('resumen', 'Sin detalle')}\n"
+        f"📅 {fecha}"
+    )
+    await bot.send_message(
+        chat_id=event['telegram_user_id'],
+        text=msg,
+        parse_mode='Markdown'
+    )
+
+
 async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
-    """Job periódico que revisa eventos próximos y envía alertas."""
-    for minutes, alert_title in REMINDER_INTERVALS:
-        label = f"{minutes}m"
-        events = get_upcoming_reminders(minutes)
-        for event in events:
-            fecha = event['fecha_evento'].strftime('%d/%m/%Y %H:%M')
-            msg = (
-                f"{alert_title}\n\n"
-                f"📂 {event.get('categoria', 'GENERAL')} › {event.get('subcategoria', 'General')}\n"
-                f"📝 {event.get('resumen', 'Sin detalle')}\n"
-                f"📅 {fecha}"
-            )
-            try:
-                await context.bot.send_message(
-                    chat_id=event['telegram_user_id'],
-                    text=msg,
-                    parse_mode='Markdown'
-                )
-                mark_reminder_sent(event['id'], label)
-                logger.info(f"Recordatorio {label} enviado - ID:{event['id']} User:{event['telegram_user_id']}")
-            except Exception as e:
-                logger.error(f"Error enviando recordatorio: {e}")
-
-
-async def send_long_message(update, text, chunk_size=4000):
-    """Envía un mensaje partiéndolo en chunks si supera el límite de Telegram (4096 chars)."""
-    for i in range(0, len(text), chunk_size):
-        chunk = text[i:i + chunk_size]
-        try:
-            await update.message.reply_text(chunk, parse_mode='Markdown')
-        except Exception:
-            await update.message.reply_text(chunk.replace("*", "").replace("`", "").replace("_", ""))
+    """Job periódico: liderazgo entre réplicas y reconciliación del scheduler de recordatorios."""
+    await reminders.tick()
+
+
+debouncer = MessageDebouncer(
+    window_ms=int(os.getenv('MESSAGE_DEBOUNCE_MS', '0')),
+    max_wait_ms=int(os.getenv('MESSAGE_DEBOUNCE_MAX_MS', '3000')),
+    max_parts=int(os.getenv('MESSAGE_DEBOUNCE_MAX_PARTS', '8')),
+)
+
+
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', '10'))
+RESULTS_CACHED_PAGES = 5
+MESSAGE_LIMIT = 4000
+
+
+def strip_markdown(text):
+    return text.replace("*", "").replace("`", "").replace("_", "")
+
+
+def render_results(rows, offset=0):
+    """Formatea una página de resultados como líneas de texto Markdown."""
+    keys = list(rows[0].keys())
+
+    if keys == ['categoria']:
+        lines = ["📂 **Mis Categorías**", "─" * 20]
+        lines += [f"• {r['categoria']}" for r in rows]
+
+    elif keys == ['subcategoria']:
+        lines = ["📋 **Subcategorías / Proyectos**", "─" * 20]
+        lines += [f"{i}. {r['subcategoria']}" for i, r in enumerate(rows, offset + 1)]
+
+    else:
+        lines = ["📑 **Resultados de Búsqueda**"]
+        current_cat = None
+        for r in rows:
+            cat = (r.get('categoria') or 'GENERAL').upper()
+            sub = r.get('subcategoria', 'General')
+            if cat != current_cat:
+                lines += ["", f"📂 **{cat}**", "─" * 20]
+                current_cat = cat
+            rid = r.get('id')
+            tipo = r.get('tipo_entrada', 'NOTA')
+            resumen = escape_markdown(r.get('resumen', ''))
+            date_val = r.get('fecha_evento')
+            date_str = f"📅 {date_val.strftime('%d/%m %H:%M')}" if date_val else ""
+            icon = {'TAREA': '📝', 'RECORDATORIO': '⏰', 'CULTURA': '🎭', 'GASTO': '💰'}.get(tipo, '🔹')
+            lines += [f"{icon} `ID {rid}` | *{sub}*", f"   └ {resumen} {date_str}", ""]
+
+    return lines
+
+
+def join_lines(lines, limit=MESSAGE_LIMIT):
+    """Une líneas sin pasar el límite de Telegram, cortando solo entre líneas."""
+    text = ""
+    for line in lines:
+        if len(text) + len(line) + 1 > limit:
+            return text + "…"
+        text += line + "\n"
+    return text
+
+
+async def get_results_page(context, page):
+    """Retorna (texto, hay_siguiente) de la página pedida usando el cache del chat, o None si falla."""
+    state = context.chat_data.get('results')
+    if state is None:
+        return None
+    pages = state['pages']
+    if page in pages:
+        pages.move_to_end(page)
+        return pages[page]
+
+    fetched = await fetch_page(
+        state['sql'], state['params'], page * RESULTS_PAGE_SIZE, RESULTS_PAGE_SIZE, user_id=state['user_id']
+    )
+    if fetched is None:
+        return None
+    rows, has_next = fetched
+    if not rows:
+        return "", False
+
+    text = join_lines(render_results(rows, page * RESULTS_PAGE_SIZE))
+    if page > 0 or has_next:
+        text += f"\n_Página {page + 1}_"
+    pages[page] = (text, has_next)
+    while len(pages) > RESULTS_CACHED_PAGES:
+        pages.popitem(last=False)
+    return pages[page]
+
+
+def results_keyboard(token, page, has_next):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀", callback_data=f"page:{token}:{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("▶", callback_data=f"page:{token}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def pick_photo_size(photos):
+    """Elige la versión más pequeña que ya cubre IMAGE_MAX_EDGE (Telegram las ordena de menor a mayor)."""
+    for photo in photos:
+        if max(photo.width, photo.height) >= IMAGE_MAX_EDGE:
+            return photo
+    return photos[-1]
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -62,7 +160,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username or user.first_name
     nombre = user.full_name
 
-    is_new = register_user(telegram_user_id, username, nombre)
+    is_new = await register_user(telegram_user_id, username, nombre)
 
     if is_new:
         await update.message.reply_text(
@@ -79,16 +177,54 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv('ADMIN_USER_IDS', '').split(',') if uid.strip()}
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '4'))
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <mensaje>: envía un aviso a todos los usuarios activos (solo ADMIN_USER_IDS)."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await update.message.reply_text("Uso: /broadcast <mensaje>")
+        return
+
+    recipients = await get_active_user_ids()
+    await update.message.reply_text(f"📣 Enviando a {len(recipients)} usuarios...")
+    # En segundo plano: la difusión puede durar minutos y no debe bloquear la cola del admin
+    context.application.create_task(
+        _run_broadcast(context.bot, update.effective_chat.id, text, recipients), update=update
+    )
+
+
+async def _run_broadcast(bot, admin_chat_id, text, recipients):
+    started = time.perf_counter()
+    deliveries = [Delivery(uid, uid, partial(bot.send_message, chat_id=uid, text=text)) for uid in recipients]
+    report = await delivery_engine.deliver(deliveries, kind='broadcast', concurrency=BROADCAST_CONCURRENCY)
+    elapsed = time.perf_counter() - started
+    sent = len(report['sent'])
+    logger.info(f"Difusión: {sent}/{len(recipients)} enviados en {elapsed:.1f}s")
+    await bot.send_message(
+        chat_id=admin_chat_id,
+        text=(
+            f"📣 Difusión terminada en {elapsed:.0f}s ({sent / elapsed if elapsed else 0:.1f} msg/s)\n"
+            f"✅ Enviados: {sent}\n⚠️ Fallidos: {len(report['failed'])}\n🚫 Rechazados: {len(report['dropped'])}"
+        )
+    )
+
+
 async def master_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
-    current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
 
-    if not is_user_registered(user_id):
+    if not await is_user_registered(user_id):
         await update.message.reply_text("⚠️ No estás registrado. Usa /start para comenzar.")
         return
 
-    categorias_dinamicas = await get_user_categories(user_id)
+    # Se resuelve con el texto del mensaje dentro de process_with_ai (lista acotada)
+    categorias_dinamicas = partial(get_user_categories, user_id)
 
     text_input = update.message.text or ""
 
@@ -110,23 +246,88 @@ async def master_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     ai_response = None
     if text_input:
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-        ai_response = await process_with_ai('text', text_input, current_date, user_id, username, categorias_dinamicas)
+        ai_response = router.route(text_input, user_id)
+        if ai_response is None:
+            if debouncer.enabled:
+                await buffer_message(update, context, [('text', text_input)])
+                return
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+            ai_response = await process_with_ai('text', text_input, current_date, user_id, username, categorias_dinamicas)
+        elif debouncer.has_pending(user_id):
+            # Mensajes anteriores siguen en la ráfaga: se despachan ya y esta respuesta
+            # se encola detrás de ellos para no contestar fuera de orden
+            debouncer.flush(user_id)
+            _enqueue(update, context, respond(update, context, ai_response))
+            return
     elif update.message.photo:
-        await update.message.reply_text("👁️ Analizando imagen...")
-        photo_file = await update.message.photo[-1].get_file()
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp:
-            await photo_file.download_to_drive(temp.name)
-            ai_response = await process_with_ai('image', temp.name, current_date, user_id, username, categorias_dinamicas)
-            os.remove(temp.name)
+        if not debouncer.enabled:
+            await update.message.reply_text("👁️ Analizando imagen...")
+        photo_file = await pick_photo_size(update.message.photo).get_file()
+        image_bytes = bytes(await photo_file.download_as_bytearray())
+        if debouncer.enabled:
+            caption = update.message.caption
+            await buffer_message(update, context, [('image', image_bytes)] + ([('text', caption)] if caption else []))
+            return
+        ai_response = await process_with_ai('image', image_bytes, current_date, user_id, username, categorias_dinamicas)
     elif update.message.voice:
         await update.message.reply_text("🎧 Procesando audio...")
+        timings = {}
+        started = time.perf_counter()
         voice_file = await update.message.voice.get_file()
-        with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp:
-            await voice_file.download_to_drive(temp.name)
-            ai_response = await process_with_ai('audio', temp.name, current_date, user_id, username, categorias_dinamicas)
-            os.remove(temp.name)
+        audio_bytes = bytes(await voice_file.download_as_bytearray())
+        timings['download'] = time.perf_counter() - started
+        ai_response = await process_with_ai(
+            'audio', audio_bytes, current_date, user_id, username, categorias_dinamicas,
+            media_duration=update.message.voice.duration, timings=timings
+        )
+        logger.info("Voz timings: " + ", ".join(f"{stage}={secs:.2f}s" for stage, secs in timings.items()))
 
+    await respond(update, context, ai_response)
+
+
+async def _process_and_mark(update, context, coroutine):
+    try:
+        await coroutine
+    finally:
+        # No pasa por Application.process_update: se marca a mano para que se persista el user_data
+        context.application.mark_data_for_update_persistence(user_ids=[update.effective_user.id])
+
+
+def _enqueue(update, context, coroutine):
+    # Pasa por el update processor para conservar el orden por usuario
+    context.application.create_task(
+        context.application.update_processor.process_update(update, _process_and_mark(update, context, coroutine)),
+        update=update,
+    )
+
+
+async def buffer_message(update, context, parts):
+    """Agrega el mensaje a la ráfaga del usuario; al cerrarse se procesa todo con una sola llamada a la IA."""
+    def on_flush(burst_parts):
+        _enqueue(update, context, process_burst(update, context, burst_parts))
+
+    if debouncer.add(update.effective_user.id, parts, on_flush):
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+
+
+async def process_burst(update, context, parts):
+    user_id = update.effective_user.id
+    username = update.effective_user.username or update.effective_user.first_name
+    current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+    categorias_dinamicas = partial(get_user_categories, user_id)
+
+    if len(parts) == 1:
+        content_type, content_data = parts[0]
+    else:
+        content_type, content_data = 'multipart', parts
+        logger.info(f"Ráfaga de {len(parts)} mensajes agrupada para user_id: {user_id}")
+    ai_response = await process_with_ai(content_type, content_data, current_date, user_id, username, categorias_dinamicas)
+    await respond(update, context, ai_response)
+
+
+async def respond(update, context, ai_response):
+    """Ejecuta la intención devuelta por la IA (o el router) y responde al usuario."""
+    user_id = update.effective_user.id
     if not ai_response:
         await update.message.reply_text("😵 Lo siento, hubo un error procesando la solicitud.")
         return
@@ -136,70 +337,54 @@ async def master_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if intent == 'SAVE':
         await show_save_confirmation(update, context, ai_response)
     elif intent == 'QUERY':
-        sql = ai_response.get('sql_query', '').strip().rstrip('.')
-        logger.info(f"QUERY SQL generado: {sql}")
-        results = await execute_sql(sql)
-        if results is None:
+        search = build_agenda_search(ai_response['search_terms']) if ai_response.get('search_terms') else None
+        if search:
+            sql, params = search
+        else:
+            sql, params = (ai_response.get('sql_query') or '').strip().rstrip('.;'), ai_response.get('sql_params')
+        logger.debug(f"QUERY SQL generado: {sql}")
+        context.chat_data['results'] = {
+            'token': uuid.uuid4().hex[:8], 'user_id': user_id, 'sql': sql, 'params': params,
+            'pages': OrderedDict()
+        }
+        page = await get_results_page(context, 0)
+        if page is None:
             await update.message.reply_text("❌ Error al ejecutar la consulta. Revisa los logs.")
-        elif not results:
+        elif not page[0]:
             await update.message.reply_text("ℹ️ No se encontraron resultados para esa búsqueda.")
         else:
-            keys = list(results[0].keys())
-
-            if keys == ['categoria']:
-                msg = "📂 **Mis Categorías**\n" + ("─" * 20) + "\n"
-                for r in results:
-                    msg += f"• {r['categoria']}\n"
-
-            elif keys == ['subcategoria']:
-                msg = "📋 **Subcategorías / Proyectos**\n" + ("─" * 20) + "\n"
-                for i, r in enumerate(results, 1):
-                    msg += f"{i}. {r['subcategoria']}\n"
-
-            else:
-                msg = "📑 **Resultados de Búsqueda**\n"
-                current_cat = None
-                for r in results:
-                    cat = r.get('categoria', 'GENERAL').upper()
-                    sub = r.get('subcategoria', 'General')
-                    if cat != current_cat:
-                        msg += f"\n📂 **{cat}**\n" + ("─" * 20) + "\n"
-                        current_cat = cat
-                    rid = r.get('id')
-                    tipo = r.get('tipo_entrada', 'NOTA')
-                    resumen = escape_markdown(r.get('resumen', ''))
-                    date_val = r.get('fecha_evento')
-                    date_str = f"📅 {date_val.strftime('%d/%m %H:%M')}" if date_val else ""
-                    icon = {'TAREA': '📝', 'RECORDATORIO': '⏰', 'CULTURA': '🎭', 'GASTO': '💰'}.get(tipo, '🔹')
-                    msg += f"{icon} `ID {rid}` | *{sub}*\n   └ {resumen} {date_str}\n\n"
-
-            await send_long_message(update, msg)
+            text, has_next = page
+            markup = results_keyboard(context.chat_data['results']['token'], 0, has_next)
+            try:
+                await update.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
+            except Exception:
+                await update.message.reply_text(strip_markdown(text), reply_markup=markup)
 
     elif intent in ['DELETE', 'UPDATE']:
-        sql = ai_response.get('sql_query')
+        try:
+            sql = guard_sql(ai_response.get('sql_query'), user_id)
+        except QueryRejected:
+            await update.message.reply_text("🚫 La operación generada no es segura y fue rechazada. Intenta reformularla.")
+            return
         context.user_data['pending_sql'] = sql
 
         preview_msg = ""
-        try:
-            if "WHERE" in sql.upper():
-                where_clause = sql[sql.upper().index("WHERE"):]
-                preview_sql = f"SELECT * FROM agenda_personal {where_clause}"
-                if not preview_sql.strip().upper().startswith("SELECT"):
-                    preview_sql = ""
-
-                if preview_sql:
-                    affected_rows = await execute_sql(preview_sql)
-                    if affected_rows:
-                        preview_msg = "\n\n⚠️ **Ítems Afectados:**\n"
-                        for r in affected_rows:
-                            rid = r.get('id')
-                            sub = r.get('subcategoria', 'General')
-                            resumen = escape_markdown(r.get('resumen', ''))
-                            preview_msg += f"• `ID {rid}`: *{sub}* - {resumen}\n"
-                    else:
-                        preview_msg = "\n\n⚠️ **Atención:** No se encontraron ítems que coincidan (0 afectados)."
-        except Exception as e:
-            logger.error(f"Error preview: {e}")
+        preview = await preview_affected(sql, user_id)
+        if preview is None:
+            await update.message.reply_text("🚫 No se pudo validar la operación. Intenta reformularla.")
+            return
+        total, sample = preview
+        if total:
+            preview_msg = f"\n\n⚠️ **Ítems Afectados ({total}):**\n"
+            for r in sample:
+                rid = r.get('id')
+                sub = r.get('subcategoria', 'General')
+                resumen = escape_markdown(r.get('resumen', ''))
+                preview_msg += f"• `ID {rid}`: *{sub}* - {resumen}\n"
+            if total > len(sample):
+                preview_msg += f"… y {total - len(sample)} más\n"
+        else:
+            preview_msg = "\n\n⚠️ **Atención:** No se encontraron ítems que coincidan (0 afectados)."
 
         await update.message.reply_text(
             f"⚠️ **Confirmación de Acción**\n\n¿Desea ejecutar la siguiente operación?\n`{sql}`{preview_msg}",
@@ -211,31 +396,42 @@ async def master_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def show_save_confirmation(update, context, data):
-    info_raw = data.get('save_data')
-    if not info_raw:
+    info_raw = data.get('save_data') or []
+    # Una ráfaga de mensajes puede devolver varios registros en save_data
+    items = [item for item in (info_raw if isinstance(info_raw, list) else [info_raw]) if item]
+    if not items:
         await update.message.reply_text("❌ Error: No se detectaron datos para guardar.")
         return
-
-    info = info_raw[0] if isinstance(info_raw, list) and len(info_raw) > 0 else info_raw
-    context.user_data['pending_save'] = info
+    context.user_data['pending_save'] = items
 
     ai_msg = data.get('user_reply', '')
     if ai_msg:
         await update.message.reply_text(f"🤖 Jarvis: {ai_msg}")
 
-    resumen = escape_markdown(info.get('summary') or "Sin resumen")
-    categoria = escape_markdown(info.get('category') or "GENERAL")
-    subcategoria = escape_markdown(info.get('subcategory') or "General")
-    tipo = escape_markdown(info.get('entry_type') or "NOTA")
-    fecha = escape_markdown(str(info.get('event_date') or "Indefinida"))
-
-    msg = (
-        f"📋 **Confirmar Registro**\n\n"
-        f"📂 **{categoria}** › _{subcategoria}_\n"
-        f"🏷️ **Tipo:** {tipo}\n"
-        f"📝 **Nota:** {resumen}\n"
-        f"📅 **Fecha:** {fecha}"
-    )
+    if len(items) == 1:
+        info = items[0]
+        resumen = escape_markdown(info.get('summary') or "Sin resumen")
+        categoria = escape_markdown(info.get('category') or "GENERAL")
+        subcategoria = escape_markdown(info.get('subcategory') or "General")
+        tipo = escape_markdown(info.get('entry_type') or "NOTA")
+        fecha = escape_markdown(str(info.get('event_date') or "Indefinida"))
+
+        msg = (
+            f"📋 **Confirmar Registro**\n\n"
+            f"📂 **{categoria}** › _{subcategoria}_\n"
+            f"🏷️ **Tipo:** {tipo}\n"
+            f"📝 **Nota:** {resumen}\n"
+            f"📅 **Fecha:** {fecha}"
+        )
+    else:
+        msg = f"📋 **Confirmar {len(items)} Registros**"
+        for i, info in enumerate(items, 1):
+            msg += (
+                f"\n\n{i}. 📂 **{escape_markdown(info.get('category') or 'GENERAL')}** › "
+                f"_{escape_markdown(info.get('subcategory') or 'General')}_ ({escape_markdown(info.get('entry_type') or 'NOTA')})\n"
+                f"📝 {escape_markdown(info.get('summary') or 'Sin resumen')}\n"
+                f"📅 {escape_markdown(str(info.get('event_date') or 'Indefinida'))}"
+            )
 
     keyboard = [[
         InlineKeyboardButton("✅ Confirmar", callback_data="save"),
@@ -256,22 +452,33 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or update.effective_user.first_name
 
     if query.data == "save":
-        item = context.user_data.get('pending_save')
-        if item:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO agenda_personal
-                (telegram_user_id, username, categoria, subcategoria, tipo_entrada, fecha_creacion, resumen, contenido_completo, fecha_evento, datos_extra, estado)
-                VALUES (%s, %s, %s, %s, %s, NOW(), %s, %s, %s, %s, 'APPROVED')
-                RETURNING id
-            """, (user_id, username, item.get('category'), item.get('subcategory'), item.get('entry_type'),
-                  item['summary'], item.get('full_content'), item.get('event_date'), Json(item.get('extra_data'))))
-            new_id = cur.fetchone()[0]
-            conn.commit()
-            conn.close()
-            await query.edit_message_text(f"✅ Guardado (ID: {new_id})")
+        items = context.user_data.get('pending_save')
+        if items:
+            new_ids = await save_entries(user_id, username, items)
+            if len(new_ids) == 1:
+                await query.edit_message_text(f"✅ Guardado (ID: {new_ids[0]})")
+            else:
+                await query.edit_message_text(f"✅ Guardados {len(new_ids)} registros (IDs: {', '.join(map(str, new_ids))})")
             context.user_data.pop('pending_save', None)
+            dated = [new_id for new_id, item in zip(new_ids, items) if item.get('event_date')]
+            if len(dated) == 1:
+                await reminders.notify_agenda_changed(record_id=dated[0])
+            elif dated:
+                await reminders.notify_agenda_changed(telegram_user_id=user_id)
+    elif query.data.startswith("page:"):
+        _, token, page_num = query.data.split(":")
+        page_num = int(page_num)
+        state = context.chat_data.get('results')
+        page = await get_results_page(context, page_num) if state and state['token'] == token else None
+        if not page or not page[0]:
+            await query.edit_message_text("ℹ️ La búsqueda expiró. Vuelve a consultar.")
+            return
+        text, has_next = page
+        markup = results_keyboard(token, page_num, has_next)
+        try:
+            await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
+        except Exception:
+            await query.edit_message_text(strip_markdown(text), reply_markup=markup)
     elif query.data == "edit":
         context.user_data['state'] = 'WAITING_EDIT'
         await query.edit_message_text("✍️ Por favor, escriba los cambios o la nueva información:")
@@ -281,5 +488,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data == "exec_sql":
         sql = context.user_data.get('pending_sql')
         if sql:
-            res = await execute_sql(sql)
+            res = await execute_guarded_sql(sql, user_id)
+            if res is None:
+                await query.edit_message_text("❌ La operación fue rechazada o falló. Revisa los logs.")
+                return
             await query.edit_message_text(f"✅ Acción completada con éxito. ({res} filas afectadas)")
+            await reminders.notify_agenda_changed(telegram_user_id=user_id)
@@ -0,0 +1,51 @@
+"""Importa o actualiza usuarios desde un CSV en lotes transaccionales.
+
+El CSV debe tener encabezado con las columnas telegram_user_id, username y nombre.
+
+    python import_users.py usuarios.csv --batch-size 1000
+"""
+import csv
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+load_dotenv()
+
+from config import logger
+from db import init_pool, close_pool, bulk_register_users
+from migrations import migrate
+
+
+def read_users(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                telegram_user_id = int(row['telegram_user_id'])
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Línea {line} ignorada: telegram_user_id inválido")
+                continue
+            yield telegram_user_id, row.get('username') or None, row.get('nombre') or None
+
+
+async def main(path, batch_size):
+    migrate()
+    await init_pool()
+    try:
+        started = time.perf_counter()
+        inserted, updated = await bulk_register_users(read_users(path), batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        total = inserted + updated
+        logger.info(
+            f"Importación completa: {inserted} nuevos, {updated} actualizados en {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} usuarios/s)"
+        )
+    finally:
+        await close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Importa usuarios desde un CSV")
+    parser.add_argument('csv_path')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.csv_path, args.batch_size))
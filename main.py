@@ -1,18 +1,143 @@
+import time
+_BOOT_STARTED = time.perf_counter()  # antes de cualquier import pesado, para medir el arranque en frío
+
 import os
+import signal
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 
 from config import logger
-from db import init_db
-from handlers import start, master_handler, button_callback, check_reminders
+from db import init_pool, close_pool, guard_stats
+from migrations import migrate, check_schema, MigrationError
+from handlers import start, broadcast, master_handler, button_callback, check_reminders, send_reminder, REMINDER_INTERVALS
+from reminders import start_scheduler, stop_scheduler
+from concurrency import PerUserUpdateProcessor
+from metrics import InstrumentedRequest, stage_seconds, register_collector, start_metrics_server, stop_metrics_server
+from router import router
+from ai import usage_stats, response_cache
+from ai_scheduler import ai_scheduler
+from delivery import delivery_engine
+from cache import user_cache
+from category_index import category_indexes
+from persistence import build_persistence
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
+# Solo los tipos que atienden los handlers: Telegram no envía (ni cobra latencia por) el resto
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+async def post_init(application):
+    await init_pool()
+    register_collector('router', lambda: router.stats)
+    register_collector('ai_usage', lambda: usage_stats)
+    register_collector('ai_cache', lambda: {**response_cache.stats, 'hit_ratio': response_cache.hit_ratio()})
+    register_collector('sql_guard', lambda: guard_stats)
+    register_collector('user_cache', user_cache.stats)
+    register_collector('category_index', category_indexes.stats)
+    register_collector('ai_scheduler', ai_scheduler.snapshot)
+    register_collector('delivery', delivery_engine.snapshot)
+    if application.persistence is not None:
+        register_collector('conversation_state', application.persistence.snapshot)
+    await start_metrics_server()
+
+    async def deliver(event, label):
+        await send_reminder(application.bot, event, label)
+
+    await start_scheduler(deliver, [minutes for minutes, _ in REMINDER_INTERVALS])
+    if response_cache.backend is not None:
+        application.create_task(response_cache.backend.purge_expired())
+
+    startup = time.perf_counter() - _BOOT_STARTED
+    stage_seconds.observe(startup, stage='startup')
+    logger.info(f"Arranque en frío hasta el inicio del bot: {startup:.2f}s")
+
+
+def prepare_schema():
+    """Aplica las migraciones pendientes o, con MIGRATE_ON_START=0, solo verifica la versión."""
+    started = time.perf_counter()
+    try:
+        if os.getenv('MIGRATE_ON_START', '1') == '1':
+            version = migrate()
+        else:
+            version = check_schema()
+    except MigrationError as e:
+        raise SystemExit(str(e))
+    logger.info(f"Esquema en versión {version} ({time.perf_counter() - started:.2f}s)")
+
+
+async def post_shutdown(application):
+    await stop_metrics_server()
+    await stop_scheduler()
+    await ai_scheduler.stop()
+    await close_pool()
+
+
+def add_handlers(application):
+    """Handlers y jobs del bot; también los usa el benchmark (bench/run.py)."""
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(MessageHandler((filters.TEXT | filters.PHOTO | filters.VOICE) & (~filters.COMMAND), master_handler))
+    application.add_handler(CallbackQueryHandler(button_callback))
+    application.job_queue.run_repeating(check_reminders, interval=int(os.getenv('REMINDER_LEADER_CHECK_SECONDS', '30')), first=30)
+
+
+async def run_worker(application):
+    """Modo worker: sin polling, solo jobs y entrega de recordatorios (coordinados por Postgres)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    try:
+        await stop.wait()
+    finally:
+        # Mismo orden que run_polling: shutdown() escribe el estado persistido antes de cerrar el pool
+        await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+
 if __name__ == '__main__':
-    init_db()
-    app = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(MessageHandler((filters.TEXT | filters.PHOTO | filters.VOICE) & (~filters.COMMAND), master_handler))
-    app.add_handler(CallbackQueryHandler(button_callback))
-    app.job_queue.run_repeating(check_reminders, interval=30, first=10)
-    print("🚀 JARVIS PROFESSIONAL SYSTEM RUNNING...")
-    app.run_polling()
+    if os.getenv('TELEGRAM_MODE') == 'webhook' and not os.getenv('TELEGRAM_WEBHOOK_SECRET'):
+        raise SystemExit("TELEGRAM_WEBHOOK_SECRET es obligatorio en modo webhook")
+    prepare_schema()
+    builder = (
+        ApplicationBuilder()
+        .token(os.getenv("TELEGRAM_TOKEN"))
+        .request(InstrumentedRequest(connection_pool_size=int(os.getenv('TELEGRAM_POOL_SIZE', '64'))))
+        .concurrent_updates(PerUserUpdateProcessor(
+            int(os.getenv('MAX_CONCURRENT_UPDATES', '32')),
+            max_pending_per_user=int(os.getenv('MAX_PENDING_PER_USER', '20')),
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    persistence = build_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    app = builder.build()
+    add_handlers(app)
+    if os.getenv('BOT_ROLE', 'bot') == 'worker':
+        print("🛠️ JARVIS WORKER RUNNING...")
+        asyncio.run(run_worker(app))
+    elif os.getenv('TELEGRAM_MODE', 'polling') == 'webhook':
+        # Servidor HTTP embebido (tornado) detrás del reverse proxy; Telegram envía cada
+        # update con el header X-Telegram-Bot-Api-Secret-Token, que PTB valida.
+        webhook_path = os.getenv('TELEGRAM_WEBHOOK_PATH', 'telegram')
+        print("🚀 JARVIS PROFESSIONAL SYSTEM RUNNING (webhook)...")
+        app.run_webhook(
+            listen=os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443')),
+            url_path=webhook_path,
+            webhook_url=f"{os.getenv('TELEGRAM_WEBHOOK_URL', '').rstrip('/')}/{webhook_path}",
+            secret_token=os.getenv('TELEGRAM_WEBHOOK_SECRET'),
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        print("🚀 JARVIS PROFESSIONAL SYSTEM RUNNING...")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
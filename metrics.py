@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+
+from telegram.request import HTTPXRequest
+
+from config import logger
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+_registry = {}
+_collectors = []
+
+
+def counter(name, help_text):
+    if name not in _registry:
+        _registry[name] = Counter(name, help_text)
+    return _registry[name]
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    if name not in _registry:
+        _registry[name] = Histogram(name, help_text, buckets)
+    return _registry[name]
+
+
+def register_collector(prefix, fn):
+    """Expone como gauges los valores numéricos del dict que retorna fn() (ej. Counters existentes)."""
+    _collectors.append((prefix, fn))
+
+
+stage_seconds = histogram('jarvis_stage_seconds', 'Duración de cada etapa del procesamiento')
+telegram_seconds = histogram('jarvis_telegram_request_seconds', 'Duración de las llamadas a la Bot API de Telegram')
+errors_total = counter('jarvis_errors_total', 'Errores por etapa')
+
+
+def timed(stage):
+    """Decorador para corrutinas: registra su duración en jarvis_stage_seconds{stage=...}."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage_seconds.time(stage=stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API por método (sendMessage, editMessageText...)."""
+
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        with telegram_seconds.time(method=method):
+            try:
+                return await super().do_request(url, *args, **kwargs)
+            except Exception:
+                errors_total.inc(stage=f"telegram_{method}")
+                raise
+
+
+def render():
+    lines = []
+    for metric in _registry.values():
+        lines += metric.render()
+    for prefix, fn in _collectors:
+        try:
+            values = fn()
+        except Exception as e:
+            logger.error(f"Error en collector {prefix}: {e}")
+            continue
+        name = f"jarvis_{prefix}"
+        lines += [f"# TYPE {name} gauge"]
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                lines.append(f'{name}{{key="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors='ignore').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body, status = render().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+_server = None
+
+
+async def start_metrics_server():
+    """Servidor HTTP local con /metrics en formato Prometheus. METRICS_PORT=0 lo desactiva."""
+    global _server
+    port = int(os.getenv('METRICS_PORT', '9100'))
+    if not port:
+        return None
+    host = os.getenv('METRICS_HOST', '127.0.0.1')
+    _server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"Métricas en http://{host}:{port}/metrics")
+    return _server
+
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,284 @@
+"""Migraciones versionadas del esquema.
+
+El bot las aplica al arrancar (MIGRATE_ON_START=1) o se ejecutan por separado:
+
+    python migrations.py            # aplica las pendientes
+    python migrations.py --status   # muestra la versión actual y las pendientes
+"""
+import os
+import sys
+import time
+import argparse
+
+import psycopg2.errors
+from dotenv import load_dotenv
+
+from config import logger
+from db import get_db_connection
+
+
+MIGRATION_LOCK_KEY = 726002
+MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv('MIGRATION_LOCK_TIMEOUT_MS', '5000'))
+
+# (versión, nombre, SQL) en orden. Solo se agregan pasos al final; todos son idempotentes
+# para poder aplicarse sobre bases creadas con el antiguo init_db().
+MIGRATIONS = [
+    # Tablas principales y columnas agregadas a bases anteriores
+    (1, "tablas_base", """
+        CREATE TABLE IF NOT EXISTS agenda_personal (
+            id SERIAL PRIMARY KEY,
+            telegram_user_id BIGINT,
+            username VARCHAR(100),
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            categoria VARCHAR(50),
+            subcategoria VARCHAR(100),
+            tipo_entrada VARCHAR(50),
+            resumen TEXT,
+            contenido_completo TEXT,
+            fecha_evento TIMESTAMP,
+            datos_extra JSONB,
+            estado VARCHAR(20) DEFAULT 'Open'
+        );
+
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            telegram_user_id BIGINT UNIQUE NOT NULL,
+            username VARCHAR(100),
+            nombre VARCHAR(200),
+            fecha_registro TIMESTAMP DEFAULT NOW(),
+            estado VARCHAR(20) DEFAULT 'ACTIVO'
+        );
+
+        CREATE TABLE IF NOT EXISTS categorias_agenda (
+            id SERIAL PRIMARY KEY,
+            telegram_user_id BIGINT NOT NULL,
+            username VARCHAR(100),
+            categoria VARCHAR(50) NOT NULL,
+            subcategoria VARCHAR(100) NOT NULL,
+            estado VARCHAR(20) DEFAULT 'ACTIVO'
+        );
+
+        ALTER TABLE agenda_personal ADD COLUMN IF NOT EXISTS username VARCHAR(100);
+        ALTER TABLE agenda_personal ADD COLUMN IF NOT EXISTS tipo_entrada VARCHAR(50);
+        ALTER TABLE agenda_personal ADD COLUMN IF NOT EXISTS notificaciones_enviadas JSONB DEFAULT '[]'::jsonb;
+        ALTER TABLE categorias_agenda ADD COLUMN IF NOT EXISTS telegram_user_id BIGINT;
+    """),
+    # Índices según las consultas reales del bot
+    (2, "indices_agenda", """
+        CREATE INDEX IF NOT EXISTS idx_agenda_user_cat_fecha
+            ON agenda_personal (telegram_user_id, categoria, fecha_evento);
+
+        CREATE INDEX IF NOT EXISTS idx_agenda_fecha_evento_abiertos
+            ON agenda_personal (fecha_evento)
+            WHERE estado <> 'Closed';
+    """),
+    # Búsquedas ILIKE '%termino%' (requiere pg_trgm; si no hay permisos se omite)
+    (3, "indices_trigram", """
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+                RAISE NOTICE 'pg_trgm no disponible; se omiten índices trigram';
+            END;
+
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_agenda_categoria_trgm
+                    ON agenda_personal USING gin (categoria gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_agenda_subcategoria_trgm
+                    ON agenda_personal USING gin (subcategoria gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_agenda_resumen_trgm
+                    ON agenda_personal USING gin (resumen gin_trgm_ops);
+            END IF;
+        END $$;
+    """),
+    # Unicidad de categorías por usuario (para que ON CONFLICT DO NOTHING deduplique)
+    (4, "categorias_unicas", """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_categorias_usuario_cat_sub') THEN
+                DELETE FROM categorias_agenda a
+                USING categorias_agenda b
+                WHERE a.telegram_user_id = b.telegram_user_id
+                  AND a.categoria = b.categoria
+                  AND a.subcategoria = b.subcategoria
+                  AND a.id > b.id;
+
+                ALTER TABLE categorias_agenda
+                    ADD CONSTRAINT uq_categorias_usuario_cat_sub UNIQUE (telegram_user_id, categoria, subcategoria);
+            END IF;
+        END $$;
+    """),
+    # Cache persistente de respuestas de la IA
+    (5, "cache_respuestas_ia", """
+        CREATE TABLE IF NOT EXISTS ai_response_cache (
+            cache_key VARCHAR(64) PRIMARY KEY,
+            response JSONB NOT NULL,
+            latency REAL DEFAULT 0,
+            expires_at TIMESTAMP NOT NULL
+        );
+    """),
+    # Búsqueda full-text: columna tsvector generada (español, sin tildes) con índice GIN.
+    # agenda_unaccent envuelve unaccent() como IMMUTABLE, requisito de las columnas generadas;
+    # sin la extensión queda como identidad. Con btree_gin el índice incluye telegram_user_id.
+    (6, "busqueda_full_text", """
+        DO $$
+        DECLARE
+            ext_schema TEXT;
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS unaccent;
+            EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+                RAISE NOTICE 'unaccent no disponible; la búsqueda distinguirá tildes';
+            END;
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS btree_gin;
+            EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+                RAISE NOTICE 'btree_gin no disponible; el índice de búsqueda no incluye telegram_user_id';
+            END;
+
+            IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'agenda_unaccent') THEN
+                SELECT n.nspname INTO ext_schema
+                FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+                WHERE e.extname = 'unaccent';
+
+                EXECUTE format(
+                    'CREATE FUNCTION agenda_unaccent(text) RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS %L',
+                    CASE WHEN ext_schema IS NULL THEN 'SELECT $1'
+                         ELSE format('SELECT %I.unaccent(%L::regdictionary, $1)', ext_schema, ext_schema || '.unaccent')
+                    END
+                );
+            END IF;
+
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='agenda_personal' AND column_name='busqueda') THEN
+                ALTER TABLE agenda_personal ADD COLUMN busqueda tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('spanish', agenda_unaccent(coalesce(categoria, '') || ' ' || coalesce(subcategoria, ''))), 'A') ||
+                    setweight(to_tsvector('spanish', agenda_unaccent(coalesce(resumen, ''))), 'B') ||
+                    setweight(to_tsvector('spanish', agenda_unaccent(coalesce(contenido_completo, ''))), 'C')
+                ) STORED;
+            END IF;
+
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'btree_gin') THEN
+                CREATE INDEX IF NOT EXISTS idx_agenda_busqueda
+                    ON agenda_personal USING gin (telegram_user_id, busqueda);
+            ELSE
+                CREATE INDEX IF NOT EXISTS idx_agenda_busqueda
+                    ON agenda_personal USING gin (busqueda);
+            END IF;
+        END $$;
+    """),
+    # Estado de conversación (context.user_data) persistido por PostgresPersistence
+    (7, "estado_conversacion", """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            telegram_user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at);
+    """),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+class MigrationError(Exception):
+    """El esquema de la base no está en la versión que requiere el código."""
+
+
+def current_version(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    finally:
+        conn.rollback()
+        cur.close()
+
+
+def migrate():
+    """Aplica las migraciones pendientes y retorna la versión final.
+
+    Con el esquema al día solo cuesta una consulta y no toma locks. Si hay pasos
+    pendientes, un advisory lock serializa a las réplicas que arrancan a la vez: la
+    primera migra y las demás esperan y encuentran la versión ya actualizada. Cada
+    paso corre en su propia transacción con lock_timeout, para fallar rápido en vez
+    de bloquear tablas en uso durante un despliegue.
+    """
+    conn = get_db_connection()
+    try:
+        version = current_version(conn)
+        if version >= LATEST_VERSION:
+            return version
+
+        cur = conn.cursor()
+        # Lock de sesión: se libera al cerrar la conexión, incluso si un paso falla
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        conn.commit()
+
+        version = current_version(conn)
+        for number, name, sql in MIGRATIONS:
+            if number <= version:
+                continue
+            started = time.perf_counter()
+            try:
+                cur.execute("SELECT set_config('lock_timeout', %s, true)", (str(MIGRATION_LOCK_TIMEOUT_MS),))
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (number, name))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise MigrationError(f"Migración {number} ({name}) falló: {e}") from e
+            logger.info(f"Migración {number} ({name}) aplicada en {time.perf_counter() - started:.2f}s")
+            version = number
+        cur.close()
+        return version
+    finally:
+        conn.close()
+
+
+def check_schema():
+    """Lanza MigrationError si faltan migraciones (para arrancar con MIGRATE_ON_START=0)."""
+    conn = get_db_connection()
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if version < LATEST_VERSION:
+        raise MigrationError(f"Esquema en versión {version}, se requiere {LATEST_VERSION}: ejecuta python migrations.py")
+    return version
+
+
+def status():
+    conn = get_db_connection()
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    print(f"Versión actual: {version} (última: {LATEST_VERSION})")
+    for number, name, _ in MIGRATIONS:
+        if number > version:
+            print(f"  pendiente: {number} {name}")
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de Jarvis")
+    parser.add_argument('--status', action='store_true', help="muestra la versión sin aplicar cambios")
+    args = parser.parse_args()
+    if args.status:
+        status()
+    else:
+        try:
+            logger.info(f"Esquema en versión {migrate()}")
+        except MigrationError as e:
+            logger.error(str(e))
+            sys.exit(1)
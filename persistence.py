@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import asyncio
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from metrics import counter, histogram
+from db import load_conversation_state, save_conversation_states
+
+
+flush_seconds = histogram('jarvis_state_flush_seconds', 'Duración de cada escritura por lotes del estado de conversación')
+flushed_users_total = counter('jarvis_state_flushed_users_total', 'Usuarios escritos o borrados en conversation_state')
+
+PURGE_INTERVAL = 600.0
+
+
+class PostgresPersistence(BasePersistence):
+    """Persistencia de context.user_data (state, pending_save, pending_sql) en Postgres.
+
+    - Carga perezosa: get_user_data() arranca vacío y cada usuario se lee de la base
+      con su primer update (refresh_user_data).
+    - Write-behind: update_user_data() solo anota al usuario; un flush diferido
+      `flush_delay` segundos escribe a todos los anotados en un único upsert JSONB.
+    - TTL: el estado sin actividad por más de `ttl` segundos se descarta, en memoria
+      y en la base.
+    - Tras `reload_after` segundos sin actividad en esta réplica el usuario se vuelve
+      a leer, por si otra réplica atendió sus mensajes mientras tanto.
+
+    chat_data (páginas de resultados) y bot_data no se persisten.
+    """
+
+    def __init__(self, ttl=86400.0, flush_delay=0.2, reload_after=300.0, update_interval=1.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self.reload_after = reload_after
+        self._refs = {}
+        self._dirty = set()
+        self._flushing = set()
+        self._last_seen = {}
+        self._flush_handle = None
+        self._flush_task = None
+        self._failures = 0
+        self._last_purge = 0.0
+
+    def snapshot(self):
+        return {'users': len(self._last_seen), 'dirty': len(self._dirty), 'flush_failures': self._failures}
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        now = time.monotonic()
+        last = self._last_seen.get(user_id)
+        self._last_seen[user_id] = now
+        if last is not None:
+            idle = now - last
+            if idle <= self.reload_after:
+                return
+            if idle > self.ttl:
+                # Confirmación abandonada: se descarta aunque siga en memoria
+                if user_data:
+                    user_data.clear()
+                    await self.update_user_data(user_id, user_data)
+                return
+        # Con cambios locales aún sin escribir, la copia en memoria es la más nueva
+        if user_id in self._dirty or user_id in self._flushing:
+            return
+
+        data = await load_conversation_state(user_id)
+        if data is None:
+            # La base falló: se reintenta con el próximo update
+            self._last_seen.pop(user_id, None)
+            return
+        user_data.clear()
+        user_data.update(data)
+
+    async def update_user_data(self, user_id, data):
+        # Camino caliente: solo una referencia al dict y una marca; se serializa en el flush
+        self._refs[user_id] = data
+        self._dirty.add(user_id)
+        if self._flush_handle is None and self._flush_task is None:
+            self._schedule(self.flush_delay)
+
+    async def drop_user_data(self, user_id):
+        self._refs.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        self._dirty.add(user_id)
+        if self._flush_handle is None and self._flush_task is None:
+            self._schedule(self.flush_delay)
+
+    async def flush(self):
+        """Escribe lo pendiente (lo llama Application.shutdown)."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            # _flush_done pudo programar otro flush; lo pendiente se escribe ahora
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+        if self._dirty:
+            await self._write()
+
+    def _schedule(self, delay):
+        self._flush_handle = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self._write())
+        self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._flush_task = None
+        if self._dirty and self._flush_handle is None:
+            # Tras un fallo se espera más para no insistir contra una base caída
+            self._schedule(self.flush_delay if not self._failures else min(30.0, 2.0 ** self._failures))
+
+    async def _write(self):
+        dirty, self._dirty = self._dirty, set()
+        self._flushing = dirty
+        refs = {user_id: self._refs.pop(user_id, None) for user_id in dirty}
+        rows = [(user_id, json.dumps(data, default=str), self.ttl) for user_id, data in refs.items() if data]
+        deleted = [user_id for user_id, data in refs.items() if not data]
+
+        now = time.monotonic()
+        purge = now - self._last_purge >= PURGE_INTERVAL
+        started = time.perf_counter()
+        try:
+            ok = await save_conversation_states(rows, deleted, purge_expired=purge)
+        finally:
+            self._flushing = set()
+        if not ok:
+            self._failures += 1
+            # Se reencolan sin pisar los cambios que llegaron durante el flush
+            for user_id, data in refs.items():
+                if user_id not in self._dirty:
+                    self._dirty.add(user_id)
+                    if data is not None:
+                        self._refs[user_id] = data
+            return
+        self._failures = 0
+        flush_seconds.observe(time.perf_counter() - started)
+        flushed_users_total.inc(len(dirty))
+        if purge:
+            self._last_purge = now
+            self._last_seen = {uid: seen for uid, seen in self._last_seen.items() if now - seen <= self.ttl}
+
+    # Solo se persiste user_data
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def build_persistence():
+    """PostgresPersistence configurada por entorno, o None con CONVERSATION_STATE_PERSIST=0."""
+    if os.getenv('CONVERSATION_STATE_PERSIST', '1') != '1':
+        return None
+    return PostgresPersistence(
+        ttl=float(os.getenv('CONVERSATION_STATE_TTL', '86400')),
+        flush_delay=int(os.getenv('CONVERSATION_STATE_FLUSH_MS', '200')) / 1000,
+        reload_after=float(os.getenv('CONVERSATION_STATE_RELOAD_SECONDS', '300')),
+        update_interval=float(os.getenv('CONVERSATION_STATE_UPDATE_INTERVAL', '1')),
+    )
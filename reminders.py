@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+from functools import partial
+
+from config import logger
+from metrics import timed
+from delivery import Delivery, delivery_engine
+import db
+from db import get_reminder_schedule, claim_reminders, release_reminders, AdvisoryLeader, AGENDA_CHANNEL
+
+
+class ReminderScheduler:
+    """Planificador en memoria de alertas de agenda_personal.
+
+    Carga los eventos del horizonte próximo en un heap ordenado por la hora exacta
+    de cada alerta (60m/5m/1m antes) y duerme hasta la siguiente. Los cambios en la
+    agenda se aplican con refresh(); reconcile() recarga el horizonte completo para
+    corregir cualquier desvío. Las alertas cuyo envío falla se vuelven a programar con
+    backoff exponencial (hasta `max_retries` veces) mientras el evento no haya empezado.
+    """
+
+    def __init__(self, send_callback, intervals, horizon_minutes=60, grace_seconds=60,
+                 max_retries=5, retry_base=15.0, retry_cap=300.0):
+        self.send_callback = send_callback
+        self.intervals = list(intervals)
+        self.horizon_minutes = horizon_minutes
+        self.grace_seconds = grace_seconds
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self._heap = []
+        self._entries = {}
+        self._retries = {}
+        self._in_flight = set()
+        self._deliveries = set()
+        self._changed = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        await self.reconcile()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Scheduler de recordatorios iniciado ({len(self._entries)} alertas programadas)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Las alertas ya reclamadas terminan de enviarse aunque se pierda el liderazgo
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    @timed('reminder_reconcile')
+    async def reconcile(self):
+        """Recarga todas las alertas del horizonte desde la base de datos."""
+        rows = await get_reminder_schedule(self.intervals, self.horizon_minutes)
+        if rows is None:
+            return
+        self._entries.clear()
+        self._heap.clear()
+        self._load(rows)
+        # Reintentos de alertas que ya no existen (evento borrado o reprogramado)
+        self._retries = {key: retry for key, retry in self._retries.items()
+                         if key in self._entries or key in self._in_flight}
+
+    @timed('reminder_refresh')
+    async def refresh(self, telegram_user_id=None, record_id=None):
+        """Recarga solo las alertas de un usuario o de un registro tras SAVE/UPDATE/DELETE."""
+        rows = await get_reminder_schedule(
+            self.intervals, self.horizon_minutes, telegram_user_id=telegram_user_id, record_id=record_id
+        )
+        if rows is None:
+            return
+        for key, (_, event, _) in list(self._entries.items()):
+            if (record_id is not None and event['id'] == record_id) or \
+                    (record_id is None and event['telegram_user_id'] == telegram_user_id):
+                del self._entries[key]
+        self._load(rows)
+
+    def _load(self, rows):
+        now = asyncio.get_running_loop().time()
+        for event in rows:
+            sent = set(event.get('notificaciones_enviadas') or [])
+            for minutes in self.intervals:
+                label = f"{minutes}m"
+                if label in sent:
+                    continue
+                starts_at = now + event['seconds_until']
+                fire_at = starts_at - minutes * 60
+                key = (event['id'], label)
+                if key in self._in_flight:
+                    continue
+                retry = self._retries.get(key)
+                if retry is not None:
+                    # Reclamo liberado tras un envío fallido: se mantiene aunque su hora ya pasó
+                    if now >= starts_at:
+                        del self._retries[key]
+                        continue
+                    fire_at = retry[1]
+                elif fire_at < now - self.grace_seconds:
+                    continue
+                self._entries[key] = (fire_at, event, starts_at)
+                heapq.heappush(self._heap, (fire_at, event['id'], label))
+        self._changed.set()
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, record_id, label = heapq.heappop(self._heap)
+            entry = self._entries.get((record_id, label))
+            # Entradas obsoletas (reprogramadas o eliminadas) se descartan
+            if entry is None or entry[0] != fire_at:
+                continue
+            del self._entries[(record_id, label)]
+            due.append((entry[1], label, fire_at, entry[2]))
+        return due
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._changed.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - loop.time())
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            due = self._pop_due(loop.time())
+            if not due:
+                continue
+            # El envío corre aparte para que una ráfaga larga no retrase las alertas siguientes
+            keys = {(event['id'], label) for event, label, _, _ in due}
+            self._in_flight.update(keys)
+            task = asyncio.create_task(self._deliver(due))
+            self._deliveries.add(task)
+            task.add_done_callback(partial(self._delivered, keys))
+
+    def _delivered(self, keys, task):
+        self._deliveries.discard(task)
+        self._in_flight.difference_update(keys)
+
+    @timed('reminder_sweep')
+    async def _deliver(self, due):
+        # La alerta se reclama en Postgres antes de enviarla: con varias réplicas
+        # solo una la obtiene. Las que fallan por errores transitorios se liberan para
+        # reintentarlas; las rechazadas o que llegarían después del evento se descartan.
+        claimed = set(await claim_reminders([(event['id'], label) for event, label, _, _ in due]))
+        # fire_at/starts_at usan loop.time(), que es el reloj monotónico del DeliveryEngine
+        deliveries = [
+            Delivery((event['id'], label), event['telegram_user_id'], partial(self.send_callback, event, label),
+                     due_at=fire_at, expires_at=starts_at)
+            for event, label, fire_at, starts_at in due if (event['id'], label) in claimed
+        ]
+        for event, label, _, _ in due:
+            if (event['id'], label) not in claimed:
+                self._retries.pop((event['id'], label), None)
+        if not deliveries:
+            return
+        report = await delivery_engine.deliver(deliveries, kind='reminder')
+        logger.info(
+            f"Recordatorios: {len(report['sent'])} enviados, {len(report['failed'])} a reintentar, "
+            f"{len(report['dropped'])} descartados"
+        )
+        for key in report['sent'] + report['dropped']:
+            self._retries.pop(key, None)
+        await release_reminders(report['failed'])
+        self._reschedule(report['failed'], {(event['id'], label): (event, starts_at) for event, label, _, starts_at in due})
+
+    def _reschedule(self, keys, events):
+        """Vuelve a poner en el heap las alertas liberadas, con backoff exponencial acotado."""
+        now = asyncio.get_running_loop().time()
+        for key in keys:
+            event, starts_at = events[key]
+            attempt = self._retries.get(key, (0, None))[0] + 1
+            retry_at = now + min(self.retry_cap, self.retry_base * 2 ** (attempt - 1))
+            if attempt > self.max_retries or retry_at >= starts_at:
+                logger.error(f"Recordatorio {key[1]} del registro {key[0]} descartado tras {attempt} intentos")
+                self._retries.pop(key, None)
+                continue
+            self._retries[key] = (attempt, retry_at)
+            self._entries[key] = (retry_at, event, starts_at)
+            heapq.heappush(self._heap, (retry_at, key[0], key[1]))
+        if keys:
+            self._changed.set()
+
+
+REMINDER_LOCK_KEY = 726001
+RECONCILE_SECONDS = int(os.getenv('REMINDER_RECONCILE_SECONDS', '900'))
+
+scheduler = None
+_leader = None
+_config = {}
+_last_reconcile = 0.0
+_reader_fd = None
+_draining = False
+
+
+async def start_scheduler(send_callback, intervals):
+    """Registra cómo enviar alertas y, si esta réplica gana el liderazgo, arranca el scheduler."""
+    global _leader
+    _config.update(send_callback=send_callback, intervals=list(intervals))
+    _leader = AdvisoryLeader(REMINDER_LOCK_KEY, channel=AGENDA_CHANNEL)
+    await tick()
+
+
+async def tick():
+    """Chequeo periódico: mantiene o toma el liderazgo, aplica cambios notificados y reconcilia.
+
+    Solo la réplica líder mantiene el heap de alertas; las demás quedan en espera y
+    toman el relevo si el líder cae.
+    """
+    global scheduler, _last_reconcile
+    if _leader is None:
+        return
+    if not await _leader.ensure():
+        _unwatch_notifications()
+        if scheduler is not None:
+            await scheduler.stop()
+            scheduler = None
+        return
+
+    _watch_notifications()
+    if scheduler is None or not scheduler.running:
+        scheduler = ReminderScheduler(
+            _config['send_callback'],
+            _config['intervals'],
+            horizon_minutes=int(os.getenv('REMINDER_HORIZON_MINUTES', '60')),
+        )
+        await scheduler.start()
+        _last_reconcile = time.monotonic()
+    elif time.monotonic() - _last_reconcile >= RECONCILE_SECONDS:
+        await scheduler.reconcile()
+        _last_reconcile = time.monotonic()
+
+
+def _watch_notifications():
+    """Registra la conexión del líder en el event loop para procesar cada NOTIFY al llegar."""
+    global _reader_fd
+    fd = _leader.conn.fileno()
+    if fd == _reader_fd:
+        return
+    _unwatch_notifications()
+    asyncio.get_running_loop().add_reader(fd, _on_readable)
+    _reader_fd = fd
+
+
+def _on_readable():
+    # add_reader avisa mientras haya datos sin leer; basta una lectura en curso a la vez
+    if not _draining:
+        asyncio.ensure_future(_apply_notifications())
+
+
+def _unwatch_notifications():
+    global _reader_fd
+    if _reader_fd is not None:
+        asyncio.get_running_loop().remove_reader(_reader_fd)
+        _reader_fd = None
+
+
+async def _apply_notifications():
+    global _draining
+    if _leader is None:
+        return
+    _draining = True
+    try:
+        payloads = await _leader.drain_notifications()
+    finally:
+        _draining = False
+    for payload in payloads:
+        if scheduler is None or not scheduler.running:
+            return
+        change = json.loads(payload)
+        try:
+            await scheduler.refresh(telegram_user_id=change.get('telegram_user_id'), record_id=change.get('record_id'))
+        except Exception as e:
+            logger.error(f"Error refrescando recordatorios: {e}")
+
+
+async def stop_scheduler():
+    global scheduler, _leader
+    if scheduler is not None:
+        await scheduler.stop()
+        scheduler = None
+    if _leader is not None:
+        _unwatch_notifications()
+        await _leader.release()
+        _leader = None
+
+
+async def notify_agenda_changed(telegram_user_id=None, record_id=None):
+    """Avisa de un cambio en agenda_personal a la réplica líder (vía NOTIFY)."""
+    await db.notify_agenda_changed(telegram_user_id=telegram_user_id, record_id=record_id)
@@ -0,0 +1,116 @@
+import re
+from collections import Counter
+
+from config import logger
+from utils import normalize_text
+
+
+class IntentRule:
+    """Regla local: si `pattern` coincide con el texto normalizado, `build(match, user_id)`
+    retorna una respuesta con el mismo formato que process_with_ai. Con `question=True`
+    solo aplica si el texto original termina en '?' (la normalización quita los signos)."""
+
+    def __init__(self, name, pattern, build, question=False):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.build = build
+        self.question = question
+
+
+class IntentRouter:
+    """Resuelve localmente las peticiones frecuentes y deterministas sin llamar al LLM."""
+
+    def __init__(self, rules=None):
+        self.rules = list(rules or [])
+        self.stats = Counter()
+
+    def register(self, rule, first=False):
+        if first:
+            self.rules.insert(0, rule)
+        else:
+            self.rules.append(rule)
+
+    def route(self, text, user_id):
+        normalized = normalize_text(text)
+        question = (text or "").rstrip().endswith("?")
+        for rule in self.rules:
+            if rule.question and not question:
+                continue
+            match = rule.pattern.fullmatch(normalized)
+            if match:
+                self.stats['fast_path'] += 1
+                self.stats[f'rule:{rule.name}'] += 1
+                logger.info(f"Fast-path '{rule.name}' para user_id: {user_id}")
+                return rule.build(match, user_id)
+        self.stats['llm_fallback'] += 1
+        return None
+
+
+def _query(sql, params):
+    return {"intent": "QUERY", "sql_query": sql, "sql_params": params}
+
+
+def _search(terms):
+    return {"intent": "QUERY", "search_terms": terms}
+
+
+_PREFIX = r"(?:(?:por favor |porfa )?(?:muestrame|mostrar|muestra|ver|dame|listar|lista|cuales son|que|quiero ver) )?"
+
+DEFAULT_RULES = [
+    IntentRule(
+        "categorias",
+        _PREFIX + r"(?:mis |las )?categorias(?: tengo| que tengo)?",
+        lambda m, uid: _query(
+            "SELECT DISTINCT categoria FROM categorias_agenda WHERE telegram_user_id = %s AND estado = 'ACTIVO' ORDER BY categoria ASC",
+            (uid,)
+        ),
+    ),
+    IntentRule(
+        "subcategorias",
+        _PREFIX + r"(?:mis |las )?(?:subcategorias|proyectos) (?:de|del|en) (?:la |el )?(?P<categoria>[\w ]+?)",
+        lambda m, uid: _query(
+            "SELECT subcategoria FROM categorias_agenda WHERE telegram_user_id = %s AND TRIM(categoria) ILIKE %s AND estado = 'ACTIVO' ORDER BY subcategoria ASC",
+            (uid, f"%{m.group('categoria').strip()}%")
+        ),
+    ),
+    # "Buscar pasaporte mañana" es una nota para guardar: sin "en mi agenda" solo se
+    # toma como búsqueda si es una pregunta
+    IntentRule(
+        "buscar",
+        r"(?:busca|buscar|buscame|encuentra|encontrar) en (?:mi |la )?agenda (?P<terms>.+)",
+        lambda m, uid: _search(m.group('terms')),
+    ),
+    IntentRule(
+        "buscar_pregunta",
+        r"(?:busca|buscar|buscame|encuentra|encontrar|me buscas|me encuentras) (?P<terms>.+)",
+        lambda m, uid: _search(m.group('terms')),
+        question=True,
+    ),
+    IntentRule(
+        "agenda_completa",
+        _PREFIX + r"(?:toda (?:mi |la )?agenda|mi agenda|la agenda|agenda completa|todo)",
+        lambda m, uid: _query(
+            "SELECT * FROM agenda_personal WHERE telegram_user_id = %s ORDER BY categoria ASC, fecha_evento ASC",
+            (uid,)
+        ),
+    ),
+    IntentRule(
+        "agenda_hoy",
+        _PREFIX + r"(?:tengo |hay )?(?:para |pendiente )?hoy|(?:mi )?agenda (?:de|para) hoy",
+        lambda m, uid: _query(
+            "SELECT * FROM agenda_personal WHERE telegram_user_id = %s AND fecha_evento::date = CURRENT_DATE ORDER BY categoria ASC, fecha_evento ASC",
+            (uid,)
+        ),
+    ),
+    IntentRule(
+        "agenda_manana",
+        _PREFIX + r"(?:tengo |hay )?(?:para |pendiente )?manana|(?:mi )?agenda (?:de|para) manana",
+        lambda m, uid: _query(
+            "SELECT * FROM agenda_personal WHERE telegram_user_id = %s AND fecha_evento::date = CURRENT_DATE + 1 ORDER BY categoria ASC, fecha_evento ASC",
+            (uid,)
+        ),
+    ),
+]
+
+
+router = IntentRouter(DEFAULT_RULES)
@@ -1,4 +1,9 @@
+import io
+import re
 import base64
+import unicodedata
+
+from PIL import Image, ImageOps
 
 
 def escape_markdown(text):
@@ -11,6 +16,27 @@ def escape_markdown(text):
     return text
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def prepare_image(image_bytes, max_edge=1536, quality=85, low_detail_max_edge=512):
+    """Redimensiona y recomprime una imagen en memoria para la API de visión.
+
+    Retorna (data_url, detail): la imagen JPEG en base64 lista para `image_url` y el
+    nivel de detalle ('low' si cabe en un solo tile de 512px, 'high' si no).
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        detail = "low" if max(img.size) <= low_detail_max_edge else "high"
+    encoded = base64.b64encode(buffer.getbuffer()).decode('ascii')
+    return f"data:image/jpeg;base64,{encoded}", detail
+
+
+def normalize_text(text):
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados."""
+    text = unicodedata.normalize('NFKD', text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[¿?¡!.,;:]", " ", text)
+    return " ".join(text.split())